@@ -1,6 +1,6 @@
 # encoding: UTF-8
 
-# To-dos : 多和空的收益分开计算！看到底是多仓亏了钱还是空仓亏了钱！
+# To-dos : 多和空的收益分开计算！看到底是多仓亏了钱还是空仓亏了钱！（已在按日统计结果中实现，见showDailyResult）
 
 '''
 本文件中包含的是CTA模块的回测引擎，回测引擎的API和CTA引擎一致，
@@ -10,7 +10,7 @@ from __future__ import division
 
 from datetime import datetime, timedelta
 from collections import OrderedDict
-from itertools import product
+from itertools import product, chain
 import multiprocessing
 import pymongo
 import numpy as np
@@ -24,6 +24,31 @@ from vnpy.trader.vtConstant import *
 from vnpy.trader.vtGateway import VtOrderData, VtTradeData
 
 from vnpy.trader.app.ctaStrategy.ctaBase import *
+from vnpy.trader.app.ctaStrategy.ctaLogger import CtaLogger, LOG_INFO, LOG_DISABLED
+from vnpy.trader.app.ctaStrategy.ctaBarCache import BarCache, sliceBarArrays, barDocsToArrays
+from vnpy.trader.app.ctaStrategy.ctaBarArray import (iterArrayBars, SharedBarDataset,
+                                                     resampleBarArrays, resampleAggregatedArrays,
+                                                     makeAggregatedBar)
+from vnpy.trader.app.ctaStrategy.ctaFileDataSource import FileDataSource
+from vnpy.trader.app.ctaStrategy.ctaOrderBook import LimitOrderBook, StopOrderBook
+from vnpy.trader.app.ctaStrategy.ctaTickStore import TickStore
+from vnpy.trader.app.ctaStrategy.ctaRunningMetrics import (RunningMetrics, checkStopConditions,
+                                                          STOPPED_TARGET_VALUE)
+from vnpy.trader.app.ctaStrategy.ctaTradeWriter import createTradeWriter, FORMAT_CSV, DEFAULT_BUFFER_SIZE
+from vnpy.trader.app.ctaStrategy.ctaReport import drawBacktestingResult, exportReport
+from vnpy.trader.app.ctaStrategy.ctaOptimizer import OptimizationPool
+from vnpy.trader.app.ctaStrategy.ctaParameterSearch import (SEARCH_GRID, SEARCH_RANDOM, SEARCH_LHS,
+                                                            sampleSettings, halvingWindows,
+                                                            rankResults, promoteCount)
+from vnpy.trader.app.ctaStrategy.ctaResultCache import (ResultCache, strategyFingerprint,
+                                                        directoryFingerprint, makeCacheKey, hashContent)
+from vnpy.trader.app.ctaStrategy.ctaMonteCarlo import runMonteCarlo, summarizeMonteCarlo, METHOD_SHUFFLE
+from vnpy.trader.app.ctaStrategy.ctaDailyResult import calculateDailyResult, calculateDailyStatistics
+from vnpy.trader.app.ctaStrategy.ctaTradeLedger import (TradeLedger, OrderLedger, LedgerDictView,
+                                                        LedgerTrade, LedgerOrder, DIRECTION_LIST)
+from vnpy.trader.app.ctaStrategy.ctaVectorBacktesting import makeSignalBars, simulateVectorTrades
+from vnpy.trader.app.ctaStrategy.ctaMongoReader import (MongoPrefetchReader, BarDecoder, decodeTick,
+                                                        loadContractInfo, BAR_PROJECTION, TICK_PROJECTION)
 
 
 ########################################################################
@@ -46,14 +71,18 @@ class BacktestingEngine(object):
         
         # 本地停止单字典
         # key为stopOrderID，value为stopOrder对象
-        self.stopOrderDict = {}             # 停止单撤销后不会从本字典中删除
         self.workingStopOrderDict = {}      # 停止单撤销后会从本字典中删除
+        self.stopOrderLedger = OrderLedger(STOPORDERPREFIX)     # 已触发或撤销的停止单记录
+        self.stopOrderDict = LedgerDictView(self.stopOrderLedger, self.workingStopOrderDict)    # 全部停止单的只读视图
+        self.stopOrderBook = StopOrderBook()    # 活动停止单按触发价排序的委托簿
         
         # 引擎类型为回测
         self.engineType = ENGINETYPE_BACKTESTING
 
         # 百分比pnl画图开关
         self.pnlPctToggle = False
+        self.showPlot = True        # 显示回测结果时是否绘图
+        self.reportFile = None      # 回测报告文件名，设置后不弹出图形界面，直接导出报告
         
         # 回测相关
         self.strategy = None        # 回测策略
@@ -74,35 +103,67 @@ class BacktestingEngine(object):
         self.dbCursor = None        # 数据库指针
         
         #self.historyData = []       # 历史数据的列表，回测用
-        self.initData = []          # 初始化用的数据
-        #self.backtestingData = []   # 回测用的数据
+        self.initData = []          # 初始化用的数据（迭代器，和回测数据共用同一个数据流）
+        self.backtestingData = None # 回测用的数据（迭代器，逐条生成数据对象）
+        self.dataStream = None      # 整个回测区间按时间排序的数据流
+        self.pendingData = None     # 初始化数据读取结束时取出的第一条回测数据
+        self.skippingInitData = False   # 是否正在跳过策略没有读取的初始化数据
+        self.markArrays = None      # 逐日盯市用的时间和收盘价列数据，以列数据载入时保存
         
         self.dbName = ''            # 回测数据库名
         self.symbol = ''            # 回测集合名
+
+        self.dataSource = None      # 本地文件数据源，设置后不再使用数据库
+        self.tickStore = None       # 压缩Tick存储，设置后Tick模式不再使用数据库
+        self.barCache = None        # K线列式缓存，为None时直接从数据库读取
+        self.reuseBar = False       # 缓存回放时是否复用同一个K线对象
+
+        self.prefetchBatchSize = 0  # 预读取的批大小，为0时不使用预读取
+        self.prefetchQueueSize = 4  # 最多预读取的批数
+
+        self.sharedDataPath = ''    # 多进程优化时父进程共享的K线数据集路径
+        self.sharedArrayData = None # 已挂载的共享数据集，(路径, 列数据字典, 合约信息字典)
+        
+        self.optimizationPool = None    # 多进程优化的常驻进程池
+        self.optimizationDataset = None # 进程池使用的共享数据集
+        self.resultCache = None         # 优化结果缓存，为None时不使用缓存
+
+        self.barGeneratorList = []  # 引擎预先聚合的大周期K线设置，(周期, 回调函数名, 偏移, 基础K线的回调函数名)
+        self.aggregatedBarDict = {} # 1分钟K线的位置：该K线走完时需要推送的大周期K线
         
         self.dataStartDate = None       # 回测数据开始日期，datetime对象
         self.dataEndDate = None         # 回测数据结束日期，datetime对象
         self.strategyStartDate = None   # 策略启动日期（即前面的数据用于初始化），datetime对象
         
-        self.limitOrderDict = OrderedDict()         # 限价单字典
         self.workingLimitOrderDict = OrderedDict()  # 活动限价单字典，用于进行撮合用
+        self.limitOrderLedger = OrderLedger()       # 已成交或撤销的限价单记录
+        self.limitOrderDict = LedgerDictView(self.limitOrderLedger, self.workingLimitOrderDict)  # 全部限价单的只读视图
+        self.limitOrderBook = LimitOrderBook()      # 活动限价单按价格排序的委托簿，用于快速定位会成交的委托
         self.limitOrderCount = 0                    # 限价单编号
         
         self.tradeCount = 0             # 成交编号
-        self.tradeDict = OrderedDict()  # 成交字典
+        self.tradeLedger = TradeLedger()                    # 成交记录
+        self.tradeDict = LedgerDictView(self.tradeLedger)   # 成交字典（只读视图，读取时才生成成交对象）
+        
+        self.logger = CtaLogger()       # 日志记录，读取时才格式化
         
-        self.logList = []               # 日志记录
+        self.runningMetrics = RunningMetrics()  # 回测过程中在线更新的统计指标
+        self.stopConditionList = []     # 提前终止回测的条件
+        self.stopReason = ''            # 回测提前终止的原因
         
         # 当前最新数据，用于模拟成交用
         self.tick = None
         self.bar = None
         self.dt = None      # 最新的时间
 
-        # 是否打印成交
+        # 是否在回测过程中逐笔写出交易结果
         self.writeTrade = False
+        self.tradeFormat = FORMAT_CSV                   # 交易结果的格式
+        self.tradeBufferSize = DEFAULT_BUFFER_SIZE      # 写出前缓冲的交易结果数量
+        self.tradeWriter = None
 
         # 存储分析文件的path
-        self.savepath = 'C:/Users/LZJF_02/Desktop/BacktestRA/'
+        self.savepath = 'BacktestRA'
         
     #----------------------------------------------------------------------
     def setStartDate(self, startDate='20100416', initDays=10):
@@ -135,65 +196,352 @@ class BacktestingEngine(object):
         self.dbName = dbName
         self.symbol = symbol
 
+    #----------------------------------------------------------------------
+    def setDataSource(self, root, symbol, fileFormat='npy'):
+        """
+        设置历史数据所用的本地文件数据源（按品种和月份分区），替代setDatabase
+        仅支持K线模式
+        """
+        self.dataSource = FileDataSource(root, fileFormat)
+        self.symbol = symbol
+
+    #----------------------------------------------------------------------
+    def setTickStore(self, root, symbol):
+        """设置Tick模式所用的压缩Tick存储，替代setDatabase"""
+        self.tickStore = TickStore(root)
+        self.symbol = symbol
+
+    #----------------------------------------------------------------------
+    def setBarCache(self, cachePath=''):
+        """设置K线列式缓存的路径，开启后重复回测直接从本地缓存载入"""
+        self.barCache = BarCache(cachePath)
+
+    #----------------------------------------------------------------------
+    def setResultCache(self, cachePath=''):
+        """设置优化结果缓存的文件路径，开启后重复优化时跳过已经计算过的参数组合"""
+        self.resultCache = ResultCache(cachePath)
+
+    #----------------------------------------------------------------------
+    def setReuseBar(self, reuseBar):
+        """
+        设置缓存回放时是否复用同一个K线对象
+        复用可以进一步减少对象创建，但要求策略不保存推送过来的K线引用
+        """
+        self.reuseBar = reuseBar
+
+    #----------------------------------------------------------------------
+    def setPrefetch(self, batchSize=5000, queueSize=4):
+        """
+        设置从数据库载入数据时使用后台预读取
+        只读取回测需要的字段，按batchSize分批读取，最多预读取queueSize批
+        """
+        self.prefetchBatchSize = batchSize
+        self.prefetchQueueSize = queueSize
+
+    #----------------------------------------------------------------------
+    def setBarGenerator(self, window, callbackName, offset=1, baseName=''):
+        """
+        设置由引擎预先聚合的大周期K线
+        载入数据时一次性聚合出window分钟的K线，在其最后一根1分钟K线推送给onBar后，
+        调用策略的callbackName函数（如onFiveBar、onLongCycle）推送大周期K线；
+        offset为1对应策略中(minute+1) % window == 0的聚合规则，为0对应minute % window == 0。
+
+        baseName不为空时，在之前设置的回调函数为baseName的大周期K线上继续聚合，
+        如MultiCycleStrategy由5分钟K线聚合15分钟K线：
+            engine.setBarGenerator(5, 'onFiveBar')
+            engine.setBarGenerator(15, 'onLongCycle', 5, 'onFiveBar')
+
+        同一根1分钟K线上有多个大周期K线走完时，周期长的先推送，
+        和策略在onFiveBar的开始处调用onLongCycle的顺序一致。
+        """
+        self.barGeneratorList.append((window, callbackName, offset, baseName))
+
+    #----------------------------------------------------------------------
+    def hasBarGenerator(self, window, callbackName):
+        """是否设置了推送到callbackName的window分钟K线，供策略在初始化时检查"""
+        for generator in self.barGeneratorList:
+            if generator[0] == window and generator[1] == callbackName:
+                return True
+        return False
+
+    #----------------------------------------------------------------------
+    def setLogLevel(self, level):
+        """设置日志级别，LOG_DISABLED为关闭日志"""
+        self.logger.setLevel(level)
+
+    #----------------------------------------------------------------------
+    def setLogBufferSize(self, bufferSize):
+        """设置日志环形缓冲区的长度，超出后丢弃最早的日志"""
+        self.logger.setBufferSize(bufferSize)
+
     #----------------------------------------------------------------------
     def setSavePath(self,savepath):
         """设置存储分析结果的路径"""
         self.savepath = savepath
 
+    #----------------------------------------------------------------------
+    def setTradeWriter(self, fileFormat=FORMAT_CSV, bufferSize=DEFAULT_BUFFER_SIZE):
+        """
+        开启交易结果的逐笔写出，文件保存在savepath下
+        fileFormat为csv（文本）或col（列式二进制），bufferSize为写出前缓冲的交易结果数量
+        """
+        self.writeTrade = True
+        self.tradeFormat = fileFormat
+        self.tradeBufferSize = bufferSize
+
 
     
     #----------------------------------------------------------------------
     def loadHistoryData(self):
         """载入历史数据"""
+        # 多进程优化的子进程中，直接挂载父进程载入的共享数据，无需连接数据库
+        if self.sharedDataPath and self.mode == self.BAR_MODE:
+            arrays, info = self.attachSharedData()
+            self.setArrayData(arrays, info)
+            return
+
+        # Tick模式使用压缩Tick存储，解码后逐条回放
+        if self.tickStore and self.mode == self.TICK_MODE:
+            self.output(u'开始载入数据')
+            self.loadTickStoreData()
+            return
+
+        # 使用本地文件数据源，按日期裁剪分区后直接读取
+        if self.dataSource and self.mode == self.BAR_MODE:
+            self.output(u'开始载入数据')
+            arrays, info = self.loadBarArrays()
+            self.setArrayData(arrays, info)
+            return
+
         self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
         collection = self.dbClient[self.dbName][self.symbol]          
 
         self.output(u'开始载入数据')
-      
-        # 首先根据回测模式，确认要使用的数据类
-        if self.mode == self.BAR_MODE:
-            dataClass = VtBarData
-            func = self.newBar
-        else:
-            dataClass = VtTickData
-            func = self.newTick
-
-        # 载入初始化需要用的数据
-        flt = {'datetime':{'$gte':self.dataStartDate,
-                           '$lt':self.strategyStartDate}}        
-        #initCursor = collection.find(flt)
-        initCursor = collection.find(flt).sort("_id",1)
-
-        # 将数据从查询指针中读取出，并生成列表
-        self.initData = []              # 清空initData列表
-        for d in initCursor:
-            data = dataClass()
-            data.__dict__ = d
-            self.initData.append(data)      
-        
-        # 载入回测数据
-        if not self.dataEndDate:
-            flt = {'datetime':{'$gte':self.strategyStartDate}}   # 数据过滤条件
-        else:
-            flt = {'datetime':{'$gte':self.strategyStartDate,
-                               '$lte':self.dataEndDate}}  
-        self.dbCursor = collection.find(flt).sort('datetime')
+
+        # K线模式下开启了缓存，或者需要预先聚合大周期K线，则以列数据的方式载入
+        if (self.barCache or self.barGeneratorList) and self.mode == self.BAR_MODE:
+            arrays, info = self.loadBarArrays(collection)
+            self.setArrayData(arrays, info)
+            return
+
+        # 开启了预读取，则使用后台线程分批读取
+        if self.prefetchBatchSize:
+            self.loadPrefetchData(collection)
+            return
+
+        # 初始化数据和回测数据使用同一个查询指针，只投影回测需要的字段，K线解码为ArrayBar
+        flt = self.makeDataFilter()
+        projection, decoder = self.makeDocDecoder(collection, flt)
+        self.dbCursor = collection.find(flt, projection).sort('datetime')
+        self.setDataStream(self.iterCursorData(self.dbCursor, decoder))
         
-        self.output(u'载入完成，数据量：%s' %(initCursor.count() + self.dbCursor.count()))
+        self.output(u'载入完成，数据量：%s' %self.dbCursor.count())
+
+    #----------------------------------------------------------------------
+    def setDataStream(self, dataIter):
+        """
+        使用同一个按时间排序的数据流作为初始化数据和回测数据
+        策略启动时间之前的数据通过loadBar/loadTick惰性地推送给策略，其余的用于回测，
+        初始化天数的多少不影响内存占用
+        """
+        self.dataStream = iter(dataIter)
+        self.pendingData = None
+        self.initData = self.iterInitData()
+        self.backtestingData = self.iterBacktestingData()
+
+    #----------------------------------------------------------------------
+    def iterInitData(self):
+        """逐条生成策略启动时间之前的数据"""
+        for data in self.dataStream:
+            if data.datetime >= self.strategyStartDate:
+                # 已经是回测数据，留给回测数据流
+                self.pendingData = data
+                return
+            yield data
+
+    #----------------------------------------------------------------------
+    def iterBacktestingData(self):
+        """逐条生成回测数据，策略没有读取完的初始化数据直接跳过"""
+        self.skippingInitData = True
+        for data in self.initData:
+            pass
+        self.skippingInitData = False
+
+        if self.pendingData is not None:
+            data = self.pendingData
+            self.pendingData = None
+            yield data
+
+        for data in self.dataStream:
+            yield data
+
+    #----------------------------------------------------------------------
+    def makeDataFilter(self):
+        """整个回测区间（包括初始化数据）的过滤条件"""
+        flt = {'datetime': {'$gte': self.dataStartDate}}
+        if self.dataEndDate:
+            flt['datetime']['$lte'] = self.dataEndDate
+        return flt
+
+    #----------------------------------------------------------------------
+    def makeDocDecoder(self, collection, flt):
+        """根据回测模式返回数据库查询的(投影, 文档解码函数)"""
+        if self.mode == self.BAR_MODE:
+            return BAR_PROJECTION, BarDecoder(loadContractInfo(collection, flt))
+        return TICK_PROJECTION, decodeTick
+
+    #----------------------------------------------------------------------
+    def loadPrefetchData(self, collection):
+        """使用后台预读取器载入历史数据，只投影回测需要的字段"""
+        flt = self.makeDataFilter()
+        projection, decoder = self.makeDocDecoder(collection, flt)
+
+        # 立即启动读取，使其和策略初始化并行
+        reader = MongoPrefetchReader(collection, flt, projection, decoder,
+                                     self.prefetchBatchSize, self.prefetchQueueSize)
+        reader.start()
+        self.setDataStream(reader)
+
+        self.output(u'载入完成，数据量：%s' %reader.count())
+
+    #----------------------------------------------------------------------
+    def loadBarArrays(self, collection=None):
+        """
+        载入整个回测区间的K线列数据，返回(列数据字典, 合约信息字典)
+        设置了本地文件数据源则从文件载入，不需要传入collection；
+        开启了缓存则从缓存载入，缓存过期的部分会自动从数据库刷新
+        """
+        if self.dataSource:
+            return self.dataSource.loadBarArrays(self.symbol, self.dataStartDate, self.dataEndDate)
+
+        if self.barCache:
+            return self.barCache.loadBarArrays(collection, self.dbName, self.symbol,
+                                               self.dataStartDate, self.dataEndDate)
+
+        flt = self.makeDataFilter()
+        info = loadContractInfo(collection, flt)
+        docs = list(collection.find(flt, BAR_PROJECTION).sort('datetime'))
+        return barDocsToArrays(docs), info
+
+    #----------------------------------------------------------------------
+    def loadArrayData(self):
+        """
+        以列数据的方式载入整个回测区间的K线，返回(列数据字典, 合约信息字典)
+        依次使用共享数据集、本地文件数据源和数据库（开启了缓存则经过缓存）
+        """
+        if self.sharedDataPath:
+            return self.attachSharedData()
+
+        collection = None
+        if not self.dataSource:
+            self.dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+            collection = self.dbClient[self.dbName][self.symbol]
+
+        return self.loadBarArrays(collection)
+
+    #----------------------------------------------------------------------
+    def attachSharedData(self):
+        """挂载共享数据集，同一路径在进程中只挂载一次，返回(列数据字典, 合约信息字典)"""
+        if not self.sharedArrayData or self.sharedArrayData[0] != self.sharedDataPath:
+            arrays, info = SharedBarDataset(self.sharedDataPath).attach()
+            self.sharedArrayData = (self.sharedDataPath, arrays, info)
+        return self.sharedArrayData[1], self.sharedArrayData[2]
+
+    #----------------------------------------------------------------------
+    def loadTickStoreData(self):
+        """从压缩Tick存储中逐日解码回放历史数据，内存中只保留当天的数据"""
+        self.setDataStream(self.tickStore.iterTicks(self.symbol, self.dataStartDate,
+                                                    self.dataEndDate))
+        self.markArrays = None
+
+        days = self.tickStore.listRangeDays(self.symbol, self.dataStartDate, self.dataEndDate)
+        self.output(u'载入完成，交易日数量：%s' %len(days))
+
+    #----------------------------------------------------------------------
+    def setArrayData(self, arrays, info):
+        """使用列数据作为回测数据"""
+        # 按策略启动时间切分初始化数据和回测数据
+        datetimes = arrays['datetime']
+        n = datetimes.searchsorted(np.datetime64(self.strategyStartDate, 'us'))
+
+        # 初始化数据可能被策略保存，因此不复用对象
+        dataIter = chain(iterArrayBars(sliceBarArrays(arrays, 0, n), info),
+                         iterArrayBars(sliceBarArrays(arrays, n, len(datetimes)), info,
+                                       self.reuseBar))
+
+        if self.barGeneratorList:
+            self.prepareAggregatedBars(arrays)
+            dataIter = self.iterAggregatedData(dataIter, arrays, info)
+
+        self.setDataStream(dataIter)
+        self.markArrays = {'datetime': datetimes, 'close': arrays['close']}
+
+        self.output(u'载入完成，数据量：%s' %len(datetimes))
+
+    #----------------------------------------------------------------------
+    def prepareAggregatedBars(self, arrays):
+        """一次性聚合所有大周期K线，按照结束K线的位置建立推送表"""
+        self.aggregatedBarDict = {}
+        resampledDict = {}
+
+        for window, callbackName, offset, baseName in self.barGeneratorList:
+            if baseName:
+                resampled = resampleAggregatedArrays(resampledDict[baseName], window, offset)
+            else:
+                resampled = resampleBarArrays(arrays, window, offset)
+            resampledDict[callbackName] = resampled
+
+            for k, end in enumerate(resampled['end'].tolist()):
+                self.aggregatedBarDict.setdefault(end, []).append((window, callbackName, resampled, k))
+
+        # 同一根K线上走完的大周期K线，周期长的先推送
+        for pushList in self.aggregatedBarDict.values():
+            pushList.sort(key=lambda x: -x[0])
+
+    #----------------------------------------------------------------------
+    def iterAggregatedData(self, dataIter, arrays, info):
+        """
+        逐条生成K线，每根K线处理完成后（即迭代器恢复时）推送在该K线走完的大周期K线
+        策略没有读取而被跳过的初始化K线，不推送大周期K线
+        """
+        barDict = self.aggregatedBarDict
+        strategyStartDate = self.strategyStartDate
+
+        for i, data in enumerate(dataIter):
+            skipped = self.skippingInitData and data.datetime < strategyStartDate
+            yield data
+            if skipped:
+                continue
+
+            pushList = barDict.get(i)
+            if pushList:
+                for window, callbackName, resampled, k in pushList:
+                    bar = makeAggregatedBar(arrays, resampled, k, info)
+                    getattr(self.strategy, callbackName)(bar)
         
+    #----------------------------------------------------------------------
+    def iterCursorData(self, cursor, decoder):
+        """将数据库查询指针中的文档逐条解码为数据对象"""
+        for d in cursor:
+            yield decoder(d)
+
     #----------------------------------------------------------------------
     def runBacktesting(self):
         """运行回测"""
-        # 载入历史数据
-        self.loadHistoryData()
+        self.prepareBacktesting()
         
-        # 首先根据回测模式，确认要使用的数据类
-        if self.mode == self.BAR_MODE:
-            dataClass = VtBarData
-            func = self.newBar
-        else:
-            dataClass = VtTickData
-            func = self.newTick
+        replayData = self.replayData
+        for data in self.backtestingData:
+            # 满足终止条件时停止回放
+            if replayData(data):
+                break
+        
+        self.finishBacktesting()
+
+    #----------------------------------------------------------------------
+    def prepareBacktesting(self):
+        """载入历史数据，初始化并启动策略，准备回放数据"""
+        self.loadHistoryData()
 
         self.output(u'开始回测')
         
@@ -207,12 +555,76 @@ class BacktestingEngine(object):
         
         self.output(u'开始回放数据')
 
-        for d in self.dbCursor:
-            data = dataClass()
-            data.__dict__ = d
-            func(data)     
+        self.resetRunningMetrics()
+        self.openTradeWriter()
+
+    #----------------------------------------------------------------------
+    def replayData(self, data):
+        """推送一条回测数据并检查终止条件，满足终止条件时返回终止原因"""
+        if self.mode == self.BAR_MODE:
+            self.newBar(data)
+        else:
+            self.newTick(data)
+        
+        if self.stopConditionList:
+            self.stopReason = checkStopConditions(self.stopConditionList, self.runningMetrics,
+                                                  self.dt)
+            if self.stopReason:
+                self.output(u'回测提前终止：%s' % self.stopReason)
+        return self.stopReason
+
+    #----------------------------------------------------------------------
+    def finishBacktesting(self):
+        """结束回放，写出剩余的交易结果"""
+        self.closeTradeWriter()
             
         self.output(u'数据回放结束')
+
+    #----------------------------------------------------------------------
+    def runVectorBacktesting(self):
+        """
+        运行向量化回测，仅支持K线模式
+        策略需要继承VectorStrategyTemplate，在整个回测区间的大周期K线上一次性计算信号，
+        成交由simulateVectorTrades计算，结果和事件回测一样保存在成交字典中，
+        可以直接使用calculateBacktestingResult等函数
+        """
+        self.output(u'开始载入数据')
+        arrays, info = self.loadArrayData()
+        datetimes = arrays['datetime']
+        self.markArrays = {'datetime': datetimes, 'close': arrays['close']}
+        self.output(u'载入完成，数据量：%s' %len(datetimes))
+
+        # 策略启动时间之前的信号只用于初始化，不发出委托
+        startIndex = datetimes.searchsorted(np.datetime64(self.strategyStartDate, 'us'))
+
+        self.output(u'开始向量化回测')
+        strategy = self.strategy
+        resampled = resampleBarArrays(arrays, strategy.barBin, strategy.barOffset)
+        bars = makeSignalBars(arrays, resampled)
+        signals = strategy.calculateVectorSignals(bars)
+
+        tradeList = simulateVectorTrades(arrays, resampled['end'], bars, signals, startIndex,
+                                         strategy.fixedSize, strategy.trailingPrcnt,
+                                         strategy.fixedCutLoss, strategy.cutLossOffset,
+                                         self.priceTick)
+
+        self.resetRunningMetrics()
+        self.openTradeWriter()
+        for index, direction, offset, price, volume in tradeList:
+            self.tradeCount += 1            # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = LedgerTrade(strategy.vtSymbol, tradeID, '',
+                                DIRECTION_LONG if direction > 0 else DIRECTION_SHORT, offset,
+                                float(price), volume, datetimes[index].astype(object))
+
+            strategy.pos += direction * volume
+            self.recordTrade(trade)
+        self.closeTradeWriter()
+
+        if len(datetimes):
+            self.dt = datetimes[-1].astype(object)
+
+        self.output(u'向量化回测结束，成交数量：%s' %len(tradeList))
         
     #----------------------------------------------------------------------
     def newBar(self, bar):
@@ -247,32 +659,28 @@ class BacktestingEngine(object):
         self.limitOrderCount += 1
         orderID = str(self.limitOrderCount)
         
-        order = VtOrderData()
-        order.vtSymbol = vtSymbol
-        order.price = self.roundToPriceTick(price)
-        order.totalVolume = volume
-        order.status = STATUS_NOTTRADED     # 刚提交尚未成交
-        order.orderID = orderID
-        order.vtOrderID = orderID
-        order.orderTime = str(self.dt)
-        
         # CTA委托类型映射
+        direction = offset = EMPTY_UNICODE
         if orderType == CTAORDER_BUY:
-            order.direction = DIRECTION_LONG
-            order.offset = OFFSET_OPEN
+            direction = DIRECTION_LONG
+            offset = OFFSET_OPEN
         elif orderType == CTAORDER_SELL:
-            order.direction = DIRECTION_SHORT
-            order.offset = OFFSET_CLOSE
+            direction = DIRECTION_SHORT
+            offset = OFFSET_CLOSE
         elif orderType == CTAORDER_SHORT:
-            order.direction = DIRECTION_SHORT
-            order.offset = OFFSET_OPEN
+            direction = DIRECTION_SHORT
+            offset = OFFSET_OPEN
         elif orderType == CTAORDER_COVER:
-            order.direction = DIRECTION_LONG
-            order.offset = OFFSET_CLOSE     
+            direction = DIRECTION_LONG
+            offset = OFFSET_CLOSE     
         
-        # 保存到限价单字典中
+        # 刚提交尚未成交，发单时间字符串在访问时才生成
+        order = LedgerOrder(vtSymbol, orderID, direction, offset, self.roundToPriceTick(price),
+                            volume, STATUS_NOTTRADED, self.dt)
+        
+        # 保存到活动限价单字典中
         self.workingLimitOrderDict[orderID] = order
-        self.limitOrderDict[orderID] = order
+        self.limitOrderBook.add(order)
         
         return orderID
     
@@ -282,8 +690,10 @@ class BacktestingEngine(object):
         if vtOrderID in self.workingLimitOrderDict:
             order = self.workingLimitOrderDict[vtOrderID]
             order.status = STATUS_CANCELLED
-            order.cancelTime = str(self.dt)
+            order.cancelDt = self.dt
             del self.workingLimitOrderDict[vtOrderID]
+            self.limitOrderBook.remove(order)
+            self.limitOrderLedger.appendOrder(order)
             self.strategy.onOrder(order)
         
     #----------------------------------------------------------------------
@@ -299,6 +709,7 @@ class BacktestingEngine(object):
         so.strategy = strategy
         so.stopOrderID = stopOrderID
         so.status = STOPORDER_WAITING
+        so.dt = self.dt                 # 发单时间
         
         if orderType == CTAORDER_BUY:
             so.direction = DIRECTION_LONG
@@ -313,9 +724,9 @@ class BacktestingEngine(object):
             so.direction = DIRECTION_LONG
             so.offset = OFFSET_CLOSE           
         
-        # 保存stopOrder对象到字典中
-        self.stopOrderDict[stopOrderID] = so
+        # 保存stopOrder对象到活动停止单字典中
         self.workingStopOrderDict[stopOrderID] = so
+        self.stopOrderBook.add(so)
         
         return stopOrderID
     
@@ -326,8 +737,22 @@ class BacktestingEngine(object):
         if stopOrderID in self.workingStopOrderDict:
             so = self.workingStopOrderDict[stopOrderID]
             so.status = STOPORDER_CANCELLED
+            so.cancelDt = self.dt
             del self.workingStopOrderDict[stopOrderID]
+            self.stopOrderBook.remove(so)
+            self.stopOrderLedger.appendOrder(so)
             self.strategy.onOrder(so)
+
+    #----------------------------------------------------------------------
+    def cancelAll(self, name):
+        """全部撤单，撤销所有活动的限价单和停止单"""
+        for order in self.limitOrderBook.popAllOrders():
+            if order.vtOrderID in self.workingLimitOrderDict:
+                self.cancelOrder(order.vtOrderID)
+
+        for so in self.stopOrderBook.popAllOrders():
+            if so.stopOrderID in self.workingStopOrderDict:
+                self.cancelStopOrder(so.stopOrderID)
             
     #----------------------------------------------------------------------
     def crossLimitOrder(self):
@@ -344,57 +769,48 @@ class BacktestingEngine(object):
             buyBestCrossPrice = self.tick.askPrice1
             sellBestCrossPrice = self.tick.bidPrice1
         
-        # 遍历限价单字典中的所有限价单
-        for orderID, order in self.workingLimitOrderDict.items():
-            # 判断是否会成交
-            buyCross = (order.direction==DIRECTION_LONG and 
-                        order.price>=buyCrossPrice and
-                        buyCrossPrice > 0)      # 国内的tick行情在涨停时askPrice1为0，此时买无法成交
+        # 从委托簿中取出会成交的限价单，按发单顺序撮合
+        # 国内的tick行情在涨停时askPrice1为0，此时买无法成交；跌停时bidPrice1为0，此时卖无法成交
+        crossedList = self.limitOrderBook.popCrossedOrders(buyCrossPrice, sellCrossPrice)
+        
+        for order in crossedList:
+            orderID = order.orderID
             
-            sellCross = (order.direction==DIRECTION_SHORT and 
-                         order.price<=sellCrossPrice and
-                         sellCrossPrice > 0)    # 国内的tick行情在跌停时bidPrice1为0，此时卖无法成交
+            # 在之前成交的回调中已经被策略撤销
+            if orderID not in self.workingLimitOrderDict:
+                continue
+            
+            buyCross = order.direction==DIRECTION_LONG
+            
+            # 以买入为例：
+            # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
+            # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
+            # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
+            if buyCross:
+                price = min(order.price, buyBestCrossPrice)
+                self.strategy.pos += order.totalVolume
+            else:
+                price = max(order.price, sellBestCrossPrice)
+                self.strategy.pos -= order.totalVolume
+            
+            # 推送成交数据
+            self.tradeCount += 1            # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = LedgerTrade(order.vtSymbol, tradeID, orderID, order.direction, order.offset,
+                                price, order.totalVolume, self.dt)
+            self.strategy.onTrade(trade)
+            
+            self.recordTrade(trade)
+            
+            # 推送委托数据
+            order.tradedVolume = order.totalVolume
+            order.status = STATUS_ALLTRADED
+            self.strategy.onOrder(order)
+            
+            # 从字典中删除该限价单，保存到记录中
+            del self.workingLimitOrderDict[orderID]
+            self.limitOrderLedger.appendOrder(order)
             
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1            # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = order.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-                trade.orderID = order.orderID
-                trade.vtOrderID = order.orderID
-                trade.direction = order.direction
-                trade.offset = order.offset
-                
-                # 以买入为例：
-                # 1. 假设当根K线的OHLC分别为：100, 125, 90, 110
-                # 2. 假设在上一根K线结束(也是当前K线开始)的时刻，策略发出的委托为限价105
-                # 3. 则在实际中的成交价会是100而不是105，因为委托发出时市场的最优价格是100
-                if buyCross:
-                    trade.price = min(order.price, buyBestCrossPrice)
-                    self.strategy.pos += order.totalVolume
-                else:
-                    trade.price = max(order.price, sellBestCrossPrice)
-                    self.strategy.pos -= order.totalVolume
-                
-                trade.volume = order.totalVolume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-                
-                self.tradeDict[tradeID] = trade
-                
-                # 推送委托数据
-                order.tradedVolume = order.totalVolume
-                order.status = STATUS_ALLTRADED
-                self.strategy.onOrder(order)
-                
-                # 从字典中删除该限价单
-                del self.workingLimitOrderDict[orderID]
-                
     #----------------------------------------------------------------------
     def crossStopOrder(self):
         """基于最新数据撮合停止单"""
@@ -408,65 +824,90 @@ class BacktestingEngine(object):
             sellCrossPrice = self.tick.lastPrice
             bestCrossPrice = self.tick.lastPrice
         
-        # 遍历停止单字典中的所有停止单
-        for stopOrderID, so in self.workingStopOrderDict.items():
-            # 判断是否会成交
-            buyCross = so.direction==DIRECTION_LONG and so.price<=buyCrossPrice
-            sellCross = so.direction==DIRECTION_SHORT and so.price>=sellCrossPrice
+        # 从委托簿中取出会触发的停止单，按发单顺序撮合
+        crossedList = self.stopOrderBook.popCrossedOrders(buyCrossPrice, sellCrossPrice)
+        
+        for so in crossedList:
+            stopOrderID = so.stopOrderID
             
-            # 如果发生了成交
-            if buyCross or sellCross:
-                # 推送成交数据
-                self.tradeCount += 1            # 成交编号自增1
-                tradeID = str(self.tradeCount)
-                trade = VtTradeData()
-                trade.vtSymbol = so.vtSymbol
-                trade.tradeID = tradeID
-                trade.vtTradeID = tradeID
-                
-                if buyCross:
-                    self.strategy.pos += so.volume
-                    trade.price = max(bestCrossPrice, so.price)
-                else:
-                    self.strategy.pos -= so.volume
-                    trade.price = min(bestCrossPrice, so.price)                
-                
-                self.limitOrderCount += 1
-                orderID = str(self.limitOrderCount)
-                trade.orderID = orderID
-                trade.vtOrderID = orderID
-                
-                trade.direction = so.direction
-                trade.offset = so.offset
-                trade.volume = so.volume
-                trade.tradeTime = str(self.dt)
-                trade.dt = self.dt
-                self.strategy.onTrade(trade)
-                
-                self.tradeDict[tradeID] = trade
-                
-                # 推送委托数据
-                so.status = STOPORDER_TRIGGERED
-                
-                order = VtOrderData()
-                order.vtSymbol = so.vtSymbol
-                order.symbol = so.vtSymbol
-                order.orderID = orderID
-                order.vtOrderID = orderID
-                order.direction = so.direction
-                order.offset = so.offset
-                order.price = so.price
-                order.totalVolume = so.volume
-                order.tradedVolume = so.volume
-                order.status = STATUS_ALLTRADED
-                order.orderTime = trade.tradeTime
-                self.strategy.onOrder(order)
-                
-                self.limitOrderDict[orderID] = order
-                
-                # 从字典中删除该限价单
-                if stopOrderID in self.workingStopOrderDict:
-                    del self.workingStopOrderDict[stopOrderID]        
+            # 在之前成交的回调中已经被策略撤销
+            if stopOrderID not in self.workingStopOrderDict:
+                continue
+            
+            buyCross = so.direction==DIRECTION_LONG
+            
+            if buyCross:
+                self.strategy.pos += so.volume
+                price = max(bestCrossPrice, so.price)
+            else:
+                self.strategy.pos -= so.volume
+                price = min(bestCrossPrice, so.price)                
+            
+            self.limitOrderCount += 1
+            orderID = str(self.limitOrderCount)
+            
+            # 推送成交数据
+            self.tradeCount += 1            # 成交编号自增1
+            tradeID = str(self.tradeCount)
+            trade = LedgerTrade(so.vtSymbol, tradeID, orderID, so.direction, so.offset,
+                                price, so.volume, self.dt)
+            self.strategy.onTrade(trade)
+            
+            self.recordTrade(trade)
+            
+            # 推送委托数据
+            so.status = STOPORDER_TRIGGERED
+            so.triggerDt = self.dt
+            
+            order = LedgerOrder(so.vtSymbol, orderID, so.direction, so.offset, so.price,
+                                so.volume, STATUS_ALLTRADED, self.dt, so.volume)
+            self.strategy.onOrder(order)
+            
+            self.limitOrderLedger.appendOrder(order)
+            
+            # 从字典中删除该停止单，保存到记录中
+            if stopOrderID in self.workingStopOrderDict:
+                del self.workingStopOrderDict[stopOrderID]        
+                self.stopOrderLedger.appendOrder(so)
+
+    #----------------------------------------------------------------------
+    def recordTrade(self, trade):
+        """记录成交并更新在线统计，开启逐笔写出时同时写出平仓的交易结果"""
+        self.tradeLedger.appendTrade(trade)
+        self.runningMetrics.onTrade(trade)
+        if self.tradeWriter:
+            self.tradeWriter.onTrade(trade)
+
+    #----------------------------------------------------------------------
+    def resetRunningMetrics(self):
+        """回测开始时按当前的回测参数重置在线统计"""
+        self.runningMetrics.reset(self.initcapital, self.size, self.rate, self.slippage,
+                                  self.leverage)
+        self.stopReason = ''
+
+    #----------------------------------------------------------------------
+    def addStopCondition(self, condition):
+        """添加提前终止回测的条件，condition为StopCondition对象"""
+        self.stopConditionList.append(condition)
+
+    #----------------------------------------------------------------------
+    def openTradeWriter(self):
+        """开启逐笔写出时，创建交易结果的写出对象"""
+        if not self.writeTrade:
+            return
+        name = self.strategy.name + self.startDate + '-' + self.endDate
+        self.tradeWriter = createTradeWriter(self.savepath, name, self.tradeFormat,
+                                             self.size, self.rate, self.slippage,
+                                             self.tradeBufferSize)
+        self.output(u'交易结果写出到：%s' % self.tradeWriter.path)
+
+    #----------------------------------------------------------------------
+    def closeTradeWriter(self):
+        """写出剩余的交易结果并关闭文件"""
+        if self.tradeWriter:
+            self.tradeWriter.close()
+            self.output(u'交易结果写出完成，数量：%s' % self.tradeWriter.resultCount)
+            self.tradeWriter = None
 
     #----------------------------------------------------------------------
     def insertData(self, dbName, collectionName, data):
@@ -475,19 +916,27 @@ class BacktestingEngine(object):
     
     #----------------------------------------------------------------------
     def loadBar(self, dbName, collectionName, startDate):
-        """直接返回初始化数据列表中的Bar"""
+        """直接返回初始化数据的迭代器"""
         return self.initData
     
     #----------------------------------------------------------------------
     def loadTick(self, dbName, collectionName, startDate):
-        """直接返回初始化数据列表中的Tick"""
+        """直接返回初始化数据的迭代器"""
         return self.initData
     
     #----------------------------------------------------------------------
-    def writeCtaLog(self, content):
-        """记录日志"""
-        log = str(self.dt) + ' ' + content 
-        self.logList.append(log)
+    def writeCtaLog(self, content, *args, **kwargs):
+        """
+        记录日志，只保存模板和参数，读取时才格式化
+        args为content的格式化参数，level参数为日志级别，默认为LOG_INFO
+        """
+        self.logger.log(self.dt, kwargs.get('level', LOG_INFO), content, args)
+
+    #----------------------------------------------------------------------
+    @property
+    def logList(self):
+        """格式化后的日志列表"""
+        return self.logger.render()
         
     #----------------------------------------------------------------------
     def output(self, content):
@@ -498,175 +947,54 @@ class BacktestingEngine(object):
     def calculateBacktestingResult(self):
         """
         计算回测结果
+        开平仓交易按照先进先出的规则配对，盈亏曲线和回撤等序列均为NumPy数组
         """
         self.output(u'计算回测结果')
         
-        # 首先基于回测后的成交记录，计算每笔交易的盈亏
-        resultList = []             # 交易结果列表
-
-        longTradeList = []          # 多头交易列表
-        shortTradeList = []         # 空头交易列表
-
-        longTrade = []              # 未平仓的多头交易
-        shortTrade = []             # 未平仓的空头交易
-        
-        tradeTimeList = []          # 每笔成交时间戳
-        posList = [0]               # 每笔成交后的持仓情况        
-
-        for trade in self.tradeDict.values():
-            # 多头交易
-            if trade.direction == DIRECTION_LONG:
-                # 如果尚无空头交易
-                if not shortTrade:
-                    longTrade.append(trade)
-                # 当前多头交易为平空
-                else:
-                    while True:
-                        entryTrade = shortTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               -closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-                        shortTradeList.append(result.pnl * self.leverage)   # 加入多头交易
-
-                        posList.extend([-1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-                        
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            shortTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not shortTrade:
-                                longTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass
-                        
-            # 空头交易        
-            else:
-                # 如果尚无多头交易
-                if not longTrade:
-                    shortTrade.append(trade)
-                # 当前空头交易为平多
-                else:                    
-                    while True:
-                        entryTrade = longTrade[0]
-                        exitTrade = trade
-                        
-                        # 清算开平仓交易
-                        closedVolume = min(exitTrade.volume, entryTrade.volume)
-                        result = TradingResult(entryTrade.price, entryTrade.dt, 
-                                               exitTrade.price, exitTrade.dt,
-                                               closedVolume, self.rate, self.slippage, self.size)
-                        resultList.append(result)
-
-                        longTradeList.append(result.pnl * self.leverage)  # 加入空头交易
-                        
-                        posList.extend([1,0])
-                        tradeTimeList.extend([result.entryDt, result.exitDt])
-
-                        # 计算未清算部分
-                        entryTrade.volume -= closedVolume
-                        exitTrade.volume -= closedVolume
-                        
-                        # 如果开仓交易已经全部清算，则从列表中移除
-                        if not entryTrade.volume:
-                            longTrade.pop(0)
-                        
-                        # 如果平仓交易已经全部清算，则退出循环
-                        if not exitTrade.volume:
-                            break
-                        
-                        # 如果平仓交易未全部清算，
-                        if exitTrade.volume:
-                            # 且开仓交易已经全部清算完，则平仓交易剩余的部分
-                            # 等于新的反向开仓交易，添加到队列中
-                            if not longTrade:
-                                shortTrade.append(exitTrade)
-                                break
-                            # 如果开仓交易还有剩余，则进入下一轮循环
-                            else:
-                                pass                    
-                    
+        # 首先基于回测后的成交记录，按先进先出配对每笔交易
+        trades = self.tradeLedger.getData()
+        isLong = trades['direction'] == DIRECTION_LIST.index(DIRECTION_LONG)
+        entryIndex, exitIndex, volume = matchTradesFifo(isLong, trades['volume'])
+        
         # 检查是否有交易
-        if not resultList:
+        if not len(volume):
             self.output(u'无交易结果')
             return {}
         
-        # 然后基于每笔交易的结果，我们可以计算具体的盈亏曲线和最大回撤等        
-        capital = self.initcapital             # 资金
-        maxCapital = 0          # 资金最高净值
-        drawdown = 0            # 回撤
-        drawdownpctList = []        # 回撤比例
-
-        longPnl = np.array(longTradeList).mean()    # 多仓平均利润
-        shortPnl = np.array(shortTradeList).mean()  # 空仓平均利润
-
-        networthList = []       # 净值数据序列
-        totalResult = 0         # 总成交数量
-        totalTurnover = 0       # 总成交金额（合约面值）
-        totalCommission = 0     # 总手续费
-        totalSlippage = 0       # 总滑点
-        
-        timeList = []           # 时间序列
-        pnlList = []            # 每笔盈亏序列
-        pnlPctList = []         # 每笔百分比盈亏
-        totalpnlPctList = []    # 每笔百分比盈亏序列
-        capitalList = []        # 盈亏汇总的时间序列
-        drawdownList = []       # 回撤的时间序列
-        
-        winningResult = 0       # 盈利次数
-        losingResult = 0        # 亏损次数		
-        totalWinning = 0        # 总盈利金额		
-        totalLosing = 0         # 总亏损金额        
+        # 计算每笔交易的盈亏，和TradingResult的计算方式一致
+        r = {}
+        r['entryPrice'] = trades['price'][entryIndex]
+        r['exitPrice'] = trades['price'][exitIndex]
+        r['entryDt'] = trades['datetime'][entryIndex].astype(object)
+        r['exitDt'] = trades['datetime'][exitIndex].astype(object)
+        r['volume'] = volume
+        r['turnover'] = (r['entryPrice'] + r['exitPrice']) * self.size * np.abs(volume)
+        r['commission'] = r['turnover'] * self.rate
+        r['slippage'] = self.slippage * 2 * self.size * np.abs(volume)
+        r['pnl'] = ((r['exitPrice'] - r['entryPrice']) * volume * self.size 
+                    - r['commission'] - r['slippage'])
+        r['pnlPct'] = r['pnl'] / r['entryPrice']
+        
+        # 然后基于每笔交易的结果，计算具体的盈亏曲线和最大回撤等
+        pnlArray = self.leverage * r['pnl']
+        capitalArray = np.cumsum(np.append(self.initcapital, pnlArray))[1:]     # 资金
+        maxCapitalArray = np.maximum(np.maximum.accumulate(capitalArray), 0)   # 资金最高净值
+        drawdownArray = capitalArray - maxCapitalArray                          # 回撤
+        
+        drawdownpctArray = np.zeros(len(drawdownArray))                         # 回撤比例
+        nonzero = maxCapitalArray != 0
+        drawdownpctArray[nonzero] = drawdownArray[nonzero] / maxCapitalArray[nonzero]
+        
+        longResult = volume > 0                                                 # 平多的交易
+        winning = r['pnl'] >= 0
         
-        for result in resultList:
-            capital += self.leverage * result.pnl
-            maxCapital = max(capital, maxCapital)
-            drawdown = capital - maxCapital
-
-            ddpct = drawdown / maxCapital if maxCapital != 0 else 0  # 最大回撤百分比
-            drawdownpctList.append(ddpct)  # 最大回撤
-
-            networth = capital / self.initcapital
-            networthList.append(networth)
-
-            pnlList.append(self.leverage * result.pnl)
-            pnlPctList.append(self.leverage * result.pnlPct)
-            timeList.append(result.exitDt)      # 交易的时间戳使用平仓时间
-            capitalList.append(capital)
-            drawdownList.append(drawdown)
-            
-            totalResult += 1
-            totalTurnover += result.turnover
-            totalCommission += result.commission
-            totalSlippage += result.slippage
-            
-            if result.pnl >= 0:
-                winningResult += 1
-                totalWinning += result.pnl * self.leverage
-            else:
-                losingResult += 1
-                totalLosing += result.pnl * self.leverage
-                
         # 计算盈亏相关数据
+        totalResult = len(volume)                                               # 总成交数量
+        winningResult = int(winning.sum())                                      # 盈利次数
+        losingResult = totalResult - winningResult                              # 亏损次数
+        totalWinning = sequentialSum(pnlArray[winning])                         # 总盈利金额
+        totalLosing = sequentialSum(pnlArray[~winning])                         # 总亏损金额
+        
         winningRate = winningResult/totalResult*100         # 胜率
         
         averageWinning = 0                                  # 这里把数据都初始化为0
@@ -679,37 +1007,42 @@ class BacktestingEngine(object):
             averageLosing = totalLosing/losingResult        # 平均每笔亏损
         if averageLosing:
             profitLossRatio = -averageWinning/averageLosing # 盈亏比
+        
+        # 每笔交易开仓和平仓时的持仓情况，以及对应的时间戳
+        posArray = np.zeros(totalResult * 2 + 1, dtype=np.int64)
+        posArray[1::2] = np.where(longResult, 1, -1)
+        tradeTimeArray = np.empty(totalResult * 2, dtype=object)
+        tradeTimeArray[0::2] = r['entryDt']
+        tradeTimeArray[1::2] = r['exitDt']
 
         # 返回回测结果
         d = {}
-        d['capital'] = capital
-        d['maxCapital'] = maxCapital
-        d['drawdown'] = drawdown
+        d['capital'] = float(capitalArray[-1])
+        d['maxCapital'] = float(maxCapitalArray[-1])
+        d['drawdown'] = float(drawdownArray[-1])
         d['totalResult'] = totalResult
-        d['totalTurnover'] = totalTurnover
-        d['totalCommission'] = totalCommission
-        d['totalSlippage'] = totalSlippage
-        d['timeList'] = timeList
-        d['pnlList'] = pnlList
-        d['pnlPctList'] = pnlPctList
-        d['capitalList'] = capitalList
-        d['drawdownList'] = drawdownList
+        d['totalTurnover'] = sequentialSum(r['turnover'])
+        d['totalCommission'] = sequentialSum(r['commission'])
+        d['totalSlippage'] = sequentialSum(r['slippage'])
+        d['timeList'] = r['exitDt']         # 交易的时间戳使用平仓时间
+        d['pnlList'] = pnlArray
+        d['pnlPctList'] = self.leverage * r['pnlPct']
+        d['capitalList'] = capitalArray
+        d['drawdownList'] = drawdownArray
         d['winningRate'] = winningRate
         d['averageWinning'] = averageWinning
         d['averageLosing'] = averageLosing
         d['profitLossRatio'] = profitLossRatio
-        d['posList'] = posList
-        d['tradeTimeList'] = tradeTimeList
-        d['drawdownpctList'] = drawdownpctList  #
-        d['networthList'] = networthList
-        d['longPnl'] = longPnl
-        d['shortPnl'] = shortPnl
-        d['longTradeCount'] = len(longTradeList)
-        d['shortTradeCount'] = len(shortTradeList)
-
-        if (self.writeTrade):  # 开启记录交易详细情况
-            print 'Save trading data!'
-            self.output_csv(resultList)
+        d['posList'] = posArray
+        d['tradeTimeList'] = tradeTimeArray
+        d['drawdownpctList'] = drawdownpctArray
+        d['networthList'] = capitalArray / self.initcapital
+        d['longPnl'] = pnlArray[longResult].mean() if longResult.any() else np.nan      # 多仓平均利润
+        d['shortPnl'] = pnlArray[~longResult].mean() if not longResult.all() else np.nan    # 空仓平均利润
+        d['longTradeCount'] = int(longResult.sum())
+        d['shortTradeCount'] = totalResult - d['longTradeCount']
+        d['resultArrays'] = r               # 每笔交易结果的列数据
+        d['stopReason'] = self.stopReason   # 回测提前终止的原因，没有终止时为空
 
         return d
         
@@ -734,85 +1067,182 @@ class BacktestingEngine(object):
         except:
             self.output(u'净值为负')
 
-        # 输出
-        self.output('-' * 30)
-        self.output(u'第一笔交易：\t%s' % d['timeList'][0])
-        self.output(u'最后一笔交易：\t%s' % d['timeList'][-1])
+        # 输出，统计结果同时写入报告
+        lines = []
+        lines.append('-' * 30)
+        lines.append(u'第一笔交易：\t%s' % d['timeList'][0])
+        lines.append(u'最后一笔交易：\t%s' % d['timeList'][-1])
         
-        self.output(u'总交易次数：\t%s' % formatNumber(d['totalResult']))
-        self.output(u'多头交易次数：\t%s' % formatNumber(d['longTradeCount']))
-        self.output(u'空头交易次数：\t%s' % formatNumber(d['shortTradeCount']))
-        self.output(u'期末净值：\t%s' % formatNumber(d['networthList'][-1]))
-        self.output(u'总盈亏：\t%s' % formatNumber(d['capital'] - self.initcapital))
+        lines.append(u'总交易次数：\t%s' % formatNumber(d['totalResult']))
+        lines.append(u'多头交易次数：\t%s' % formatNumber(d['longTradeCount']))
+        lines.append(u'空头交易次数：\t%s' % formatNumber(d['shortTradeCount']))
+        lines.append(u'期末净值：\t%s' % formatNumber(d['networthList'][-1]))
+        lines.append(u'总盈亏：\t%s' % formatNumber(d['capital'] - self.initcapital))
 
-        self.output(u'最大回撤: \t%s' % formatNumber(min(d['drawdownList'])))
-        self.output(u'最大回撤百分比: \t%s' % formatNumber(min(d['drawdownpctList'])))
+        lines.append(u'最大回撤: \t%s' % formatNumber(min(d['drawdownList'])))
+        lines.append(u'最大回撤百分比: \t%s' % formatNumber(min(d['drawdownpctList'])))
         try:
-            self.output(u'年化收益率：\t%s' % formatNumber(annualizedRet))
-            #self.output(u'夏普比率：\t%s' % formatNumber(sharpeRatio))
-            self.output(u'收益回撤比: \t%s' % formatNumber(
+            lines.append(u'年化收益率：\t%s' % formatNumber(annualizedRet))
+            #lines.append(u'夏普比率：\t%s' % formatNumber(sharpeRatio))
+            lines.append(u'收益回撤比: \t%s' % formatNumber(
                 ((d['networthList'][-1]) ** trueTimeDelta - 1.) / min(d['drawdownpctList'])))
         except:
-            self.output(u'净值为负！')
-        self.output(u'平均每笔盈利：\t%s' %formatNumber(d['capital']/d['totalResult']))
-        self.output(u'平均每笔滑点：\t%s' %formatNumber(d['totalSlippage']/d['totalResult']))
-        self.output(u'平均每笔佣金：\t%s' %formatNumber(d['totalCommission']/d['totalResult']))
-        self.output(u'胜率\t\t%s%%' %formatNumber(d['winningRate']))
-        self.output(u'盈利交易平均值\t%s' %formatNumber(d['averageWinning']))
-        self.output(u'亏损交易平均值\t%s' %formatNumber(d['averageLosing']))
-        self.output(u'盈亏比：\t%s' %formatNumber(d['profitLossRatio']))
-        self.output(u'多仓平均利润：\t%s' % formatNumber(d['longPnl']))
-        self.output(u'空仓平均利润：\t%s' % formatNumber(d['shortPnl']))
+            lines.append(u'净值为负！')
+        lines.append(u'平均每笔盈利：\t%s' %formatNumber(d['capital']/d['totalResult']))
+        lines.append(u'平均每笔滑点：\t%s' %formatNumber(d['totalSlippage']/d['totalResult']))
+        lines.append(u'平均每笔佣金：\t%s' %formatNumber(d['totalCommission']/d['totalResult']))
+        lines.append(u'胜率\t\t%s%%' %formatNumber(d['winningRate']))
+        lines.append(u'盈利交易平均值\t%s' %formatNumber(d['averageWinning']))
+        lines.append(u'亏损交易平均值\t%s' %formatNumber(d['averageLosing']))
+        lines.append(u'盈亏比：\t%s' %formatNumber(d['profitLossRatio']))
+        lines.append(u'多仓平均利润：\t%s' % formatNumber(d['longPnl']))
+        lines.append(u'空仓平均利润：\t%s' % formatNumber(d['shortPnl']))
+        for line in lines:
+            self.output(line)
+    
+        # 绘图，批量回测时可以关闭绘图，不会导入matplotlib
+        if self.reportFile:
+            exportReport(d, self.reportFile, lines, self.pnlPctToggle)
+            self.output(u'回测报告已保存：%s' % self.reportFile)
+        elif self.showPlot:
+            import matplotlib.pyplot as plt
+            
+            try:
+                import seaborn as sns       # 如果安装了seaborn则设置为白色风格
+                sns.set_style('whitegrid')  
+            except ImportError:
+                pass
+            
+            drawBacktestingResult(plt.figure(), d, self.pnlPctToggle)
+            plt.show()
+    
+    #----------------------------------------------------------------------
+    def calculateMonteCarloResult(self, pathNum=10000, method=METHOD_SHUFFLE, seed=None):
+        """
+        基于每笔交易盈亏的蒙特卡洛模拟，method为shuffle（重新排列）或bootstrap（重抽样）
+        返回每条路径统计指标的DataFrame，并输出各指标的分位数
+        """
+        d = self.calculateBacktestingResult()
+        if not d:
+            return None
+        
+        self.output(u'蒙特卡洛模拟，路径数量：%s' % pathNum)
+        result = runMonteCarlo(d['pnlList'], self.initcapital, pathNum, method, seed)
+        
+        self.output(u'实际最大回撤：\t%s' % formatNumber(min(d['drawdownList'])))
+        self.output(u'模拟最大回撤低于实际的比例：\t%s%%' % formatNumber(
+            (result['maxDrawdown'] < min(d['drawdownList'])).mean() * 100))
+        for line in summarizeMonteCarlo(result).to_string().splitlines():
+            self.output(line)
+        return result
     
+    #----------------------------------------------------------------------
+    def calculateDailyResult(self):
+        """
+        按交易日逐日盯市计算每日盈亏
+        返回(每日结果DataFrame, 每根K线的资金曲线DataFrame)，无法计算时返回(None, None)
+        """
+        self.output(u'计算按日统计结果')
+        
+        # 回测数据没有以列数据载入时（如直接从数据库逐条读取或逐日回放Tick），
+        # 重新载入K线的收盘价或Tick的最新价
+        if self.markArrays is None:
+            if self.mode == self.BAR_MODE:
+                arrays, info = self.loadArrayData()
+                self.markArrays = {'datetime': arrays['datetime'], 'close': arrays['close']}
+            elif self.tickStore:
+                arrays, info = self.tickStore.loadTickArrays(self.symbol, self.dataStartDate,
+                                                             self.dataEndDate, ['lastPrice'])
+                self.markArrays = {'datetime': arrays['datetime'], 'close': arrays['lastPrice']}
+            else:
+                self.output(u'Tick模式需要使用压缩Tick存储才能逐日盯市')
+                return None, None
+        
+        trades = self.tradeLedger.getData()
+        isLong = trades['direction'] == DIRECTION_LIST.index(DIRECTION_LONG)
+        signedVolumes = np.where(isLong, trades['volume'], -trades['volume'])
+        
+        df, barDf = calculateDailyResult(self.markArrays['datetime'], self.markArrays['close'],
+                                         trades['datetime'], trades['price'], signedVolumes,
+                                         self.strategyStartDate, self.initcapital, self.size,
+                                         self.rate, self.slippage, self.leverage)
+        if df is None:
+            self.output(u'无回测数据')
+        return df, barDf
+    
+    #----------------------------------------------------------------------
+    def showDailyResult(self, df=None, barDf=None):
+        """显示按日统计的结果"""
+        if df is None:
+            df, barDf = self.calculateDailyResult()
+        if df is None:
+            return
+        result = calculateDailyStatistics(df, barDf, self.initcapital)
+        
+        # 输出统计结果
+        self.output('-' * 30)
+        self.output(u'首个交易日：\t%s' % result['startDate'])
+        self.output(u'最后交易日：\t%s' % result['endDate'])
+        
+        self.output(u'总交易日：\t%s' % result['totalDays'])
+        self.output(u'盈利交易日\t%s' % result['profitDays'])
+        self.output(u'亏损交易日：\t%s' % result['lossDays'])
+        
+        self.output(u'起始资金：\t%s' % formatNumber(self.initcapital))
+        self.output(u'结束资金：\t%s' % formatNumber(result['endBalance']))
+    
+        self.output(u'总收益率：\t%s%%' % formatNumber(result['totalReturn']))
+        self.output(u'年化收益：\t%s%%' % formatNumber(result['annualizedReturn']))
+        self.output(u'总盈亏：\t%s' % formatNumber(result['totalNetPnl']))
+        self.output(u'最大回撤: \t%s' % formatNumber(result['maxDrawdown']))   
+        self.output(u'百分比最大回撤: %s%%' % formatNumber(result['maxDdPercent']))   
+        self.output(u'日内最大回撤: \t%s' % formatNumber(result['intradayMaxDrawdown']))   
+        self.output(u'日内百分比最大回撤: %s%%' % formatNumber(result['intradayMaxDdPercent']))   
+        
+        self.output(u'总手续费：\t%s' % formatNumber(result['totalCommission']))
+        self.output(u'总滑点：\t%s' % formatNumber(result['totalSlippage']))
+        self.output(u'总成交金额：\t%s' % formatNumber(result['totalTurnover']))
+        self.output(u'总成交笔数：\t%s' % formatNumber(result['totalTradeCount']))
+        
+        self.output(u'日均盈亏：\t%s' % formatNumber(result['dailyNetPnl']))
+        self.output(u'日均手续费：\t%s' % formatNumber(result['dailyCommission']))
+        self.output(u'日均滑点：\t%s' % formatNumber(result['dailySlippage']))
+        self.output(u'日均成交金额：\t%s' % formatNumber(result['dailyTurnover']))
+        self.output(u'日均成交笔数：\t%s' % formatNumber(result['dailyTradeCount']))
+        
+        self.output(u'日均收益率：\t%s%%' % formatNumber(result['dailyReturn']))
+        self.output(u'收益标准差：\t%s%%' % formatNumber(result['returnStd']))
+        self.output(u'夏普比率：\t%s' % formatNumber(result['sharpeRatio']))
+        
+        self.output(u'多仓总盈亏：\t%s' % formatNumber(result['longNetPnl']))
+        self.output(u'多仓夏普比率：\t%s' % formatNumber(result['longSharpeRatio']))
+        self.output(u'空仓总盈亏：\t%s' % formatNumber(result['shortNetPnl']))
+        self.output(u'空仓夏普比率：\t%s' % formatNumber(result['shortSharpeRatio']))
+        
         # 绘图
-        import matplotlib.pyplot as plt        
-        import numpy as np
+        import matplotlib.pyplot as plt
         
-        try:
-            import seaborn as sns       # 如果安装了seaborn则设置为白色风格
-            sns.set_style('whitegrid')  
-        except ImportError:
-            pass
-
-        pCapital = plt.subplot(4, 1, 1)
-        pCapital.set_ylabel("networth")
-        pCapital.plot(d['timeList'],d['networthList'], color='r', lw=0.8)
-
-        if not self.pnlPctToggle:
-            pDD = plt.subplot(4, 1, 2)
-            pDD.set_ylabel("DD")
-            pDD.bar(range(len(d['drawdownList'])), d['drawdownList'], color='g')
-
-
-            pPnl = plt.subplot(4, 1, 3)
-            pPnl.set_ylabel("pnl")
-            pPnl.hist(d['pnlList'], bins=50, color='c')
-        else:
-            pDDPCT = plt.subplot(4, 1, 2)
-            pDDPCT.set_ylabel("DD_PCT")
-            pDDPCT.bar(range(len(d['drawdownpctList'])), d['drawdownpctList'], color='g')
-
-            ppnlPct = plt.subplot(4, 1, 3)
-            ppnlPct.set_ylabel("pnlPct")
-            ppnlPct.hist(d['pnlPctList'], bins=50, color='c')
-
-
-
-        pPos = plt.subplot(4, 1, 4)
-        pPos.set_ylabel("Position")
-        if d['posList'][-1] == 0:
-            del d['posList'][-1]
-        tradeTimeIndex = [item.strftime("%Y/%m/%d %H:%M:%S") for item in d['tradeTimeList']]
-        xindex = np.arange(0, len(tradeTimeIndex), np.int(len(tradeTimeIndex)/10))
-        tradeTimeIndex = map(lambda i: tradeTimeIndex[i], xindex)
-        #pPos.plot(d['timeList'],d['posList'], color='k', drawstyle='steps-pre')
-        pPos.plot(d['posList'], color='k', drawstyle='steps-pre')
-        pPos.set_ylim(-1.2, 1.2)
-        plt.sca(pPos)
-        plt.tight_layout()
-        plt.xticks(xindex, tradeTimeIndex, rotation=10)  # 旋转15
+        pBalance = plt.subplot(4, 1, 1)
+        pBalance.set_title('Balance')
+        df['balance'].plot(legend=True)
+        
+        pDrawdown = plt.subplot(4, 1, 2)
+        pDrawdown.set_title('Intraday Drawdown')
+        pDrawdown.fill_between(range(len(barDf)), barDf['drawdown'].values)
+        
+        pPnl = plt.subplot(4, 1, 3)
+        pPnl.set_title('Daily Pnl (long / short)')
+        df[['longNetPnl', 'shortNetPnl']].plot(kind='bar', stacked=True, legend=True, ax=pPnl,
+                                               xticks=[])
         
+        pKDE = plt.subplot(4, 1, 4)
+        pKDE.set_title('Daily Pnl Distribution')
+        df['netPnl'].hist(bins=50)
+        
+        plt.tight_layout()
         plt.show()
+        
+        return result
     
     #----------------------------------------------------------------------
     def putStrategyEvent(self, name):
@@ -829,6 +1259,11 @@ class BacktestingEngine(object):
         """设置初始资金"""
         self.initcapital = initcapital
 
+    # ----------------------------------------------------------------------
+    def setCapital(self, capital):
+        """设置初始资金，和setInitialCapital相同"""
+        self.setInitialCapital(capital)
+
     # ----------------------------------------------------------------------
     def setLeverage(self, leverage):
         """设置杠杆"""
@@ -854,6 +1289,16 @@ class BacktestingEngine(object):
         """设置每笔盈亏百分比开关"""
         self.pnlPctToggle = pnlPctToggle
 
+    #----------------------------------------------------------------------
+    def setShowPlot(self, showPlot):
+        """设置显示回测结果时是否绘图，批量回测时关闭"""
+        self.showPlot = showPlot
+
+    #----------------------------------------------------------------------
+    def setReportFile(self, reportFile):
+        """设置回测报告文件名，扩展名为.html时导出HTML，否则导出PNG"""
+        self.reportFile = reportFile
+
     #----------------------------------------------------------------------
     def runOptimization(self, strategyClass, optimizationSetting):
         """优化参数"""
@@ -865,20 +1310,8 @@ class BacktestingEngine(object):
         if not settingList or not targetName:
             self.output(u'优化设置有问题，请检查')
         
-        # 遍历优化
-        resultList = []
-        for setting in settingList:
-            self.clearBacktestingResult()
-            self.output('-' * 30)
-            self.output('setting: %s' %str(setting))
-            self.initStrategy(strategyClass, setting)
-            self.runBacktesting()
-            d = self.calculateBacktestingResult()
-            try:
-                targetValue = d[targetName]
-            except KeyError:
-                targetValue = 0
-            resultList.append(([str(setting)], targetValue))
+        resultList = [([settingStr], targetValue) for settingStr, targetValue
+                      in self.runSettingList(strategyClass, settingList, targetName)]
         
         # 显示结果
         resultList.sort(reverse=True, key=lambda result:result[1])
@@ -887,27 +1320,72 @@ class BacktestingEngine(object):
         for result in resultList:
             self.output(u'%s: %s' %(result[0], result[1]))
         return result
+    
+    #----------------------------------------------------------------------
+    def runSettingList(self, strategyClass, settingList, targetName):
+        """逐个回测参数组合，返回[(参数字符串, 目标值)]，缓存中已有的参数组合直接读取"""
+        # 跳过缓存中已有的参数组合
+        settingList, resultList, keyDict = self.getCachedResults(strategyClass, settingList,
+                                                                 targetName)
+        
+        # 优化过程中关闭日志
+        logLevel = self.logger.level
+        self.setLogLevel(LOG_DISABLED)
+        
+        # 遍历优化，策略出错时也要恢复日志级别
+        newList = []
+        try:
+            for setting in settingList:
+                self.clearBacktestingResult()
+                self.output('-' * 30)
+                self.output('setting: %s' %str(setting))
+                self.initStrategy(strategyClass, setting)
+                self.runBacktesting()
+                d = self.calculateBacktestingResult()
+                try:
+                    targetValue = d[targetName]
+                except KeyError:
+                    targetValue = 0
+                if self.stopReason:
+                    targetValue = STOPPED_TARGET_VALUE
+                newList.append((str(setting), targetValue))
+        finally:
+            self.setLogLevel(logLevel)
+        
+        self.saveCachedResults(newList, keyDict, targetName)
+        return resultList + newList
             
     #----------------------------------------------------------------------
     def clearBacktestingResult(self):
         """清空之前回测的结果"""
         # 清空限价单相关
         self.limitOrderCount = 0
-        self.limitOrderDict.clear()
+        self.limitOrderLedger.clear()
         self.workingLimitOrderDict.clear()        
+        self.limitOrderBook.clear()
         
         # 清空停止单相关
         self.stopOrderCount = 0
-        self.stopOrderDict.clear()
+        self.stopOrderLedger.clear()
         self.workingStopOrderDict.clear()
+        self.stopOrderBook.clear()
         
         # 清空成交相关
         self.tradeCount = 0
-        self.tradeDict.clear()
+        self.tradeLedger.clear()
+        
+        # 清空在线统计
+        self.runningMetrics.clear()
+        self.stopReason = ''
         
     #----------------------------------------------------------------------
-    def runParallelOptimization(self, strategyClass, optimizationSetting):
-        """并行优化参数"""
+    def runParallelOptimization(self, strategyClass, optimizationSetting, keepPool=False,
+                                chunkSize=0):
+        """
+        并行优化参数
+        使用常驻进程池，参数组合分块发送，结果按完成的先后顺序返回；
+        keepPool为True时优化结束后保留进程池，供下一次优化复用，需要手动调用closeOptimizationPool
+        """
         # 获取优化设置        
         settingList = optimizationSetting.generateSetting()
         targetName = optimizationSetting.optimizeTarget
@@ -916,42 +1394,245 @@ class BacktestingEngine(object):
         if not settingList or not targetName:
             self.output(u'优化设置有问题，请检查')
         
-        # 多进程优化，启动一个对应CPU核心数量的进程池
-        pool = multiprocessing.Pool(multiprocessing.cpu_count()-1)
-        l = []
-
-        for setting in settingList:
-            #print setting
-            #temporesult = optimize(strategyClass, setting, targetName,
-             #self.mode, self.startDate, self.initDays, self.endDate,self.initcapital,
-              #                     self.slippage, self.rate, self.size, self.priceTick,
-               #                    self.dbName, self.symbol)
-            #print temporesult
-            l.append(pool.apply_async(optimize, (strategyClass, setting,
-                                                 targetName, self.mode, 
-                                                 self.startDate, self.initDays, self.endDate,self.initcapital,
-                                                 self.slippage, self.rate, self.size, self.priceTick,
-                                                 self.dbName, self.symbol)))
-        pool.close()
-        pool.join()
+        resultList = self.runParallelSettingList(strategyClass, settingList, targetName,
+                                                 keepPool, chunkSize)
         
         # 显示结果
+        resultList.sort(reverse=True, key=lambda result: result[1])
+        self.output('-' * 30)
+        self.output(u'优化结果：')
+        for result in resultList:
+            self.output(u'%s: %s' % (result[0], result[1]))
+        return resultList
+    
+    #----------------------------------------------------------------------
+    def runParallelSettingList(self, strategyClass, settingList, targetName, keepPool=False,
+                               chunkSize=0):
+        """使用常驻进程池回测参数组合，返回[(参数字符串, 目标值)]，缓存中已有的参数组合直接读取"""
+        newList = []
+        try:
+            pool = self.getOptimizationPool()
+            
+            # 跳过缓存中已有的参数组合
+            settingList, resultList, keyDict = self.getCachedResults(strategyClass, settingList,
+                                                                     targetName)
+            
+            for settingStr, targetValue in pool.imapResults(strategyClass, settingList,
+                                                            targetName, chunkSize):
+                newList.append((settingStr, targetValue))
+        finally:
+            if not keepPool:
+                self.closeOptimizationPool()
+        
+        # 回测出错的参数组合目标值为None，不写入缓存
+        errorCount = len([result for result in newList if result[1] is None])
+        if errorCount:
+            self.output(u'回测出错的参数组合：%s个，目标值记为0' %errorCount)
+        self.saveCachedResults([result for result in newList if result[1] is not None],
+                               keyDict, targetName)
+        for settingStr, targetValue in newList:
+            resultList.append((settingStr, 0 if targetValue is None else targetValue))
+        return resultList
+    
+    #----------------------------------------------------------------------
+    def runSuccessiveHalving(self, strategyClass, optimizationSetting, eta=3, minDays=30,
+                             parallel=False):
+        """
+        逐级减半优化参数
+        全部参数组合先在策略启动后较短的窗口上回测，每级只保留目标值靠前的1/eta，
+        窗口长度每级增加eta倍，最短不少于minDays天，最后一级使用完整的回测区间
+        parallel为True时每一级使用多进程回测
+        """
+        # 获取优化设置        
+        settingList = optimizationSetting.generateSetting()
+        targetName = optimizationSetting.optimizeTarget
+        
+        # 检查参数设置问题
+        if not settingList or not targetName:
+            self.output(u'优化设置有问题，请检查')
+            return []
+        
+        if not self.dataEndDate:
+            self.output(u'逐级减半需要设置回测结束日期')
+            return []
+        
+        if parallel:
+            runFunc = self.runParallelSettingList
+        else:
+            runFunc = self.runSettingList
+        
+        windowList = halvingWindows(self.strategyStartDate, self.dataEndDate, eta, minDays)
+        endDate = self.endDate
         try:
-            resultList = [res.get() if res.successful() else ('No-key',0) for res in l]
-            resultList.sort(reverse=True, key=lambda result: result[1])
-            print resultList
-            self.output('-' * 30)
-            self.output(u'优化结果：')
-            for result in resultList:
-                self.output(u'%s: %s' % (result[0], result[1]))
-        except Exception as e:
-            print('Caught exception in worker thread :' )
-            traceback.print_exc()
+            # 较短的窗口上回测，只保留靠前的参数组合
+            for windowEnd in windowList[:-1]:
+                if len(settingList) <= 1:
+                    break
+                
+                self.setEndDate(windowEnd)
+                # 目标值相同时按参数组合的顺序晋级，单进程和多进程的结果一致
+                resultList = rankResults(runFunc(strategyClass, settingList, targetName),
+                                         settingList)
+                
+                settingDict = dict((str(setting), setting) for setting in settingList)
+                promoted = resultList[:promoteCount(len(resultList), eta)]
+                self.output(u'逐级减半：回测至%s，参数组合%s个，晋级%s个，最优%s: %s'
+                            %(windowEnd, len(resultList), len(promoted),
+                              promoted[0][0], promoted[0][1]))
+                settingList = [settingDict[settingStr] for settingStr, targetValue in promoted]
+            
+            # 完整的回测区间
+            self.setEndDate(endDate)
+            resultList = rankResults(runFunc(strategyClass, settingList, targetName),
+                                     settingList)
+        finally:
+            self.setEndDate(endDate)
+        
+        # 显示结果
+        self.output('-' * 30)
+        self.output(u'优化结果：')
+        for result in resultList:
+            self.output(u'%s: %s' % (result[0], result[1]))
+        return resultList
+    
+    #----------------------------------------------------------------------
+    def getDataFingerprint(self):
+        """
+        回测数据的指纹，用于优化结果缓存的键，不需要载入数据
+        本地文件数据源和压缩Tick存储为品种目录下文件的大小和修改时间，
+        数据库为回测区间的数据量和最后一条数据的时间，均可通过datetime索引快速完成
+        """
+        if self.dataSource and self.mode == self.BAR_MODE:
+            return hashContent([self.symbol,
+                                directoryFingerprint(self.dataSource.getSymbolPath(self.symbol))])
+        
+        if self.tickStore and self.mode == self.TICK_MODE:
+            return hashContent([self.symbol,
+                                directoryFingerprint(self.tickStore.getSymbolPath(self.symbol))])
+        
+        dbClient = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+        collection = dbClient[self.dbName][self.symbol]
+        flt = self.makeDataFilter()
+        count = collection.find(flt).count()
+        last = list(collection.find(flt, {'datetime': True}).sort('datetime', pymongo.DESCENDING).limit(1))
+        lastDatetime = last[0]['datetime'] if last else None
+        return hashContent([self.dbName, self.symbol, count, lastDatetime])
+    
+    #----------------------------------------------------------------------
+    def getCachedResults(self, strategyClass, settingList, targetName):
+        """
+        查询优化结果缓存
+        返回(需要回测的参数组合列表, 已缓存的[(参数字符串, 目标值)]列表, {参数字符串: 缓存键})
+        """
+        if not self.resultCache or not settingList:
+            return settingList, [], {}
+        
+        strategyHash = strategyFingerprint(strategyClass)
+        engineSetting = self.getEngineSetting()
+        dataHash = self.getDataFingerprint()
+        keyDict = {}
+        for setting in settingList:
+            keyDict[str(setting)] = makeCacheKey(strategyHash, setting, engineSetting, dataHash)
+        
+        cachedDict = self.resultCache.getResults(keyDict.values(), targetName)
+        pendingList = []
+        cachedList = []
+        for setting in settingList:
+            settingStr = str(setting)
+            key = keyDict[settingStr]
+            if key in cachedDict:
+                cachedList.append((settingStr, cachedDict[key]))
+            else:
+                pendingList.append(setting)
+        
+        self.output(u'优化结果缓存命中：%s，需要回测：%s' %(len(cachedList), len(pendingList)))
+        return pendingList, cachedList, keyDict
+    
+    #----------------------------------------------------------------------
+    def saveCachedResults(self, resultList, keyDict, targetName):
+        """将新计算的[(参数字符串, 目标值)]写入优化结果缓存"""
+        if not self.resultCache or not resultList:
+            return
+        
+        recordList = [(keyDict[settingStr], settingStr, targetValue)
+                      for settingStr, targetValue in resultList]
+        self.resultCache.putResults(recordList, targetName)
+    
+    #----------------------------------------------------------------------
+    def getEngineSetting(self):
+        """导出子进程回测引擎需要的设置"""
+        setting = {}
+        setting['mode'] = self.mode
+        setting['startDate'] = self.startDate
+        setting['initDays'] = self.initDays
+        setting['endDate'] = self.endDate
+        setting['initcapital'] = self.initcapital
+        setting['slippage'] = self.slippage
+        setting['rate'] = self.rate
+        setting['size'] = self.size
+        setting['priceTick'] = self.priceTick
+        setting['leverage'] = self.leverage
+        setting['dbName'] = self.dbName
+        setting['symbol'] = self.symbol
+        setting['dataSource'] = (self.dataSource.root, self.dataSource.fileFormat) if self.dataSource else None
+        setting['tickStoreRoot'] = self.tickStore.root if self.tickStore else None
+        setting['barCachePath'] = self.barCache.cachePath if self.barCache else None
+        setting['reuseBar'] = self.reuseBar
+        setting['prefetch'] = (self.prefetchBatchSize, self.prefetchQueueSize)
+        setting['barGeneratorList'] = list(self.barGeneratorList)
+        setting['stopConditionList'] = list(self.stopConditionList)
+        return setting
+    
+    #----------------------------------------------------------------------
+    def getOptimizationPool(self):
+        """
+        获取多进程优化的常驻进程池，回测设置改变时重新创建
+        K线模式下由父进程载入一次数据，写入共享数据集供所有子进程挂载；
+        Tick模式下子进程按导出的设置自行载入数据，数据来源必须是压缩Tick存储或数据库
+        """
+        if self.mode == self.TICK_MODE:
+            if not self.tickStore and not self.dbName:
+                raise ValueError(u'Tick模式的多进程优化需要设置压缩Tick存储或数据库')
+        elif not self.dataSource and not self.dbName:
+            raise ValueError(u'多进程优化需要设置本地文件数据源或数据库')
+        
+        setting = self.getEngineSetting()
+        pool = self.optimizationPool
+        if pool:
+            poolSetting = dict(pool.engineSetting)
+            poolSetting.pop('sharedDataPath')
+            if poolSetting == setting:
+                return pool
+            self.closeOptimizationPool()
+        
+        if self.mode == self.BAR_MODE:
+            self.optimizationDataset = self.createSharedDataset()
+        setting['sharedDataPath'] = self.optimizationDataset.path if self.optimizationDataset else ''
+        
+        self.optimizationPool = OptimizationPool(self.__class__, setting)
+        return self.optimizationPool
+    
+    #----------------------------------------------------------------------
+    def closeOptimizationPool(self):
+        """关闭常驻进程池，子进程全部结束后删除共享数据"""
+        if self.optimizationPool:
+            self.optimizationPool.close()
+            self.optimizationPool = None
+        
+        if self.optimizationDataset:
+            self.optimizationDataset.release()
+            self.optimizationDataset = None
 
-            raise e
+    #----------------------------------------------------------------------
+    def createSharedDataset(self):
+        """载入整个回测区间的K线，创建供多进程共享的数据集"""
+        self.output(u'开始载入共享数据')
+        arrays, info = self.loadArrayData()
+        dataset = SharedBarDataset.create(arrays, info)
 
+        self.output(u'共享数据创建完成，数据量：%s' %len(arrays['datetime']))
+        return dataset
 
-            
     #----------------------------------------------------------------------
     def roundToPriceTick(self, price):
         """取整价格到合约最小价格变动"""
@@ -961,25 +1642,6 @@ class BacktestingEngine(object):
         newPrice = round(price/self.priceTick, 0) * self.priceTick
         return newPrice
 
-    # ----------------------------------------------------------------------
-    def output_csv(self, recordList):
-        """记录交易记录"""
-
-        filecolumns = ['entryPrice', 'exitPrice', 'entryDt', 'exitDt', 'volume', 'turnover',
-                       'commission', 'slippage', 'pnl']
-
-        totalList = []
-        for i in recordList:
-            recordItem = [i.entryPrice, i.exitPrice, i.entryDt, i.exitDt, i.volume, i.turnover, i.commission, i.slippage,
-                 i.pnl]
-            totalList.append(recordItem)
-        df = pd.DataFrame(data=totalList,columns=filecolumns, dtype=float)
-        df.to_csv(self.savepath+self.strategy.name + self.startDate + '-' + self.endDate +
-                  '.' + 'csv',na_rep='NaN',date_format='%Y%m%d',index=False)
-
-
-
-        
 
 ########################################################################
 class TradingResult(object):
@@ -1017,6 +1679,10 @@ class OptimizationSetting(object):
         
         self.optimizeTarget = ''        # 优化目标字段
         
+        self.searchMode = SEARCH_GRID   # 参数组合的生成方式
+        self.sampleNum = 0              # 抽样生成的参数组合数量
+        self.seed = None                # 抽样的随机数种子
+        
     #----------------------------------------------------------------------
     def addParameter(self, name, start, end=None, step=None):
         """增加优化参数"""
@@ -1041,9 +1707,26 @@ class OptimizationSetting(object):
         
         self.paramDict[name] = l
         
+    #----------------------------------------------------------------------
+    def setSearchMode(self, mode, sampleNum=0, seed=None):
+        """
+        设置参数组合的生成方式：网格（全部组合）、随机抽样或拉丁超立方抽样
+        抽样时从网格中生成sampleNum个参数组合
+        """
+        if mode not in [SEARCH_GRID, SEARCH_RANDOM, SEARCH_LHS]:
+            print u'不支持的参数组合生成方式：%s' %mode
+            return
+        
+        self.searchMode = mode
+        self.sampleNum = sampleNum
+        self.seed = seed
+        
     #----------------------------------------------------------------------
     def generateSetting(self):
         """生成优化参数组合"""
+        if self.searchMode != SEARCH_GRID:
+            return sampleSettings(self.paramDict, self.searchMode, self.sampleNum, self.seed)
+        
         # 参数名的列表
         nameList = self.paramDict.keys()
         paramList = self.paramDict.values()
@@ -1065,6 +1748,67 @@ class OptimizationSetting(object):
         self.optimizeTarget = target
 
 
+#----------------------------------------------------------------------
+def matchTradesFifo(isLong, volumes):
+    """
+    按先进先出的规则配对开平仓成交
+    isLong为每笔成交是否为买入，volumes为成交数量（正数）。
+    成交先平掉反向的持仓，剩余部分作为同向的开仓；
+    将开仓和平仓数量分别在多头、空头各自的累计数量轴上排开，两者的分界点即为配对的结果。
+    返回(开仓成交位置, 平仓成交位置, 配对数量)，多头交易的配对数量为正，空头为负，
+    按平仓成交的顺序排列，同一笔平仓成交内按开仓的先后排列
+    """
+    volumes = np.asarray(volumes, dtype=np.float64)
+    signedVolumes = np.where(isLong, volumes, -volumes)
+    prevPos = np.cumsum(signedVolumes) - signedVolumes      # 成交前的持仓
+
+    # 每笔成交中平仓和开仓的数量
+    closeVolumes = np.where(isLong, np.minimum(volumes, np.maximum(-prevPos, 0)),
+                            np.minimum(volumes, np.maximum(prevPos, 0)))
+    openVolumes = volumes - closeVolumes
+
+    entryList = []
+    exitList = []
+    volumeList = []
+    for openMask, closeMask, sign in ((isLong, ~isLong, 1), (~isLong, isLong, -1)):
+        openIndex = np.flatnonzero(openMask & (openVolumes > 0))
+        closeIndex = np.flatnonzero(closeMask & (closeVolumes > 0))
+        if not len(closeIndex):
+            continue
+
+        openEnds = np.cumsum(openVolumes[openIndex])
+        closeEnds = np.cumsum(closeVolumes[closeIndex])
+
+        # 开平仓累计数量的分界点，平仓总数不会超过开仓总数
+        bounds = np.union1d(openEnds, closeEnds)
+        bounds = bounds[bounds <= closeEnds[-1]]
+        starts = np.append(0, bounds[:-1])
+
+        entryList.append(openIndex[openEnds.searchsorted(starts, 'right')])
+        exitList.append(closeIndex[closeEnds.searchsorted(starts, 'right')])
+        volumeList.append(sign * (bounds - starts))
+
+    if not volumeList:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float64)
+
+    entryIndex = np.concatenate(entryList)
+    exitIndex = np.concatenate(exitList)
+    volume = np.concatenate(volumeList)
+
+    # 按平仓成交的顺序排列，同一笔平仓成交内保持先进先出的顺序
+    order = np.argsort(exitIndex, kind='mergesort')
+    return entryIndex[order], exitIndex[order], volume[order]
+
+
+#----------------------------------------------------------------------
+def sequentialSum(values):
+    """按顺序逐个累加求和，和Python循环累加的结果一致"""
+    if not len(values):
+        return 0
+    return float(np.cumsum(values)[-1])
+
+
 #----------------------------------------------------------------------
 def formatNumber(n):
     """格式化数字到字符串"""
@@ -1076,7 +1820,7 @@ def formatNumber(n):
 def optimize(strategyClass, setting, targetName,
              mode, startDate, initDays, endDate,initcapital,
              slippage, rate, size, pricetick,
-             dbName, symbol):
+             dbName, symbol, sharedDataPath='', barGeneratorList=None, stopConditionList=None):
     """多进程优化时跑在每个进程中运行的函数"""
     engine = BacktestingEngine()
     engine.setBacktestingMode(mode)
@@ -1088,6 +1832,12 @@ def optimize(strategyClass, setting, targetName,
     engine.setSize(size)
     engine.setPriceTick(pricetick)
     engine.setDatabase(dbName, symbol)
+    engine.sharedDataPath = sharedDataPath
+    engine.setLogLevel(LOG_DISABLED)
+    for generator in barGeneratorList or []:
+        engine.setBarGenerator(*generator)
+    for condition in stopConditionList or []:
+        engine.addStopCondition(condition)
     
     engine.initStrategy(strategyClass, setting)
     engine.runBacktesting()
@@ -1097,6 +1847,8 @@ def optimize(strategyClass, setting, targetName,
         targetValue = d[targetName]
     except KeyError:
         targetValue = 0
+    if engine.stopReason:
+        targetValue = STOPPED_TARGET_VALUE
     return (str(setting), targetValue)    
 
 
@@ -0,0 +1,286 @@
+# encoding: UTF-8
+
+'''
+本文件中包含了基于列数据的K线回放工具。
+
+回测时如果每根K线都创建一个VtBarData并保存完整的数据库文档（包括_id、
+重复的date/time字符串），在多年的1分钟数据上会带来大量的内存和GC开销。
+这里的ArrayBar使用__slots__，只保存策略需要的字段，date和time在访问时
+才由datetime生成，和VtBarData的属性保持一致，可以直接推送给onBar。
+
+resampleBarArrays在载入数据时一次性向量化地聚合出5分钟、15分钟等大周期K线，
+同时保留每根大周期K线内部的1分钟成交量和持仓量序列。策略开启engineAggregation时，
+在onInit中调用checkBarGenerators检查引擎是否设置了需要的大周期K线。
+
+SharedBarDataset用于多进程优化时在父进程和各个子进程之间共享同一份K线数据。
+'''
+
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBarCache import BAR_COLUMNS, DATETIME_COLUMN
+
+
+# 每次从列数据中转换为Python对象的K线数量，控制回放过程中的内存占用
+REPLAY_CHUNK_SIZE = 10000
+
+# 共享数据集中保存合约信息的文件名
+SHARED_INFO_FILENAME = 'info.json'
+
+
+########################################################################
+class ArrayBar(object):
+    """
+    轻量K线对象
+    属性和VtBarData保持一致，供策略的onBar使用
+    """
+    __slots__ = ['vtSymbol', 'symbol', 'exchange',
+                 'open', 'high', 'low', 'close',
+                 'volume', 'openInterest', 'datetime']
+
+    gatewayName = ''
+    rawData = None
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol='', symbol='', exchange=''):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.symbol = symbol
+        self.exchange = exchange
+
+        self.open = 0.0
+        self.high = 0.0
+        self.low = 0.0
+        self.close = 0.0
+        self.volume = 0
+        self.openInterest = 0
+        self.datetime = None
+
+    #----------------------------------------------------------------------
+    @property
+    def date(self):
+        """K线日期字符串"""
+        return self.datetime.strftime('%Y%m%d')
+
+    #----------------------------------------------------------------------
+    @property
+    def time(self):
+        """K线时间字符串"""
+        return self.datetime.strftime('%H:%M:%S')
+
+    #----------------------------------------------------------------------
+    def toBarData(self, dataClass):
+        """转化为完整的K线对象（如VtBarData），用于需要保存K线的场合"""
+        bar = dataClass()
+        for name in self.__slots__:
+            setattr(bar, name, getattr(self, name))
+        bar.date = self.date
+        bar.time = self.time
+        return bar
+
+
+########################################################################
+class AggregatedBar(ArrayBar):
+    """
+    大周期K线对象
+    volumeList为周期内每根1分钟K线的成交量，
+    openInterestList为上一根大周期K线结束时的持仓量加上周期内每根1分钟K线的持仓量
+    """
+    __slots__ = ['volumeList', 'openInterestList']
+
+
+#----------------------------------------------------------------------
+def resampleBarArrays(arrays, window, offset=1):
+    """
+    将1分钟K线列数据聚合为window分钟的K线
+    当1分钟K线的(分钟数+offset)能被window整除时，该K线为一个大周期的最后一根，
+    和策略中的聚合规则一致：offset为1对应(minute+1) % barBin == 0，
+    offset为0对应minute % barBin == 0；
+    没有开始K线的周期（只有结束K线）和最后未走完的周期不会生成。
+
+    返回的字典中除K线字段外还包括：
+    start、end：每根大周期K线在1分钟数据中的首尾位置
+    prevEnd：上一根大周期K线的结束位置，第一根为-1
+    """
+    datetimes = arrays[DATETIME_COLUMN]
+    minutes = datetimes.astype('datetime64[m]').astype(np.int64) % 60
+    ends = np.nonzero((minutes + offset) % window == 0)[0]
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+
+    if window > 1:
+        valid = ends > starts
+        starts = starts[valid]
+        ends = ends[valid]
+
+    result = {}
+    result['start'] = starts
+    result['end'] = ends
+    result['prevEnd'] = np.concatenate([[-1], ends[:-1]]).astype(np.int64)
+    result[DATETIME_COLUMN] = datetimes[starts]
+
+    if not len(starts):
+        for name in BAR_COLUMNS:
+            result[name] = np.array([], dtype=np.float64)
+        return result
+
+    # reduceat的分段为[start, end+1)，末尾补一个元素防止end+1越界
+    index = np.empty(len(starts) * 2, dtype=np.int64)
+    index[0::2] = starts
+    index[1::2] = ends + 1
+
+    def reduce(ufunc, values):
+        values = np.append(np.asarray(values), 0)
+        return ufunc.reduceat(values, index)[0::2]
+
+    result['open'] = np.asarray(arrays['open'])[starts]
+    result['high'] = reduce(np.maximum, arrays['high'])
+    result['low'] = reduce(np.minimum, arrays['low'])
+    result['close'] = np.asarray(arrays['close'])[ends]
+    result['volume'] = reduce(np.add, arrays['volume'])
+    result['openInterest'] = np.asarray(arrays['openInterest'])[ends]
+
+    return result
+
+
+#----------------------------------------------------------------------
+def resampleAggregatedArrays(base, window, offset):
+    """
+    在已聚合的大周期K线上继续聚合，如由5分钟K线聚合15分钟K线
+    base为resampleBarArrays的返回值，大周期K线的时间为其第一根1分钟K线的时间，
+    因此策略中(fiveBar.datetime.minute + barBin) % barLongBin == 0的规则对应offset为barBin；
+    返回结果中的位置换算回1分钟数据中的位置
+    """
+    result = resampleBarArrays(base, window, offset)
+
+    prevEnd = result['prevEnd']
+    result['start'] = base['start'][result['start']]
+    result['end'] = base['end'][result['end']]
+    result['prevEnd'] = np.where(prevEnd >= 0, base['end'][prevEnd], -1)
+    return result
+
+
+#----------------------------------------------------------------------
+def checkBarGenerators(strategy, generatorList):
+    """
+    策略开启了engineAggregation时，检查引擎是否通过setBarGenerator设置了generatorList中
+    每个(分钟数, 回调函数名)的大周期K线，没有设置时策略收不到大周期K线，也不会交易，直接报错
+    """
+    if not strategy.engineAggregation:
+        return
+
+    hasBarGenerator = getattr(strategy.ctaEngine, 'hasBarGenerator', None)
+    for window, callbackName in generatorList:
+        if not hasBarGenerator or not hasBarGenerator(window, callbackName):
+            raise ValueError(u'engineAggregation已开启，但引擎没有通过setBarGenerator设置'
+                             u'推送到%s的%s分钟K线' % (callbackName, window))
+
+
+#----------------------------------------------------------------------
+def makeAggregatedBar(arrays, resampled, n, info=None):
+    """生成第n根大周期K线对象"""
+    info = info or {}
+    bar = AggregatedBar(info.get('vtSymbol', ''), info.get('symbol', ''), info.get('exchange', ''))
+
+    bar.datetime = resampled[DATETIME_COLUMN][n].astype(object)
+    bar.open = float(resampled['open'][n])
+    bar.high = float(resampled['high'][n])
+    bar.low = float(resampled['low'][n])
+    bar.close = float(resampled['close'][n])
+    bar.volume = float(resampled['volume'][n])
+    bar.openInterest = float(resampled['openInterest'][n])
+
+    start = resampled['start'][n]
+    end = resampled['end'][n] + 1
+    prevEnd = resampled['prevEnd'][n]
+
+    openInterests = arrays['openInterest']
+    preOpenInterest = openInterests[prevEnd] if prevEnd >= 0 else 0
+
+    bar.volumeList = arrays['volume'][start:end]
+    bar.openInterestList = np.concatenate([[preOpenInterest], openInterests[start:end]])
+    return bar
+
+
+#----------------------------------------------------------------------
+def iterArrayBars(arrays, info=None, reuse=False):
+    """
+    从列数据中逐根生成ArrayBar
+    reuse为True时整个回放过程只使用同一个对象，适用于不保存K线引用的策略
+    """
+    info = info or {}
+    vtSymbol = info.get('vtSymbol', '')
+    symbol = info.get('symbol', '')
+    exchange = info.get('exchange', '')
+
+    total = len(arrays[DATETIME_COLUMN])
+    bar = ArrayBar(vtSymbol, symbol, exchange)
+
+    # 分块转换为Python对象，避免一次性展开全部数据
+    for start in range(0, total, REPLAY_CHUNK_SIZE):
+        end = min(start + REPLAY_CHUNK_SIZE, total)
+
+        datetimes = arrays[DATETIME_COLUMN][start:end].astype(object)
+        opens, highs, lows, closes, volumes, openInterests = [arrays[name][start:end].tolist()
+                                                              for name in BAR_COLUMNS]
+
+        for i, dt in enumerate(datetimes):
+            if not reuse:
+                bar = ArrayBar(vtSymbol, symbol, exchange)
+
+            bar.datetime = dt
+            bar.open = opens[i]
+            bar.high = highs[i]
+            bar.low = lows[i]
+            bar.close = closes[i]
+            bar.volume = volumes[i]
+            bar.openInterest = openInterests[i]
+            yield bar
+
+
+########################################################################
+class SharedBarDataset(object):
+    """
+    多进程共享的K线数据集
+    父进程将列数据写入临时目录下的npy文件，子进程以只读内存映射的方式挂载，
+    所有进程共享操作系统的页缓存，无需重复载入和复制数据
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, path):
+        """Constructor"""
+        self.path = path
+
+    #----------------------------------------------------------------------
+    @classmethod
+    def create(cls, arrays, info=None):
+        """由列数据创建共享数据集"""
+        path = tempfile.mkdtemp(prefix='ctaBars_')
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            np.save(os.path.join(path, name + '.npy'), arrays[name])
+
+        with open(os.path.join(path, SHARED_INFO_FILENAME), 'w') as f:
+            json.dump(info or {}, f)
+
+        return cls(path)
+
+    #----------------------------------------------------------------------
+    def attach(self):
+        """挂载共享数据集，返回(列数据字典, 合约信息字典)"""
+        arrays = {}
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            arrays[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+        with open(os.path.join(self.path, SHARED_INFO_FILENAME)) as f:
+            info = json.load(f)
+
+        return arrays, info
+
+    #----------------------------------------------------------------------
+    def release(self):
+        """删除共享数据集的临时文件"""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
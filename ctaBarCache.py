@@ -0,0 +1,261 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测用的K线列式缓存，将MongoDB中的分钟线按列存储为
+numpy的npy文件，重复回测时直接内存映射载入，无需再次扫描数据库。
+
+缓存目录结构：
+    cachePath/dbName/symbol/起始日期_结束日期/
+        datetime.npy, open.npy, high.npy, low.npy, close.npy,
+        volume.npy, openInterest.npy, meta.json
+
+meta.json中保存了每个自然月的指纹（数据条数、最后一条的时间和各字段的合计值），
+载入时逐月和数据库比对，只重新读取发生变化的月份。指纹在数据库端聚合计算，
+重新导入时按datetime原地覆盖的修正数据也会改变指纹。
+'''
+
+import os
+import json
+import shutil
+from datetime import datetime
+from collections import OrderedDict
+
+import numpy as np
+
+
+# 列式存储的K线字段
+BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'openInterest']
+DATETIME_COLUMN = 'datetime'
+DATETIME_DTYPE = 'datetime64[us]'
+
+# 缓存中保存的合约信息字段
+BAR_META_FIELDS = ['vtSymbol', 'symbol', 'exchange']
+
+# 从数据库读取缓存数据时的投影
+CACHE_PROJECTION = dict([('_id', 0), (DATETIME_COLUMN, 1)] +
+                        [(name, 1) for name in BAR_COLUMNS + BAR_META_FIELDS])
+
+META_FILENAME = 'meta.json'
+MONTH_FORMAT = '%Y%m'
+
+
+#----------------------------------------------------------------------
+def emptyBarArrays():
+    """生成空的K线列数据字典"""
+    arrays = {DATETIME_COLUMN: np.array([], dtype=DATETIME_DTYPE)}
+    for name in BAR_COLUMNS:
+        arrays[name] = np.array([], dtype=np.float64)
+    return arrays
+
+
+#----------------------------------------------------------------------
+def barDocsToArrays(docs):
+    """将数据库中读出的K线文档列表转化为列数据字典"""
+    if not docs:
+        return emptyBarArrays()
+
+    arrays = {}
+    arrays[DATETIME_COLUMN] = np.array([d['datetime'] for d in docs], dtype=DATETIME_DTYPE)
+    for name in BAR_COLUMNS:
+        arrays[name] = np.array([d.get(name, 0) or 0 for d in docs], dtype=np.float64)
+    return arrays
+
+
+#----------------------------------------------------------------------
+def sliceBarArrays(arrays, start, end):
+    """按位置切片列数据字典（切片为视图，不复制内存映射数据）"""
+    return {k: v[start:end] for k, v in arrays.items()}
+
+
+#----------------------------------------------------------------------
+def concatBarArrays(arraysList):
+    """按时间顺序合并多个列数据字典"""
+    arraysList = [a for a in arraysList if len(a[DATETIME_COLUMN])]
+    if not arraysList:
+        return emptyBarArrays()
+
+    merged = {}
+    for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+        merged[name] = np.concatenate([a[name] for a in arraysList])
+
+    # 使用稳定排序，保证同一时间戳的数据保持原有顺序
+    order = np.argsort(merged[DATETIME_COLUMN], kind='mergesort')
+    return {k: v[order] for k, v in merged.items()}
+
+
+#----------------------------------------------------------------------
+def monthRange(startDate, endDate):
+    """生成覆盖[startDate, endDate]的所有自然月的(月初, 下月初)列表"""
+    months = []
+    month = datetime(startDate.year, startDate.month, 1)
+    while month <= endDate:
+        if month.month == 12:
+            nextMonth = datetime(month.year+1, 1, 1)
+        else:
+            nextMonth = datetime(month.year, month.month+1, 1)
+        months.append((month, nextMonth))
+        month = nextMonth
+    return months
+
+
+########################################################################
+class BarCache(object):
+    """
+    K线列式缓存
+    以(数据库名, 集合名, 日期区间)为键，缓存为内存映射的npy文件
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, cachePath=''):
+        """Constructor"""
+        if not cachePath:
+            cachePath = os.path.join(os.getcwd(), 'barCache')
+        self.cachePath = cachePath
+
+    #----------------------------------------------------------------------
+    def getEntryPath(self, dbName, symbol, startDate, endDate):
+        """获取某个缓存条目所在的目录"""
+        start = startDate.strftime('%Y%m%d')
+        end = endDate.strftime('%Y%m%d') if endDate else 'latest'
+        return os.path.join(self.cachePath, dbName, symbol, '%s_%s' %(start, end))
+
+    #----------------------------------------------------------------------
+    def loadBarArrays(self, collection, dbName, symbol, startDate, endDate=None):
+        """
+        载入[startDate, endDate]区间的K线列数据，endDate为空则载入到最新数据
+        返回(列数据字典, 合约信息字典)
+        """
+        entryPath = self.getEntryPath(dbName, symbol, startDate, endDate)
+
+        # 确定需要比对的月份区间
+        if endDate:
+            lastDate = endDate
+        else:
+            lastDoc = self.findLastDoc(collection, {})
+            lastDate = lastDoc['datetime'] if lastDoc else startDate
+        months = monthRange(startDate, lastDate)
+
+        # 逐月计算数据库中的指纹，并和缓存比对
+        fingerprints = OrderedDict()
+        for monthStart, monthEnd in months:
+            flt = self.makeFilter(max(monthStart, startDate), monthEnd, endDate)
+            fingerprints[monthStart.strftime(MONTH_FORMAT)] = self.makeFingerprint(collection, flt)
+
+        meta = self.readMeta(entryPath)
+        cached = meta.get('fingerprints', {}) if meta else {}
+        staleMonths = [m for m in fingerprints.keys() if cached.get(m) != fingerprints[m]]
+
+        # 缓存完全有效，直接内存映射载入
+        if meta and not staleMonths and set(cached.keys()) == set(fingerprints.keys()):
+            return self.readArrays(entryPath), meta.get('info', {})
+
+        # 保留未变化月份的缓存数据，只从数据库重新读取过期的月份
+        parts = []
+        info = meta.get('info', {}) if meta else {}
+
+        if meta:
+            old = self.readArrays(entryPath, mmap=False)
+            oldMonths = old[DATETIME_COLUMN].astype('datetime64[M]')
+            keep = np.zeros(len(oldMonths), dtype=bool)
+            for m in fingerprints.keys():
+                if m in staleMonths:
+                    continue
+                keep |= (oldMonths == np.datetime64(datetime.strptime(m, MONTH_FORMAT), 'M'))
+            parts.append({k: v[keep] for k, v in old.items()})
+
+        for monthStart, monthEnd in months:
+            if monthStart.strftime(MONTH_FORMAT) not in staleMonths:
+                continue
+            flt = self.makeFilter(max(monthStart, startDate), monthEnd, endDate)
+            docs = list(collection.find(flt, CACHE_PROJECTION).sort('datetime'))
+            if docs and not info:
+                info = {k: docs[0].get(k, '') for k in BAR_META_FIELDS}
+            parts.append(barDocsToArrays(docs))
+
+        arrays = concatBarArrays(parts)
+        self.writeEntry(entryPath, arrays, {'fingerprints': fingerprints, 'info': info})
+
+        return self.readArrays(entryPath), info
+
+    #----------------------------------------------------------------------
+    def makeFilter(self, start, monthEnd, endDate):
+        """生成某个月份的查询条件，最后一个月以endDate为上限（包含）"""
+        if endDate and endDate < monthEnd:
+            return {'datetime': {'$gte': start, '$lte': endDate}}
+        return {'datetime': {'$gte': start, '$lt': monthEnd}}
+
+    #----------------------------------------------------------------------
+    def findLastDoc(self, collection, flt):
+        """查询满足条件的最后一条数据（只返回时间字段）"""
+        cursor = collection.find(flt, {'datetime': 1}).sort('datetime', -1).limit(1)
+        for d in cursor:
+            return d
+        return None
+
+    #----------------------------------------------------------------------
+    def makeFingerprint(self, collection, flt):
+        """
+        基于数据条数、最后一条的时间和各字段的合计值生成指纹
+        在数据库端聚合完成，不需要读出文档
+        """
+        group = {'_id': None, 'count': {'$sum': 1}, 'last': {'$max': '$' + DATETIME_COLUMN}}
+        for name in BAR_COLUMNS:
+            group[name] = {'$sum': '$' + name}
+
+        for d in collection.aggregate([{'$match': flt}, {'$group': group}]):
+            return [d['count'], str(d['last'])] + [float(d[name]) for name in BAR_COLUMNS]
+        return [0, '']
+
+    #----------------------------------------------------------------------
+    def readMeta(self, entryPath):
+        """读取缓存条目的元数据，不存在则返回None"""
+        filename = os.path.join(entryPath, META_FILENAME)
+        if not os.path.exists(filename):
+            return None
+
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    #----------------------------------------------------------------------
+    def readArrays(self, entryPath, mmap=True):
+        """读取缓存条目中的列数据，默认使用只读内存映射"""
+        mode = 'r' if mmap else None
+        arrays = {}
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            filename = os.path.join(entryPath, name + '.npy')
+            arrays[name] = np.load(filename, mmap_mode=mode)
+        return arrays
+
+    #----------------------------------------------------------------------
+    def writeEntry(self, entryPath, arrays, meta):
+        """写入缓存条目，先写入临时目录再替换，防止中途失败留下损坏的缓存"""
+        tempPath = entryPath + '.tmp'
+        if os.path.exists(tempPath):
+            shutil.rmtree(tempPath)
+        os.makedirs(tempPath)
+
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            np.save(os.path.join(tempPath, name + '.npy'), arrays[name])
+
+        # meta最后写入，作为缓存条目完整的标志
+        with open(os.path.join(tempPath, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+
+        if os.path.exists(entryPath):
+            shutil.rmtree(entryPath)
+        os.rename(tempPath, entryPath)
+
+    #----------------------------------------------------------------------
+    def clear(self, dbName='', symbol=''):
+        """清空缓存，可指定数据库或集合"""
+        path = self.cachePath
+        if dbName:
+            path = os.path.join(path, dbName)
+            if symbol:
+                path = os.path.join(path, symbol)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
@@ -0,0 +1,187 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了交易结果的自助法（bootstrap）显著性检验。
+
+CTA_Strategy_Output_Ananlysis.ipynb中的varDiff循环10000次，每次调用
+np.random.choice和stats.ttest_rel比较训练期和测试期的每笔盈亏，速度很慢。这里：
+1. 一次生成全部重抽样的位置矩阵（每行为一次重抽样），按行向量化计算
+   配对t检验、Levene检验（以中位数为中心，和stats.levene默认一致）和方差比F检验
+2. 重抽样矩阵按行分块计算，避免样本较大时占用过多内存
+3. 可以使用多进程分块计算，每块使用由seed派生的独立随机数种子，
+   分块方式和进程数无关，相同的seed在单进程和多进程下的结果完全一致
+
+和varDiff一样，样本数较多的一方重抽样到样本数较少的一方的长度，再和后者比较。
+'''
+
+from __future__ import division
+
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+
+# 每个分块的最大重抽样次数，以及重抽样矩阵的最大元素数量
+MAX_CHUNK_ITERATIONS = 1000
+MAX_CHUNK_ELEMENTS = 5000000
+
+RESULT_COLUMNS = ['tStat', 'tPvalue', 'leveneStat', 'levenePvalue', 'fStat', 'fPvalue']
+
+
+#----------------------------------------------------------------------
+def pairedTTest(samples, other):
+    """
+    逐行配对t检验，samples为二维数组（每行一个样本），other为一维数组
+    结果和stats.ttest_rel(samples[i], other)一致，返回(t统计量, 双侧p值)
+    """
+    diff = samples - other
+    n = diff.shape[1]
+    std = diff.std(axis=1, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = diff.mean(axis=1) / (std / np.sqrt(n))
+    return t, 2 * stats.t.sf(np.abs(t), n - 1)
+
+
+#----------------------------------------------------------------------
+def leveneTest(samples, other):
+    """
+    逐行两样本Levene检验，以中位数为中心
+    结果和stats.levene(samples[i], other)一致，返回(W统计量, p值)
+    """
+    n1 = samples.shape[1]
+    n2 = len(other)
+    N = n1 + n2
+
+    z1 = np.abs(samples - np.median(samples, axis=1)[:, None])
+    z2 = np.abs(other - np.median(other))
+    mean1 = z1.mean(axis=1)
+    mean2 = z2.mean()
+    meanAll = (z1.sum(axis=1) + z2.sum()) / N
+
+    numerator = (N - 2) * (n1 * (mean1 - meanAll) ** 2 + n2 * (mean2 - meanAll) ** 2)
+    denominator = ((z1 - mean1[:, None]) ** 2).sum(axis=1) + ((z2 - mean2) ** 2).sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = numerator / denominator
+    return w, stats.f.sf(w, 1, N - 2)
+
+
+#----------------------------------------------------------------------
+def varianceFTest(samples, other):
+    """逐行方差比F检验，返回(F统计量, 双侧p值)"""
+    df1 = samples.shape[1] - 1
+    df2 = len(other) - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = samples.var(axis=1, ddof=1) / np.var(other, ddof=1)
+    p = 2 * np.minimum(stats.f.cdf(f, df1, df2), stats.f.sf(f, df1, df2))
+    return f, np.minimum(p, 1)
+
+
+#----------------------------------------------------------------------
+def bootstrapChunk(args):
+    """计算一块重抽样的检验结果，返回二维数组，列为RESULT_COLUMNS"""
+    population, other, iterNum, seed = args
+    rng = np.random.RandomState(seed)
+    index = rng.randint(0, len(population), size=(iterNum, len(other)))
+    samples = population[index]
+
+    result = np.empty((iterNum, len(RESULT_COLUMNS)))
+    result[:, 0], result[:, 1] = pairedTTest(samples, other)
+    result[:, 2], result[:, 3] = leveneTest(samples, other)
+    result[:, 4], result[:, 5] = varianceFTest(samples, other)
+    return result
+
+
+#----------------------------------------------------------------------
+def makeChunkArgs(pnl1, pnl2, iterNum, seed=None):
+    """
+    生成分块计算的参数列表，样本数较多的一方作为重抽样的总体
+    每块的重抽样次数只取决于样本长度，随机数种子由seed派生
+    """
+    pnl1 = np.asarray(pnl1, dtype=np.float64)
+    pnl2 = np.asarray(pnl2, dtype=np.float64)
+    if len(pnl1) > len(pnl2):
+        population, other = pnl1, pnl2
+    else:
+        population, other = pnl2, pnl1
+
+    chunkSize = max(1, min(MAX_CHUNK_ITERATIONS, MAX_CHUNK_ELEMENTS // max(len(other), 1)))
+    sizeList = [chunkSize] * (iterNum // chunkSize)
+    if iterNum % chunkSize:
+        sizeList.append(iterNum % chunkSize)
+    seedList = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(sizeList))
+    return [(population, other, size, chunkSeed) for size, chunkSeed in zip(sizeList, seedList)]
+
+
+#----------------------------------------------------------------------
+def mapChunks(argsList, processes=1):
+    """计算全部分块，processes大于1时使用进程池"""
+    if processes <= 1:
+        return [bootstrapChunk(args) for args in argsList]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(bootstrapChunk, argsList)
+    finally:
+        pool.close()
+        pool.join()
+
+
+#----------------------------------------------------------------------
+def bootstrapCompare(pnl1, pnl2, iterNum=10000, seed=None, processes=1):
+    """
+    自助法比较两组每笔盈亏
+    样本数较多的一方有放回地重抽样到较少一方的长度，每次重抽样计算t、Levene和F检验，
+    processes大于1时使用多进程计算，返回DataFrame，每行为一次重抽样的结果
+    """
+    chunkList = mapChunks(makeChunkArgs(pnl1, pnl2, iterNum, seed), processes)
+    return pd.DataFrame(np.concatenate(chunkList), columns=RESULT_COLUMNS)
+
+
+#----------------------------------------------------------------------
+def summarizeBootstrap(result, alpha=0.05):
+    """汇总重抽样结果：各检验p值的均值、中位数，以及p值小于alpha（拒绝原假设）的比例"""
+    d = {}
+    for name in ['tPvalue', 'levenePvalue', 'fPvalue']:
+        pValues = result[name]
+        d[name + 'Mean'] = pValues.mean()
+        d[name + 'Median'] = pValues.median()
+        d[name + 'RejectRate'] = (pValues < alpha).mean()
+    return d
+
+
+#----------------------------------------------------------------------
+def bootstrapComparePairs(pairDict, iterNum=10000, seed=None, processes=1, alpha=0.05):
+    """
+    批量比较多组交易结果，如不同策略的训练期和测试期
+    pairDict为{名称: (每笔盈亏1, 每笔盈亏2)}，返回以名称为索引的汇总DataFrame
+    """
+    # 全部组合的分块一起计算，多进程时只启动一次进程池
+    nameList = list(pairDict.keys())
+    argsList = []
+    countList = []
+    for name in nameList:
+        pnl1, pnl2 = pairDict[name]
+        args = makeChunkArgs(pnl1, pnl2, iterNum, seed)
+        argsList.extend(args)
+        countList.append(len(args))
+    chunkList = mapChunks(argsList, processes)
+
+    summaryDict = {}
+    start = 0
+    for name, count in zip(nameList, countList):
+        result = pd.DataFrame(np.concatenate(chunkList[start:start+count]), columns=RESULT_COLUMNS)
+        summaryDict[name] = summarizeBootstrap(result, alpha)
+        start += count
+    return pd.DataFrame(summaryDict).T
+
+
+#----------------------------------------------------------------------
+def varDiff(df1, df2, iterNum=10000, seed=None, processes=1):
+    """
+    和notebook中varDiff的参数和返回值一致的版本
+    df1、df2为包含pnl列的交易结果DataFrame，返回每次重抽样配对t检验p值的Series
+    """
+    result = bootstrapCompare(df1.pnl.values, df2.pnl.values, iterNum, seed, processes)
+    return result['tPvalue']
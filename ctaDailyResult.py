@@ -0,0 +1,232 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了按交易日逐日盯市的回测结果计算。
+
+基于成交的回测结果只在平仓时计算盈亏，回撤也只在平仓时刻测量，
+无法反映持仓期间的浮动亏损。这里使用回测数据的收盘价（Tick为最新价）：
+1. 由成交记录得到每根K线结束时的持仓和累计现金流，按收盘价计算盯市权益，
+   在此基础上计算K线级别的日内最大回撤
+2. 取每个交易日最后一根K线的权益得到每日盈亏，成交数量、成交额、手续费、
+   滑点通过bincount按交易日汇总，全部为向量化操作
+3. 持仓拆分为多头和空头两部分分别盯市，可以看出盈亏来自多仓还是空仓
+
+交易日的划分：夜盘（20点之后）属于下一个交易日，周末顺延到下周一。
+'''
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+
+
+# 时间加上该偏移后的日期即为交易日，使夜盘归属下一个交易日
+TRADING_DAY_OFFSET = np.timedelta64(4, 'h')
+
+# 年化使用的交易日数量
+ANNUAL_DAYS = 240
+
+
+#----------------------------------------------------------------------
+def tradingDays(datetimes):
+    """计算每个时间所属的交易日"""
+    days = (np.asarray(datetimes) + TRADING_DAY_OFFSET).astype('datetime64[D]')
+    return np.busday_offset(days, 0, roll='forward')
+
+
+#----------------------------------------------------------------------
+def splitBookVolumes(signedVolumes):
+    """
+    将每笔成交的持仓变化拆分为多头和空头两部分，
+    如持有2手空单时买入5手，空头部分为+2，多头部分为+3
+    """
+    pos = np.cumsum(signedVolumes)
+    prevPos = pos - signedVolumes
+    longDeltas = np.maximum(pos, 0) - np.maximum(prevPos, 0)
+    shortDeltas = np.minimum(pos, 0) - np.minimum(prevPos, 0)
+    return longDeltas, shortDeltas
+
+
+#----------------------------------------------------------------------
+def markToMarket(barTimes, closes, tradeTimes, prices, deltas, size, rate, slippage):
+    """
+    计算每根K线结束时的持仓和盯市权益（不含初始资金）
+    deltas为每笔成交的持仓变化，成交时间不晚于K线时间的成交计入该K线
+    """
+    volumes = np.abs(deltas)
+    cashFlows = -deltas * prices * size - volumes * prices * size * rate - volumes * size * slippage
+
+    tradeCount = tradeTimes.searchsorted(barTimes, 'right')
+    cash = np.append(0, np.cumsum(cashFlows))[tradeCount]
+    pos = np.append(0, np.cumsum(deltas))[tradeCount]
+    return pos, cash + pos * closes * size
+
+
+#----------------------------------------------------------------------
+def calculateDrawdown(balances, initcapital):
+    """计算资金曲线的最高点、回撤和回撤百分比"""
+    highlevel = np.maximum.accumulate(np.append(initcapital, balances))[1:]
+    drawdown = balances - highlevel
+    ddPercent = drawdown / highlevel * 100
+    return highlevel, drawdown, ddPercent
+
+
+#----------------------------------------------------------------------
+def calculateDailyResult(barTimes, closes, tradeTimes, tradePrices, signedVolumes,
+                         startDate, initcapital, size, rate, slippage, leverage=1):
+    """
+    逐日盯市计算每日盈亏
+    barTimes和closes为整个回测区间（包括初始化数据）的时间和收盘价，
+    只统计startDate（策略启动）之后的交易日。
+    返回(每日结果DataFrame, 每根K线的资金曲线DataFrame)，没有数据时返回(None, None)
+    """
+    barTimes = np.asarray(barTimes)
+    closes = np.asarray(closes, dtype=np.float64)
+    tradeTimes = np.asarray(tradeTimes)
+    tradePrices = np.asarray(tradePrices, dtype=np.float64)
+    signedVolumes = np.asarray(signedVolumes, dtype=np.float64)
+
+    start = barTimes.searchsorted(np.datetime64(startDate, 'us'))
+    if start >= len(barTimes):
+        return None, None
+
+    prevClose = closes[start-1] if start else closes[start]
+    # 复制为普通数组，内存映射的只读数组不能直接用于生成DatetimeIndex
+    barTimes = np.array(barTimes[start:])
+    closes = closes[start:]
+
+    # 每根K线结束时的盯市权益，总持仓和多空两部分分别计算
+    longDeltas, shortDeltas = splitBookVolumes(signedVolumes)
+    pos, equity = markToMarket(barTimes, closes, tradeTimes, tradePrices, signedVolumes,
+                               size, rate, slippage)
+    longPos, longEquity = markToMarket(barTimes, closes, tradeTimes, tradePrices, longDeltas,
+                                       size, rate, slippage)
+    shortPos, shortEquity = markToMarket(barTimes, closes, tradeTimes, tradePrices, shortDeltas,
+                                         size, rate, slippage)
+
+    barBalance = initcapital + equity * leverage
+    highlevel, drawdown, ddPercent = calculateDrawdown(barBalance, initcapital)
+    barDf = pd.DataFrame({'balance': barBalance,
+                          'pos': pos,
+                          'highlevel': highlevel,
+                          'drawdown': drawdown,
+                          'ddPercent': ddPercent},
+                         index=pd.DatetimeIndex(barTimes),
+                         columns=['balance', 'pos', 'highlevel', 'drawdown', 'ddPercent'])
+
+    # 每个交易日的最后一根K线
+    days = tradingDays(barTimes)
+    last = np.flatnonzero(np.append(days[1:] != days[:-1], True))
+    dayList = days[last]
+    count = len(dayList)
+
+    # 按交易日汇总成交
+    dayIndex = dayList.searchsorted(tradingDays(tradeTimes))
+    volumes = np.abs(signedVolumes)
+    valid = dayIndex < count
+    dayIndex = dayIndex[valid]
+
+    def groupSum(weights):
+        return np.bincount(dayIndex, weights=weights[valid], minlength=count)[:count]
+
+    turnover = groupSum(volumes * tradePrices * size)
+
+    closePrice = closes[last]
+    previousClose = np.append(prevClose, closePrice[:-1])
+    startPos = np.append(0, pos[last][:-1])
+
+    # 每日盈亏为当日和前一日收盘时的盯市权益之差
+    def dailyPnl(values):
+        return np.diff(np.append(0, values[last])) * leverage
+
+    df = pd.DataFrame(index=pd.DatetimeIndex(dayList))
+    df['closePrice'] = closePrice
+    df['previousClose'] = previousClose
+    df['startPos'] = startPos
+    df['endPos'] = pos[last]
+    df['tradeCount'] = np.bincount(dayIndex, minlength=count)[:count]
+    df['turnover'] = turnover
+    df['commission'] = turnover * rate
+    df['slippage'] = groupSum(volumes * size * slippage)
+    df['netPnl'] = dailyPnl(equity)
+    df['totalPnl'] = df['netPnl'] + (df['commission'] + df['slippage']) * leverage
+    df['holdingPnl'] = startPos * (closePrice - previousClose) * size * leverage
+    df['tradingPnl'] = df['totalPnl'] - df['holdingPnl']
+    df['longNetPnl'] = dailyPnl(longEquity)
+    df['shortNetPnl'] = dailyPnl(shortEquity)
+
+    df['balance'] = initcapital + df['netPnl'].cumsum()
+    df['return'] = logReturns(df['balance'], initcapital)
+    highlevel, drawdown, ddPercent = calculateDrawdown(df['balance'].values, initcapital)
+    df['highlevel'] = highlevel
+    df['drawdown'] = drawdown
+    df['ddPercent'] = ddPercent
+
+    return df, barDf
+
+
+#----------------------------------------------------------------------
+def logReturns(balance, initcapital):
+    """每日对数收益率，资金不为正（爆仓）时收益率没有意义，记为NaN"""
+    preBalance = balance.shift(1).fillna(initcapital)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.log(balance / preBalance)
+    returns[(balance <= 0) | (preBalance <= 0)] = np.nan
+    return returns
+
+
+#----------------------------------------------------------------------
+def sharpeRatio(returns):
+    """年化夏普比率，标准差和DataFrame.std一致使用样本标准差，忽略NaN，无法计算时返回0"""
+    returns = returns[np.isfinite(returns)]
+    if len(returns) < 2:
+        return 0
+    std = np.std(returns, ddof=1)
+    if not std:
+        return 0
+    return np.mean(returns) / std * np.sqrt(ANNUAL_DAYS)
+
+
+#----------------------------------------------------------------------
+def calculateDailyStatistics(df, barDf, initcapital):
+    """基于每日结果计算统计指标"""
+    totalDays = len(df)
+    endBalance = df['balance'].iloc[-1]
+    totalReturn = (endBalance / initcapital - 1) * 100
+
+    # 多空两部分各自以初始资金为基准计算收益率
+    longBalance = initcapital + df['longNetPnl'].cumsum()
+    shortBalance = initcapital + df['shortNetPnl'].cumsum()
+    longReturns = logReturns(longBalance, initcapital)
+    shortReturns = logReturns(shortBalance, initcapital)
+
+    result = {}
+    result['startDate'] = df.index[0]
+    result['endDate'] = df.index[-1]
+    result['totalDays'] = totalDays
+    result['profitDays'] = int((df['netPnl'] > 0).sum())
+    result['lossDays'] = int((df['netPnl'] < 0).sum())
+    result['endBalance'] = endBalance
+    result['maxDrawdown'] = df['drawdown'].min()
+    result['maxDdPercent'] = df['ddPercent'].min()
+    result['intradayMaxDrawdown'] = barDf['drawdown'].min()
+    result['intradayMaxDdPercent'] = barDf['ddPercent'].min()
+    result['totalNetPnl'] = df['netPnl'].sum()
+    result['dailyNetPnl'] = result['totalNetPnl'] / totalDays
+    result['totalCommission'] = df['commission'].sum()
+    result['dailyCommission'] = result['totalCommission'] / totalDays
+    result['totalSlippage'] = df['slippage'].sum()
+    result['dailySlippage'] = result['totalSlippage'] / totalDays
+    result['totalTurnover'] = df['turnover'].sum()
+    result['dailyTurnover'] = result['totalTurnover'] / totalDays
+    result['totalTradeCount'] = int(df['tradeCount'].sum())
+    result['dailyTradeCount'] = result['totalTradeCount'] / totalDays
+    result['totalReturn'] = totalReturn
+    result['annualizedReturn'] = totalReturn / totalDays * ANNUAL_DAYS
+    result['dailyReturn'] = df['return'].mean() * 100
+    result['returnStd'] = df['return'].std() * 100
+    result['sharpeRatio'] = sharpeRatio(df['return'].values)
+    result['longNetPnl'] = df['longNetPnl'].sum()
+    result['longSharpeRatio'] = sharpeRatio(longReturns.values)
+    result['shortNetPnl'] = df['shortNetPnl'].sum()
+    result['shortSharpeRatio'] = sharpeRatio(shortReturns.values)
+    return result
@@ -0,0 +1,200 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了基于本地文件的K线数据源，可以替代MongoDB用于回测。
+
+数据按品种和自然月分区存储：
+    root/symbol/info.json                   合约信息
+    root/symbol/YYYYMM/datetime.npy ...     npy格式，每列一个文件
+    root/symbol/YYYYMM.parquet              parquet格式，每月一个文件
+
+载入时根据回测的起止日期只读取需要的月份分区，npy格式的分区以
+内存映射的方式读取。parquet格式需要安装pyarrow或fastparquet。
+'''
+
+import os
+import json
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBarCache import (BAR_COLUMNS, DATETIME_COLUMN, DATETIME_DTYPE,
+                                                     MONTH_FORMAT, emptyBarArrays)
+
+
+FORMAT_NPY = 'npy'
+FORMAT_PARQUET = 'parquet'
+
+INFO_FILENAME = 'info.json'
+
+
+########################################################################
+class FileDataSource(object):
+    """
+    本地文件K线数据源
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, root, fileFormat=FORMAT_NPY):
+        """Constructor"""
+        self.root = root
+        self.fileFormat = fileFormat
+
+    #----------------------------------------------------------------------
+    def getSymbolPath(self, symbol):
+        """获取品种数据所在的目录"""
+        return os.path.join(self.root, symbol)
+
+    #----------------------------------------------------------------------
+    def getPartitionPath(self, symbol, month):
+        """获取某个月份分区的路径"""
+        path = os.path.join(self.getSymbolPath(symbol), month)
+        if self.fileFormat == FORMAT_PARQUET:
+            path += '.parquet'
+        return path
+
+    #----------------------------------------------------------------------
+    def listPartitions(self, symbol):
+        """列出品种所有的月份分区，按时间排序"""
+        path = self.getSymbolPath(symbol)
+        if not os.path.isdir(path):
+            return []
+
+        months = []
+        for name in os.listdir(path):
+            month = name.split('.')[0]
+            if len(month) == 6 and month.isdigit():
+                months.append(month)
+        return sorted(set(months))
+
+    #----------------------------------------------------------------------
+    def loadBarArrays(self, symbol, startDate, endDate=None):
+        """
+        载入[startDate, endDate]区间的K线列数据，endDate为空则载入全部数据
+        返回(列数据字典, 合约信息字典)
+        """
+        # 根据起止日期裁剪月份分区
+        startMonth = startDate.strftime(MONTH_FORMAT)
+        endMonth = endDate.strftime(MONTH_FORMAT) if endDate else None
+        months = [m for m in self.listPartitions(symbol)
+                  if m >= startMonth and (endMonth is None or m <= endMonth)]
+
+        partList = [self.readPartition(symbol, m) for m in months]
+        partList = [p for p in partList if len(p[DATETIME_COLUMN])]
+
+        # 只有一个分区时直接使用内存映射的数据，不进行复制
+        if not partList:
+            arrays = emptyBarArrays()
+        elif len(partList) == 1:
+            arrays = partList[0]
+        else:
+            arrays = {}
+            for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+                arrays[name] = np.concatenate([p[name] for p in partList])
+
+        # 首尾分区按照精确的时间截取
+        datetimes = arrays[DATETIME_COLUMN]
+        start = datetimes.searchsorted(np.datetime64(startDate, 'us'))
+        if endDate:
+            end = datetimes.searchsorted(np.datetime64(endDate, 'us'), side='right')
+        else:
+            end = len(datetimes)
+        arrays = {k: v[start:end] for k, v in arrays.items()}
+
+        return arrays, self.readInfo(symbol)
+
+    #----------------------------------------------------------------------
+    def readPartition(self, symbol, month, mmap=True):
+        """读取一个月份分区，npy格式默认使用只读内存映射"""
+        path = self.getPartitionPath(symbol, month)
+
+        if self.fileFormat == FORMAT_PARQUET:
+            import pandas as pd
+            df = pd.read_parquet(path)
+            arrays = {DATETIME_COLUMN: df[DATETIME_COLUMN].values.astype(DATETIME_DTYPE)}
+            for name in BAR_COLUMNS:
+                arrays[name] = df[name].values.astype(np.float64)
+            return arrays
+
+        arrays = {}
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            arrays[name] = np.load(os.path.join(path, name + '.npy'),
+                                   mmap_mode='r' if mmap else None)
+        return arrays
+
+    #----------------------------------------------------------------------
+    def readInfo(self, symbol):
+        """读取合约信息"""
+        filename = os.path.join(self.getSymbolPath(symbol), INFO_FILENAME)
+        if not os.path.exists(filename):
+            return {'vtSymbol': symbol, 'symbol': symbol, 'exchange': ''}
+
+        with open(filename) as f:
+            return json.load(f)
+
+    #----------------------------------------------------------------------
+    def writeBarArrays(self, symbol, arrays, info=None):
+        """
+        写入K线列数据，按月份分区保存
+        和已有分区合并，时间相同的数据以新写入的为准
+        """
+        symbolPath = self.getSymbolPath(symbol)
+        if not os.path.isdir(symbolPath):
+            os.makedirs(symbolPath)
+
+        if info:
+            with open(os.path.join(symbolPath, INFO_FILENAME), 'w') as f:
+                json.dump(info, f)
+
+        datetimes = np.asarray(arrays[DATETIME_COLUMN], dtype=DATETIME_DTYPE)
+        monthArray = datetimes.astype('datetime64[M]')
+        existing = set(self.listPartitions(symbol))
+
+        for m in np.unique(monthArray):
+            month = m.astype(datetime).strftime(MONTH_FORMAT)
+            mask = monthArray == m
+
+            part = {DATETIME_COLUMN: datetimes[mask]}
+            for name in BAR_COLUMNS:
+                part[name] = np.asarray(arrays[name], dtype=np.float64)[mask]
+
+            if month in existing:
+                old = self.readPartition(symbol, month, mmap=False)
+                part = mergePartition(old, part)
+            else:
+                part = mergePartition(None, part)
+
+            self.writePartition(symbol, month, part)
+
+    #----------------------------------------------------------------------
+    def writePartition(self, symbol, month, arrays):
+        """写入一个月份分区"""
+        path = self.getPartitionPath(symbol, month)
+
+        if self.fileFormat == FORMAT_PARQUET:
+            import pandas as pd
+            df = pd.DataFrame({name: arrays[name] for name in [DATETIME_COLUMN] + BAR_COLUMNS})
+            df.to_parquet(path, index=False)
+            return
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for name in [DATETIME_COLUMN] + BAR_COLUMNS:
+            np.save(os.path.join(path, name + '.npy'), arrays[name])
+
+
+#----------------------------------------------------------------------
+def mergePartition(old, new):
+    """合并新旧分区数据，按时间排序，时间重复时保留新数据"""
+    if old is not None:
+        merged = {k: np.concatenate([np.asarray(old[k]), new[k]]) for k in new.keys()}
+    else:
+        merged = new
+
+    datetimes = merged[DATETIME_COLUMN]
+    order = np.argsort(datetimes, kind='mergesort')
+    datetimes = datetimes[order]
+
+    # 排序稳定，同一时间的最后一条即为最新写入的数据
+    keep = np.append(datetimes[1:] != datetimes[:-1], True)
+    return {k: v[order][keep] for k, v in merged.items()}
@@ -5,6 +5,8 @@
 1. 从通联数据下载历史行情的引擎
 2. 用来把MultiCharts导出的历史数据载入到MongoDB中用的函数
 3. 增加从通达信导出的历史数据载入到MongoDB中的函数
+4. 把MultiCharts导出的历史数据或MongoDB中的数据写入本地分区文件的函数
+5. 把MongoDB中的Tick数据导出到压缩Tick存储的函数
 """
 
 from datetime import datetime, timedelta
@@ -433,6 +435,72 @@ def loadTdxCsv(fileName, dbName, symbol):
     
     print u'插入完毕，耗时：%s' % (time()-start)
 
+#----------------------------------------------------------------------
+def loadMcCsvToFiles(fileName, root, symbol, fileFormat='npy'):
+    """将Multicharts导出的csv格式的历史数据写入本地分区文件，用于脱离MongoDB回测"""
+    import csv
+    from vnpy.trader.app.ctaStrategy.ctaFileDataSource import FileDataSource
+    
+    start = time()
+    print u'开始读取CSV文件%s中的数据写入到%s的%s中' %(fileName, root, symbol)
+    
+    datetimeList = []
+    columnDict = {'open': [], 'high': [], 'low': [], 'close': [], 'volume': [], 'openInterest': []}
+    
+    reader = csv.DictReader(file(fileName, 'r'))
+    for d in reader:
+        date = datetime.strptime(d['Date'], '%Y-%m-%d').strftime('%Y%m%d')
+        datetimeList.append(datetime.strptime(date + ' ' + d['Time'], '%Y%m%d %H:%M:%S'))
+        columnDict['open'].append(float(d['Open']))
+        columnDict['high'].append(float(d['High']))
+        columnDict['low'].append(float(d['Low']))
+        columnDict['close'].append(float(d['Close']))
+        columnDict['volume'].append(float(d['TotalVolume']))
+        columnDict['openInterest'].append(float(d['TotalPosition']))   # 持仓量
+    
+    columnDict['datetime'] = datetimeList
+    info = {'vtSymbol': symbol, 'symbol': symbol, 'exchange': ''}
+    FileDataSource(root, fileFormat).writeBarArrays(symbol, columnDict, info)
+    
+    print u'写入完毕，数据量：%s，耗时：%s' % (len(datetimeList), time()-start)
+
+#----------------------------------------------------------------------
+def exportMongoToFiles(dbName, symbol, root, fileFormat='npy'):
+    """将MongoDB中的K线数据导出为本地分区文件"""
+    from vnpy.trader.app.ctaStrategy.ctaBarCache import barDocsToArrays, BAR_META_FIELDS
+    from vnpy.trader.app.ctaStrategy.ctaFileDataSource import FileDataSource
+    
+    start = time()
+    print u'开始导出%s的%s到%s' %(dbName, symbol, root)
+    
+    client = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+    collection = client[dbName][symbol]
+    
+    docs = list(collection.find().sort('datetime', pymongo.ASCENDING))
+    if not docs:
+        print u'找不到合约%s' %symbol
+        return
+    
+    info = {k: docs[0].get(k, '') for k in BAR_META_FIELDS}
+    FileDataSource(root, fileFormat).writeBarArrays(symbol, barDocsToArrays(docs), info)
+    
+    print u'导出完毕，数据量：%s，耗时：%s' % (len(docs), time()-start)
+
+#----------------------------------------------------------------------
+def exportMongoTicksToStore(dbName, symbol, root, priceTick):
+    """将MongoDB中的Tick数据按日导出到压缩Tick存储"""
+    from vnpy.trader.app.ctaStrategy.ctaTickStore import TickStore
+    
+    start = time()
+    print u'开始导出%s的%s到%s' %(dbName, symbol, root)
+    
+    client = pymongo.MongoClient(globalSetting['mongoHost'], globalSetting['mongoPort'])
+    collection = client[dbName][symbol]
+    
+    total = TickStore(root).importFromMongo(collection, symbol, priceTick)
+    
+    print u'导出完毕，数据量：%s，耗时：%s' % (total, time()-start)
+
     
 if __name__ == '__main__':
     ## 简单的测试脚本可以写在这里
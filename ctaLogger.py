@@ -0,0 +1,120 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测用的结构化日志。
+
+原先回测引擎的writeCtaLog在每次调用时都拼接时间字符串并追加到不限长度的
+logList中，策略在持仓期间每根5分钟K线都会写日志，部分策略还在每根K线上print。
+这里的CtaLogger：
+1. 日志分为DEBUG、INFO、WARNING、ERROR四个级别，低于设置级别的日志直接丢弃
+2. 只保存(时间, 级别, 模板, 参数)，在读取时才格式化为字符串
+3. 使用固定长度的环形缓冲区，超出长度时丢弃最早的日志，内存占用有上限
+4. 级别设置为LOG_DISABLED时完全关闭日志，用于参数优化
+
+策略中可以使用writeStrategyLog写入延迟格式化的日志，在实盘引擎中则退化为
+格式化后调用策略的writeCtaLog。
+'''
+
+from collections import deque
+
+
+# 日志级别，和logging模块的数值一致
+LOG_DEBUG = 10
+LOG_INFO = 20
+LOG_WARNING = 30
+LOG_ERROR = 40
+LOG_DISABLED = 100      # 高于所有级别，即关闭日志
+
+LEVEL_NAMES = {LOG_DEBUG: 'DEBUG',
+               LOG_INFO: 'INFO',
+               LOG_WARNING: 'WARNING',
+               LOG_ERROR: 'ERROR'}
+
+# 环形缓冲区的默认长度
+DEFAULT_BUFFER_SIZE = 100000
+
+
+#----------------------------------------------------------------------
+def formatMessage(template, args):
+    """格式化日志内容，没有参数时直接返回模板"""
+    if not args:
+        return template
+    return template % args
+
+
+########################################################################
+class CtaLogger(object):
+    """
+    结构化日志
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, level=LOG_INFO, bufferSize=DEFAULT_BUFFER_SIZE):
+        """Constructor"""
+        self.level = level                          # 日志级别
+        self.buffer = deque(maxlen=bufferSize)      # 环形缓冲区，元素为(时间, 级别, 模板, 参数)
+
+    #----------------------------------------------------------------------
+    def setLevel(self, level):
+        """设置日志级别"""
+        self.level = level
+
+    #----------------------------------------------------------------------
+    def setBufferSize(self, bufferSize):
+        """设置环形缓冲区的长度，保留最新的日志"""
+        self.buffer = deque(self.buffer, maxlen=bufferSize)
+
+    #----------------------------------------------------------------------
+    def isEnabledFor(self, level):
+        """该级别的日志是否会被记录"""
+        return level >= self.level
+
+    #----------------------------------------------------------------------
+    def log(self, dt, level, template, args=()):
+        """记录日志，不进行格式化"""
+        if level >= self.level:
+            self.buffer.append((dt, level, template, args))
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空日志"""
+        self.buffer.clear()
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """缓冲区中的日志数量"""
+        return len(self.buffer)
+
+    #----------------------------------------------------------------------
+    def iterRecords(self, level=LOG_DEBUG):
+        """逐条生成不低于level级别的日志，元素为(时间, 级别, 日志内容)"""
+        for dt, recordLevel, template, args in list(self.buffer):
+            if recordLevel >= level:
+                yield dt, recordLevel, formatMessage(template, args)
+
+    #----------------------------------------------------------------------
+    def render(self, level=LOG_DEBUG, withLevel=False):
+        """将不低于level级别的日志格式化为字符串列表"""
+        lines = []
+        for dt, recordLevel, message in self.iterRecords(level):
+            if withLevel:
+                lines.append(' '.join([str(dt), LEVEL_NAMES.get(recordLevel, str(recordLevel)), message]))
+            else:
+                lines.append(str(dt) + ' ' + message)
+        return lines
+
+
+#----------------------------------------------------------------------
+def writeStrategyLog(strategy, template, *args, **kwargs):
+    """
+    策略写入延迟格式化的日志，level参数为日志级别，默认为LOG_INFO
+    回测引擎中只记录模板和参数；实盘引擎没有结构化日志，格式化后调用策略的writeCtaLog
+    """
+    level = kwargs.get('level', LOG_INFO)
+    engine = strategy.ctaEngine
+
+    logger = getattr(engine, 'logger', None)
+    if logger is not None:
+        logger.log(engine.dt, level, template, args)
+    else:
+        strategy.writeCtaLog(formatMessage(template, args))
@@ -0,0 +1,168 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测用的MongoDB预读取器。
+
+和直接遍历find()返回的指针相比：
+1. 查询时只投影回测需要的字段，减少网络传输和BSON解码的数据量
+2. 按可配置的批大小从数据库读取
+3. 由后台线程负责读取和解码下一批数据，策略处理当前批次的同时，
+   数据库往返和解码的耗时被并行掩盖
+'''
+
+from Queue import Queue, Full
+from threading import Thread
+
+from vnpy.trader.vtObject import VtTickData
+from vnpy.trader.app.ctaStrategy.ctaBarArray import ArrayBar
+
+
+# K线回测需要的字段
+BAR_PROJECTION = {'_id': 0, 'datetime': 1, 'open': 1, 'high': 1, 'low': 1, 'close': 1,
+                  'volume': 1, 'openInterest': 1}
+
+# Tick回测去掉不需要的字段
+TICK_PROJECTION = {'_id': 0, 'rawData': 0, 'gatewayName': 0}
+
+# 合约信息字段
+INFO_PROJECTION = {'_id': 0, 'vtSymbol': 1, 'symbol': 1, 'exchange': 1}
+
+# 队列中表示读取结束的标志
+END_OF_DATA = None
+
+
+#----------------------------------------------------------------------
+def loadContractInfo(collection, flt):
+    """读取合约信息（代码、交易所），只查询一条数据"""
+    d = collection.find_one(flt, INFO_PROJECTION)
+    return d or {}
+
+
+########################################################################
+class BarDecoder(object):
+    """将投影后的K线文档转化为ArrayBar"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, info):
+        """Constructor"""
+        self.vtSymbol = info.get('vtSymbol', '')
+        self.symbol = info.get('symbol', '')
+        self.exchange = info.get('exchange', '')
+
+    #----------------------------------------------------------------------
+    def __call__(self, d):
+        """解码一条文档"""
+        bar = ArrayBar(self.vtSymbol, self.symbol, self.exchange)
+        bar.datetime = d['datetime']
+        bar.open = d['open']
+        bar.high = d['high']
+        bar.low = d['low']
+        bar.close = d['close']
+        bar.volume = d.get('volume', 0)
+        bar.openInterest = d.get('openInterest', 0)
+        return bar
+
+
+#----------------------------------------------------------------------
+def decodeTick(d):
+    """将投影后的Tick文档转化为VtTickData"""
+    tick = VtTickData()
+    tick.__dict__ = d
+    return tick
+
+
+########################################################################
+class MongoPrefetchReader(object):
+    """
+    MongoDB预读取器
+    后台线程按批读取并解码数据，放入有界队列，主线程迭代取出
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, collection, flt, projection, decoder,
+                 batchSize=5000, prefetch=4):
+        """Constructor"""
+        self.collection = collection
+        self.flt = flt
+        self.projection = projection
+        self.decoder = decoder
+
+        self.batchSize = batchSize      # 每批读取的数据量
+        self.queue = Queue(prefetch)    # 最多预读取的批数
+
+        self.active = False
+        self.thread = None
+        self.error = None               # 后台线程中发生的异常，在主线程中重新抛出
+
+    #----------------------------------------------------------------------
+    def start(self):
+        """启动后台读取线程"""
+        if self.thread:
+            return
+
+        self.active = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #----------------------------------------------------------------------
+    def stop(self):
+        """停止读取"""
+        self.active = False
+
+    #----------------------------------------------------------------------
+    def count(self):
+        """查询数据总量"""
+        return self.collection.find(self.flt).count()
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """后台线程：读取并解码数据"""
+        try:
+            cursor = self.collection.find(self.flt, self.projection).sort('datetime')
+            cursor.batch_size(self.batchSize)
+
+            decoder = self.decoder
+            batch = []
+            for d in cursor:
+                batch.append(decoder(d))
+                if len(batch) >= self.batchSize:
+                    if not self.put(batch):
+                        return
+                    batch = []
+
+            if batch:
+                self.put(batch)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.put(END_OF_DATA)
+
+    #----------------------------------------------------------------------
+    def put(self, item):
+        """放入队列，队列已满时等待，停止后放弃"""
+        while self.active:
+            try:
+                self.queue.put(item, timeout=1)
+                return True
+            except Full:
+                pass
+        return False
+
+    #----------------------------------------------------------------------
+    def __iter__(self):
+        """逐条迭代解码后的数据"""
+        self.start()
+
+        try:
+            while True:
+                batch = self.queue.get()
+                if batch is END_OF_DATA:
+                    break
+                for data in batch:
+                    yield data
+        finally:
+            self.stop()
+
+        if self.error:
+            raise self.error
@@ -0,0 +1,157 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了基于每笔交易盈亏的蒙特卡洛资金曲线模拟。
+
+calculateBacktestingResult只给出实际交易顺序下的一条资金曲线和一个最大回撤。
+这里对每笔盈亏重新排列（shuffle）或有放回地重抽样（bootstrap），生成大量资金曲线，
+得到最大回撤、水下时间和期末净值的分布：
+1. 全部路径保存在一个二维矩阵中，每行为一条路径，统计指标由cumsum、
+   maximum.accumulate等按行的累积运算一次算出，没有逐条路径的Python循环
+2. 重新排列使用向量化的Fisher-Yates洗牌，每一步同时交换所有路径的一个位置，
+   循环次数为交易数量而不是路径数量
+3. 路径按块生成和计算，洗牌的位置矩阵也在每块内生成，内存占用只和块的大小有关
+
+资金和回撤的计算方式和calculateBacktestingResult一致。
+'''
+
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+
+
+# 模拟方式
+METHOD_SHUFFLE = 'shuffle'          # 重新排列，每条路径包含全部交易各一次
+METHOD_BOOTSTRAP = 'bootstrap'      # 有放回重抽样
+
+# 每块路径矩阵的最大元素数量
+MAX_CHUNK_ELEMENTS = 1000000
+
+# 分布汇总使用的分位数
+DEFAULT_QUANTILES = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+
+RESULT_COLUMNS = ['maxDrawdown', 'maxDrawdownPct', 'maxUnderwater', 'underwaterRatio',
+                  'terminalNetworth']
+
+
+#----------------------------------------------------------------------
+def shuffleIndex(n, pathNum, rng):
+    """
+    生成pathNum个0到n-1的随机排列，返回形状为(n, pathNum)的矩阵，每列为一个排列
+    使用向量化的Fisher-Yates洗牌，每一步对所有列交换同一行
+    """
+    dtype = np.int16 if n <= np.iinfo(np.int16).max else np.int32
+    index = np.empty((n, pathNum), dtype=dtype)
+    index[:] = np.arange(n, dtype=dtype)[:, None]
+    if n < 2:
+        return index
+
+    # 每一步的随机位置由随机整数取模得到，2**31远大于交易数量，偏差可以忽略
+    # 展开后的位置超出int32范围时使用int64
+    positionType = np.int32 if n * pathNum < 2 ** 31 else np.int64
+    randoms = rng.randint(0, 2 ** 31 - 1, size=(n, pathNum), dtype=positionType)
+    flat = index.ravel()
+    offsets = np.arange(pathNum, dtype=positionType)
+    for i in range(n - 1, 0, -1):
+        position = randoms[i] % (i + 1)
+        position *= pathNum
+        position += offsets
+        swapped = flat.take(position)
+        flat.put(position, index[i])
+        index[i] = swapped
+    return index
+
+
+#----------------------------------------------------------------------
+def pathStatistics(pnlPaths, initcapital):
+    """
+    计算每条路径的统计指标，pnlPaths的每行为一条路径的每笔盈亏（会被修改）
+    返回二维数组，列为RESULT_COLUMNS
+    """
+    pathNum, n = pnlPaths.shape
+
+    # 资金，初始资金加在第一笔上，避免对整个矩阵再做一次加法
+    pnlPaths[:, 0] += initcapital
+    capital = np.cumsum(pnlPaths, axis=1, out=pnlPaths)
+
+    # 资金最高净值不低于0，资金最高净值单调不减，只有第一笔为负时才需要处理
+    maxCapital = np.maximum.accumulate(capital, axis=1)
+    if (maxCapital[:, 0] < 0).any():
+        np.maximum(maxCapital, 0, out=maxCapital)
+
+    result = np.empty((pathNum, len(RESULT_COLUMNS)))
+    result[:, 4] = capital[:, -1] / initcapital if initcapital else np.nan
+
+    drawdown = np.subtract(capital, maxCapital, out=capital)
+    result[:, 0] = drawdown.min(axis=1)
+
+    if (maxCapital[:, 0] > 0).all():
+        result[:, 1] = np.divide(drawdown, maxCapital, out=maxCapital).min(axis=1)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[:, 1] = np.where(maxCapital != 0, drawdown / maxCapital, 0).min(axis=1)
+
+    # 水下时间：距离上一次创新高（回撤为0）的交易笔数的最大值，第一笔视为起点
+    highs = drawdown >= 0
+    result[:, 3] = 1 - np.count_nonzero(highs, axis=1) / n
+    highs[:, 0] = True
+
+    position = np.flatnonzero(highs)
+    column = position % n
+    nextColumn = np.append(column[1:], 0)
+    nextColumn[nextColumn == 0] = n             # 每行最后一次新高之后直到路径结束
+    gaps = nextColumn - column - 1
+    result[:, 2] = np.maximum.reduceat(gaps, np.flatnonzero(column == 0))
+    return result
+
+
+#----------------------------------------------------------------------
+def simulateEquityPaths(pnl, pathNum=10000, method=METHOD_SHUFFLE, seed=None):
+    """
+    生成全部模拟路径的每笔盈亏矩阵，形状为(pathNum, 交易数量)
+    路径数量较多时矩阵较大，统计分布请直接使用runMonteCarlo
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    rng = np.random.RandomState(seed)
+    if method == METHOD_SHUFFLE:
+        return pnl[shuffleIndex(len(pnl), pathNum, rng).T]
+    elif method == METHOD_BOOTSTRAP:
+        return pnl[rng.randint(0, len(pnl), size=(pathNum, len(pnl)))]
+    raise ValueError(u'不支持的模拟方式：%s' % method)
+
+
+#----------------------------------------------------------------------
+def runMonteCarlo(pnl, initcapital, pathNum=10000, method=METHOD_SHUFFLE, seed=None):
+    """
+    蒙特卡洛模拟资金曲线，pnl为每笔交易的盈亏（已计入杠杆）
+    返回DataFrame，每行为一条路径的最大回撤、最大回撤比例、最长水下交易笔数、
+    水下交易占比和期末净值
+    """
+    pnl = np.asarray(pnl, dtype=np.float64)
+    n = len(pnl)
+    if not n:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    if method not in [METHOD_SHUFFLE, METHOD_BOOTSTRAP]:
+        raise ValueError(u'不支持的模拟方式：%s' % method)
+
+    # 按块生成路径并计算统计指标
+    rng = np.random.RandomState(seed)
+    chunkSize = max(1, MAX_CHUNK_ELEMENTS // n)
+    resultList = []
+    for start in range(0, pathNum, chunkSize):
+        end = min(start + chunkSize, pathNum)
+        if method == METHOD_SHUFFLE:
+            pnlPaths = pnl[shuffleIndex(n, end - start, rng).T]
+        else:
+            pnlPaths = pnl[rng.randint(0, n, size=(end - start, n))]
+        resultList.append(pathStatistics(pnlPaths, initcapital))
+
+    return pd.DataFrame(np.concatenate(resultList), columns=RESULT_COLUMNS)
+
+
+#----------------------------------------------------------------------
+def summarizeMonteCarlo(result, quantiles=DEFAULT_QUANTILES):
+    """模拟结果各指标的分位数表"""
+    return result.quantile(quantiles)
@@ -0,0 +1,128 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了参数优化使用的常驻进程池。
+
+原先的runParallelOptimization每次调用都新建进程池，每个参数组合提交一次apply_async，
+并且要等pool.join()之后才能读取结果。这里：
+1. 每个子进程在启动时创建一个回测引擎并保持到进程池关闭，策略模块只导入一次，
+   共享数据集只挂载一次，之后的每个任务只需清空上次的回测结果
+2. 参数组合分块发送给子进程，减少进程间通信的次数
+3. 使用imap_unordered按完成的先后顺序返回结果，可以边优化边处理结果
+4. 进程池可以在多次优化之间复用，由回测引擎的getOptimizationPool管理
+
+回测引擎的类和设置（包括本地文件数据源、压缩Tick存储和K线缓存的路径）作为初始化参数
+传入子进程，本模块不导入ctaBacktesting。
+'''
+
+import multiprocessing
+import traceback
+
+from vnpy.trader.app.ctaStrategy.ctaLogger import LOG_DISABLED
+from vnpy.trader.app.ctaStrategy.ctaRunningMetrics import STOPPED_TARGET_VALUE
+
+
+# 每个子进程的任务分块数量，分块越多负载越均衡，分块越少通信越少
+CHUNKS_PER_PROCESS = 4
+
+# 子进程中常驻的回测引擎
+workerEngine = None
+
+
+#----------------------------------------------------------------------
+def applyEngineSetting(engine, setting):
+    """将getEngineSetting导出的设置应用到回测引擎"""
+    engine.setBacktestingMode(setting['mode'])
+    engine.setStartDate(setting['startDate'], setting['initDays'])
+    engine.setEndDate(setting['endDate'])
+    engine.setInitialCapital(setting['initcapital'])
+    engine.setSlippage(setting['slippage'])
+    engine.setRate(setting['rate'])
+    engine.setSize(setting['size'])
+    engine.setPriceTick(setting['priceTick'])
+    engine.setLeverage(setting['leverage'])
+    engine.setDatabase(setting['dbName'], setting['symbol'])
+    if setting['dataSource']:
+        engine.setDataSource(setting['dataSource'][0], setting['symbol'], setting['dataSource'][1])
+    if setting['tickStoreRoot']:
+        engine.setTickStore(setting['tickStoreRoot'], setting['symbol'])
+    if setting['barCachePath']:
+        engine.setBarCache(setting['barCachePath'])
+    engine.setReuseBar(setting['reuseBar'])
+    engine.setPrefetch(*setting['prefetch'])
+    engine.sharedDataPath = setting['sharedDataPath']
+    engine.setLogLevel(LOG_DISABLED)
+    for generator in setting['barGeneratorList']:
+        engine.setBarGenerator(*generator)
+    for condition in setting['stopConditionList']:
+        engine.addStopCondition(condition)
+
+
+#----------------------------------------------------------------------
+def initOptimizationWorker(engineClass, engineSetting):
+    """子进程启动时创建常驻的回测引擎"""
+    global workerEngine
+    workerEngine = engineClass()
+    applyEngineSetting(workerEngine, engineSetting)
+
+
+#----------------------------------------------------------------------
+def runOptimizationTask(task):
+    """在子进程中运行一个参数组合，返回(参数字符串, 目标值)，回测出错时目标值为None"""
+    strategyClass, setting, targetName = task
+    engine = workerEngine
+
+    try:
+        engine.clearBacktestingResult()
+        engine.initStrategy(strategyClass, setting)
+        engine.runBacktesting()
+        d = engine.calculateBacktestingResult()
+    except Exception:
+        traceback.print_exc()
+        return (str(setting), None)
+
+    try:
+        targetValue = d[targetName]
+    except KeyError:
+        targetValue = 0
+    if engine.stopReason:
+        targetValue = STOPPED_TARGET_VALUE
+    return (str(setting), targetValue)
+
+
+########################################################################
+class OptimizationPool(object):
+    """
+    参数优化的常驻进程池
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, engineClass, engineSetting, processes=None):
+        """Constructor"""
+        self.engineSetting = engineSetting
+        self.processes = processes or max(multiprocessing.cpu_count() - 1, 1)
+        self.pool = multiprocessing.Pool(self.processes, initOptimizationWorker,
+                                         (engineClass, engineSetting))
+
+    #----------------------------------------------------------------------
+    def imapResults(self, strategyClass, settingList, targetName, chunkSize=0):
+        """
+        分块发送参数组合，按完成的先后顺序逐个返回(参数字符串, 目标值)
+        chunkSize为0时按进程数自动计算
+        """
+        if not chunkSize:
+            chunkSize = max(1, len(settingList) // (self.processes * CHUNKS_PER_PROCESS))
+        taskList = [(strategyClass, setting, targetName) for setting in settingList]
+        return self.pool.imap_unordered(runOptimizationTask, taskList, chunkSize)
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """关闭进程池，等待子进程退出"""
+        self.pool.close()
+        self.pool.join()
+
+    #----------------------------------------------------------------------
+    def terminate(self):
+        """立即终止子进程"""
+        self.pool.terminate()
+        self.pool.join()
@@ -0,0 +1,156 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测撮合用的委托簿。
+
+原先的撮合在每根K线（或每个Tick）上遍历全部活动委托，逐一判断是否成交，
+对于网格、OCO这类同时挂有大量委托的策略，无法成交的委托会被反复检查。
+这里将活动委托按方向分别保存在以价格排序的列表中，撮合时通过二分查找
+直接定位会成交的委托：
+1. 买入限价单价格从低到高排列，价格不低于买入撮合价的位于列表末尾
+2. 卖出限价单价格从低到高排列，价格不高于卖出撮合价的位于列表开头
+
+停止单的触发方向和限价单相反：
+1. 买入停止单价格不高于买入触发价（K线最高价）时触发，位于列表开头
+2. 卖出停止单价格不低于卖出触发价（K线最低价）时触发，位于列表末尾
+
+取出的委托按照发单的先后顺序返回，和遍历委托字典时的成交顺序保持一致。
+'''
+
+from bisect import bisect_left, bisect_right, insort
+
+from vnpy.trader.vtConstant import DIRECTION_LONG, DIRECTION_SHORT
+
+
+# 用于二分查找时比较价格相同的委托
+MAX_SEQUENCE = float('inf')
+
+
+########################################################################
+class LimitOrderBook(object):
+    """
+    限价单委托簿
+    只负责撮合时的价格索引，委托本身仍然保存在引擎的委托字典中
+    """
+    idName = 'vtOrderID'    # 委托编号的属性名
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.buyList = []       # 买入委托，元素为(价格, 序号, 委托)，按价格排序
+        self.sellList = []      # 卖出委托，元素同上
+        self.keyDict = {}       # 委托编号：在列表中的排序键
+        self.count = 0          # 委托序号，用于价格相同时按发单顺序排列
+
+    #----------------------------------------------------------------------
+    def add(self, order):
+        """加入委托"""
+        if order.direction == DIRECTION_LONG:
+            l = self.buyList
+        elif order.direction == DIRECTION_SHORT:
+            l = self.sellList
+        else:
+            return
+
+        self.count += 1
+        key = (order.price, self.count)
+        insort(l, key + (order,))
+        self.keyDict[getattr(order, self.idName)] = key
+
+    #----------------------------------------------------------------------
+    def remove(self, order):
+        """移除委托，如撤单时"""
+        key = self.keyDict.pop(getattr(order, self.idName), None)
+        if key is None:
+            return
+
+        l = self.buyList if order.direction == DIRECTION_LONG else self.sellList
+        i = bisect_left(l, key)
+        del l[i]
+
+    #----------------------------------------------------------------------
+    def popCrossedOrders(self, buyCrossPrice, sellCrossPrice):
+        """
+        取出会成交的委托，按发单顺序返回
+        买入委托价格不低于buyCrossPrice时成交，卖出委托价格不高于sellCrossPrice时成交，
+        撮合价为0（国内Tick行情涨跌停时）对应方向的委托无法成交
+        """
+        crossed = []
+        if buyCrossPrice > 0:
+            crossed.extend(popAbove(self.buyList, buyCrossPrice))
+        if sellCrossPrice > 0:
+            crossed.extend(popBelow(self.sellList, sellCrossPrice))
+        return self.toOrderList(crossed)
+
+    #----------------------------------------------------------------------
+    def popAllOrders(self):
+        """取出全部委托，按发单顺序返回，用于全部撤单"""
+        crossed = self.buyList + self.sellList
+        self.buyList = []
+        self.sellList = []
+        return self.toOrderList(crossed)
+
+    #----------------------------------------------------------------------
+    def toOrderList(self, crossed):
+        """将取出的列表元素按发单顺序转化为委托列表"""
+        if not crossed:
+            return []
+
+        crossed.sort(key=lambda x: x[1])
+        keyDict = self.keyDict
+        idName = self.idName
+        orderList = []
+        for price, seq, order in crossed:
+            del keyDict[getattr(order, idName)]
+            orderList.append(order)
+        return orderList
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空委托簿"""
+        self.buyList = []
+        self.sellList = []
+        self.keyDict = {}
+        self.count = 0
+
+
+########################################################################
+class StopOrderBook(LimitOrderBook):
+    """
+    停止单委托簿
+    """
+    idName = 'stopOrderID'
+
+    #----------------------------------------------------------------------
+    def popCrossedOrders(self, buyCrossPrice, sellCrossPrice):
+        """
+        取出会触发的停止单，按发单顺序返回
+        买入停止单价格不高于buyCrossPrice时触发，卖出停止单价格不低于sellCrossPrice时触发
+        """
+        crossed = popBelow(self.buyList, buyCrossPrice)
+        crossed.extend(popAbove(self.sellList, sellCrossPrice))
+        return self.toOrderList(crossed)
+
+
+#----------------------------------------------------------------------
+def popAbove(l, price):
+    """从按价格排序的列表中取出价格不低于price的元素"""
+    if not l:
+        return []
+
+    i = bisect_left(l, (price,))
+    popped = l[i:]
+    del l[i:]
+    return popped
+
+
+#----------------------------------------------------------------------
+def popBelow(l, price):
+    """从按价格排序的列表中取出价格不高于price的元素"""
+    if not l:
+        return []
+
+    i = bisect_right(l, (price, MAX_SEQUENCE))
+    popped = l[:i]
+    del l[:i]
+    return popped
@@ -0,0 +1,169 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了参数优化的抽样搜索和逐级减半（successive halving）。
+
+OptimizationSetting.generateSetting原先只生成全部参数的笛卡尔积，五个参数的网格
+就有上万个组合。这里：
+1. 随机抽样：从网格中无放回地随机抽取指定数量的参数组合，按组合编号抽样，
+   不需要先生成全部组合
+2. 拉丁超立方抽样：每个参数的取值范围等分为抽样数量的层，每层恰好抽取一个点，
+   各参数的层随机配对，再映射到网格上的取值，比随机抽样覆盖得更均匀
+3. 逐级减半：全部候选参数先在较短的回测窗口上回测，只保留目标值靠前的1/eta
+   进入下一级，窗口长度每级增加eta倍，最后一级使用完整的回测区间
+抽样的结果都是网格上的取值，和网格搜索、优化结果缓存兼容。
+'''
+
+from __future__ import division
+
+import math
+from datetime import timedelta
+
+import numpy as np
+
+
+# 参数组合的生成方式
+SEARCH_GRID = 'grid'        # 网格，全部组合
+SEARCH_RANDOM = 'random'    # 随机抽样
+SEARCH_LHS = 'lhs'          # 拉丁超立方抽样
+
+# 随机抽样时直接对全部组合编号做随机排列的最大组合数量，超过时使用拒绝抽样
+MAX_PERMUTATION_SIZE = 10000000
+
+
+#----------------------------------------------------------------------
+def decodeGridIndex(flatIndex, sizeList):
+    """
+    将组合编号转换为每个参数取值的位置，返回形状为(组合数量, 参数数量)的数组
+    最后一个参数变化最快，和itertools.product的顺序一致
+    """
+    rest = np.array(flatIndex, dtype=np.int64)
+    index = np.empty((len(rest), len(sizeList)), dtype=np.int64)
+    for j in range(len(sizeList) - 1, -1, -1):
+        index[:, j] = rest % sizeList[j]
+        rest //= sizeList[j]
+    return index
+
+
+#----------------------------------------------------------------------
+def gridSize(sizeList):
+    """参数组合的数量"""
+    return int(np.prod(sizeList, dtype=np.float64))
+
+
+#----------------------------------------------------------------------
+def randomFlatIndex(total, sampleNum, rng, exclude=None):
+    """从0到total-1中无放回地随机抽取sampleNum个组合编号，跳过exclude中的编号"""
+    exclude = set(exclude or [])
+    sampleNum = min(sampleNum, total - len(exclude))
+    if sampleNum <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if total <= MAX_PERMUTATION_SIZE:
+        flatIndex = rng.permutation(total)
+        if exclude:
+            flatIndex = flatIndex[~np.in1d(flatIndex, list(exclude))]
+        return flatIndex[:sampleNum]
+
+    # 组合数量远大于抽样数量，重复的概率很小，按抽取的顺序去重
+    flatIndex = []
+    while len(flatIndex) < sampleNum:
+        for n in rng.randint(0, total, size=sampleNum - len(flatIndex)):
+            if n not in exclude:
+                exclude.add(n)
+                flatIndex.append(n)
+    return np.array(flatIndex, dtype=np.int64)
+
+
+#----------------------------------------------------------------------
+def randomGridIndex(sizeList, sampleNum, rng):
+    """无放回地随机抽取sampleNum个参数组合，抽样数量不少于组合数量时返回全部组合"""
+    total = gridSize(sizeList)
+    if sampleNum >= total:
+        return decodeGridIndex(np.arange(total), sizeList)
+    return decodeGridIndex(randomFlatIndex(total, sampleNum, rng), sizeList)
+
+
+#----------------------------------------------------------------------
+def latinHypercubeIndex(sizeList, sampleNum, rng):
+    """
+    拉丁超立方抽样sampleNum个参数组合，数量不超过全部组合的数量
+    每个参数的第k层为[k/sampleNum, (k+1)/sampleNum)，层内均匀抽取一个点，
+    再按所在区间映射到该参数的sizeList[j]个取值之一；
+    映射到网格后重复的组合只保留一个，不足的数量从其余组合中随机抽取补足
+    """
+    index = np.empty((sampleNum, len(sizeList)), dtype=np.int64)
+    for j, size in enumerate(sizeList):
+        u = (rng.permutation(sampleNum) + rng.uniform(size=sampleNum)) / sampleNum
+        index[:, j] = np.minimum((u * size).astype(np.int64), size - 1)
+
+    # 去重，保持抽样的顺序
+    first = np.unique(index, axis=0, return_index=True)[1]
+    index = index[np.sort(first)]
+
+    # 补足重复的数量
+    shortfall = min(sampleNum, gridSize(sizeList)) - len(index)
+    if shortfall > 0:
+        chosen = np.ravel_multi_index(tuple(index.T), sizeList)
+        extra = randomFlatIndex(gridSize(sizeList), shortfall, rng, chosen.tolist())
+        index = np.concatenate([index, decodeGridIndex(extra, sizeList)])
+    return index
+
+
+#----------------------------------------------------------------------
+def sampleSettings(paramDict, mode, sampleNum, seed=None):
+    """按抽样方式从参数网格中生成参数组合的列表，paramDict为{参数名: 取值列表}"""
+    nameList = list(paramDict.keys())
+    valueList = list(paramDict.values())
+    sizeList = [len(values) for values in valueList]
+    if not nameList or not all(sizeList) or sampleNum <= 0:
+        return []
+
+    rng = np.random.RandomState(seed)
+    if mode == SEARCH_RANDOM:
+        index = randomGridIndex(sizeList, sampleNum, rng)
+    elif mode == SEARCH_LHS:
+        index = latinHypercubeIndex(sizeList, sampleNum, rng)
+    else:
+        raise ValueError(u'不支持的抽样方式：%s' % mode)
+
+    settingList = []
+    for row in index:
+        settingList.append(dict((name, values[i]) for name, values, i
+                                in zip(nameList, valueList, row)))
+    return settingList
+
+
+#----------------------------------------------------------------------
+def halvingWindows(startDate, endDate, eta=3, minDays=30):
+    """
+    逐级减半每一级的回测结束日期（'20170101'格式的字符串），从短到长，最后一级为endDate
+    窗口都从startDate开始，每级长度为下一级的1/eta，最短的窗口不少于minDays天
+    """
+    totalDays = (endDate - startDate).total_seconds() / 86400
+    windowList = [endDate.strftime('%Y%m%d')]
+    days = totalDays / eta
+    while days >= minDays:
+        windowEnd = (startDate + timedelta(days=math.ceil(days))).strftime('%Y%m%d')
+        if windowEnd != windowList[0]:
+            windowList.insert(0, windowEnd)
+        days /= eta
+    return windowList
+
+
+#----------------------------------------------------------------------
+def rankResults(resultList, settingList):
+    """
+    按目标值从高到低排列[(参数字符串, 目标值)]，目标值相同时保持settingList中的顺序
+    多进程的结果按完成的先后顺序返回，排序后和单进程的结果一致
+    """
+    orderDict = dict((str(setting), n) for n, setting in enumerate(settingList))
+    resultList = sorted(resultList, key=lambda result: orderDict[result[0]])
+    resultList.sort(reverse=True, key=lambda result: result[1])
+    return resultList
+
+
+#----------------------------------------------------------------------
+def promoteCount(n, eta=3):
+    """每一级晋级的参数组合数量"""
+    return max(1, int(math.ceil(n / eta)))
@@ -0,0 +1,356 @@
+# encoding: UTF-8
+
+'''
+本文件中包含的是CTA模块的组合回测引擎。
+
+每个品种使用一个独立的BacktestingEngine负责数据载入、策略和撮合，
+组合引擎将各个品种的数据流通过堆进行按时间顺序的多路归并，单次遍历
+即可驱动所有品种的策略，并汇总组合层面的盈亏。
+
+对于j/jm、rb/hc这类需要同时参考多个品种的组合，可以开启as-of对齐：
+每个时间点处理完成后，向实现了onAlignedBars的策略推送各品种截至
+该时间点的最新K线。
+
+组合的资金曲线由各品种逐根K线的盯市权益按时间对齐后相加得到，包含持仓的
+浮动盈亏；未单独设置资金的品种平分组合中剩余的资金。
+'''
+from __future__ import division
+
+import heapq
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine, formatNumber
+from vnpy.trader.app.ctaStrategy.ctaDailyResult import (calculateDrawdown, logReturns,
+                                                        calculateDailyStatistics)
+
+
+# 各品种每日结果中按日相加的字段
+DAILY_SUM_COLUMNS = ['tradeCount', 'turnover', 'commission', 'slippage', 'netPnl',
+                     'totalPnl', 'holdingPnl', 'tradingPnl', 'longNetPnl', 'shortNetPnl']
+
+
+########################################################################
+class PortfolioBacktestingEngine(object):
+    """
+    CTA组合回测引擎
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.legList = []           # 各品种的回测引擎
+        self.nameList = []          # 各品种的名称，和legList一一对应
+
+        self.mode = BacktestingEngine.BAR_MODE
+        self.startDate = ''
+        self.initDays = 0
+        self.endDate = ''
+
+        self.initcapital = 0        # 组合初始资金
+
+        self.asof = False           # 是否开启as-of对齐
+        self.asofTolerance = None   # as-of对齐时最新K线的最大时间差，None表示不限制
+
+    #----------------------------------------------------------------------
+    def setStartDate(self, startDate='20100416', initDays=10):
+        """设置回测的启动日期"""
+        self.startDate = startDate
+        self.initDays = initDays
+
+    #----------------------------------------------------------------------
+    def setEndDate(self, endDate=''):
+        """设置回测的结束日期"""
+        self.endDate = endDate
+
+    #----------------------------------------------------------------------
+    def setBacktestingMode(self, mode):
+        """设置回测模式"""
+        self.mode = mode
+
+    #----------------------------------------------------------------------
+    def setInitialCapital(self, initcapital):
+        """设置组合初始资金，未单独设置资金的品种平分其中剩余的部分"""
+        self.initcapital = initcapital
+
+    #----------------------------------------------------------------------
+    def setAsofAlignment(self, asof=True, tolerance=None):
+        """
+        设置as-of对齐
+        tolerance为timedelta，超过该时间差的K线不再作为对应品种的最新K线推送
+        """
+        self.asof = asof
+        self.asofTolerance = tolerance
+
+    #----------------------------------------------------------------------
+    def addSymbol(self, dbName, symbol, strategyClass, setting=None,
+                  size=1, rate=0, slippage=0, priceTick=0, leverage=1,
+                  capital=0, name=''):
+        """
+        增加回测品种，返回该品种的回测引擎
+        可以继续在返回的引擎上设置缓存、预读取、交易结果写出、终止条件等选项，
+        回测模式和日期在runBacktesting时统一使用组合的设置
+        capital为该品种的资金，为0时平分组合中剩余的资金；
+        name为该品种在结果和as-of对齐中的名称，默认为集合名，同一合约添加多次时必须指定
+        """
+        name = name or symbol
+        if name in self.nameList:
+            raise ValueError(u'回测品种名称重复：%s，同一合约添加多次时请通过name区分' % name)
+
+        engine = BacktestingEngine()
+        engine.setDatabase(dbName, symbol)
+        engine.setSize(size)
+        engine.setRate(rate)
+        engine.setSlippage(slippage)
+        engine.setPriceTick(priceTick)
+        engine.setLeverage(leverage)
+        engine.setInitialCapital(capital)
+        engine.initStrategy(strategyClass, setting)
+
+        self.legList.append(engine)
+        self.nameList.append(name)
+        return engine
+
+    #----------------------------------------------------------------------
+    def iterLegData(self, n, engine):
+        """生成某个品种的(时间, 品种序号, 序号, 数据)序列，用于归并排序"""
+        for seq, data in enumerate(engine.backtestingData):
+            yield (data.datetime, n, seq, data)
+
+    #----------------------------------------------------------------------
+    def allocateCapital(self):
+        """未单独设置资金的品种平分组合中剩余的资金，组合资金为0时使用各品种资金的合计"""
+        allocated = sum(engine.initcapital for engine in self.legList)
+        unsetList = [engine for engine in self.legList if not engine.initcapital]
+
+        if not unsetList:
+            if not self.initcapital:
+                self.initcapital = allocated
+            return
+
+        remaining = self.initcapital - allocated
+        if remaining <= 0:
+            raise ValueError(u'组合资金%s不足以分配给未设置资金的%s个品种'
+                             % (self.initcapital, len(unsetList)))
+        for engine in unsetList:
+            engine.setInitialCapital(remaining / len(unsetList))
+
+    #----------------------------------------------------------------------
+    def runBacktesting(self):
+        """运行组合回测"""
+        if not self.startDate:
+            raise ValueError(u'组合回测需要先通过setStartDate设置启动日期')
+
+        self.output(u'开始组合回测，品种数量：%s' %len(self.legList))
+        self.allocateCapital()
+
+        for engine in self.legList:
+            # 各品种使用组合的回测模式和日期
+            engine.setBacktestingMode(self.mode)
+            engine.setStartDate(self.startDate, self.initDays)
+            engine.setEndDate(self.endDate)
+            engine.prepareBacktesting()
+
+        self.output(u'策略初始化完成，开始回放数据')
+
+        # 满足终止条件的品种不再推送数据
+        funcList = [engine.replayData for engine in self.legList]
+        streams = [self.iterLegData(n, engine) for n, engine in enumerate(self.legList)]
+
+        # 各品种的数据流均已按时间排序，使用堆进行多路归并
+        merged = heapq.merge(*streams)
+
+        if not self.asof:
+            for dt, n, seq, data in merged:
+                if not self.legList[n].stopReason:
+                    funcList[n](data)
+        else:
+            lastDataDict = {}
+            currentDt = None
+
+            for dt, n, seq, data in merged:
+                # 进入新的时间点前，推送上一个时间点对齐后的数据
+                if currentDt is not None and dt != currentDt:
+                    self.pushAlignedData(currentDt, lastDataDict)
+                currentDt = dt
+
+                if self.legList[n].stopReason:
+                    continue
+                funcList[n](data)
+                lastDataDict[n] = data
+
+            if currentDt is not None:
+                self.pushAlignedData(currentDt, lastDataDict)
+
+        for engine in self.legList:
+            engine.finishBacktesting()
+
+        self.output(u'数据回放结束')
+
+    #----------------------------------------------------------------------
+    def pushAlignedData(self, dt, lastDataDict):
+        """向策略推送as-of对齐后的各品种最新数据，key为品种的名称"""
+        alignedDict = {}
+        for n, data in lastDataDict.items():
+            if self.asofTolerance is not None and dt - data.datetime > self.asofTolerance:
+                continue
+            alignedDict[self.nameList[n]] = data
+
+        for engine in self.legList:
+            func = getattr(engine.strategy, 'onAlignedBars', None)
+            if func:
+                func(dt, alignedDict)
+
+    #----------------------------------------------------------------------
+    def calculateDailyResult(self):
+        """
+        按交易日逐日盯市计算组合的每日盈亏
+        各品种每根K线结束时的盯市权益按时间对齐（取各品种截至该时间的最新值）后相加，
+        返回(每日结果DataFrame, 每根K线的资金曲线DataFrame)，有品种无法盯市时返回(None, None)
+        """
+        self.output(u'计算组合按日统计结果')
+
+        dailyList = []
+        equityList = []
+        for name, engine in zip(self.nameList, self.legList):
+            df, barDf = engine.calculateDailyResult()
+            if df is None:
+                self.output(u'%s无法逐日盯市' % name)
+                return None, None
+
+            dailyList.append(df[DAILY_SUM_COLUMNS])
+            equity = barDf['balance'] - engine.initcapital
+            equityList.append(equity[~equity.index.duplicated(keep='last')].rename(name))
+
+        # 各品种的权益在其他品种的时间点上沿用最近的值，第一根K线之前为0
+        equity = pd.concat(equityList, axis=1).sort_index().ffill().fillna(0)
+        barBalance = self.initcapital + equity.sum(axis=1).values
+        highlevel, drawdown, ddPercent = calculateDrawdown(barBalance, self.initcapital)
+        barDf = pd.DataFrame({'balance': barBalance,
+                              'highlevel': highlevel,
+                              'drawdown': drawdown,
+                              'ddPercent': ddPercent},
+                             index=equity.index,
+                             columns=['balance', 'highlevel', 'drawdown', 'ddPercent'])
+
+        # 各品种的每日结果按交易日相加
+        df = pd.concat(dailyList).groupby(level=0).sum()
+        df['balance'] = self.initcapital + df['netPnl'].cumsum()
+        df['return'] = logReturns(df['balance'], self.initcapital)
+        highlevel, drawdown, ddPercent = calculateDrawdown(df['balance'].values, self.initcapital)
+        df['highlevel'] = highlevel
+        df['drawdown'] = drawdown
+        df['ddPercent'] = ddPercent
+
+        return df, barDf
+
+    #----------------------------------------------------------------------
+    def calculateBacktestingResult(self):
+        """
+        计算组合回测结果
+        交易次数和胜率来自各品种按平仓时间合并的逐笔交易结果，
+        资金和回撤来自calculateDailyResult逐根K线盯市的资金曲线，包含持仓的浮动盈亏
+        """
+        self.output(u'计算组合回测结果')
+
+        legResultDict = {}
+        timeList = []
+        pnlList = []
+        nameList = []
+
+        for name, engine in zip(self.nameList, self.legList):
+            d = engine.calculateBacktestingResult()
+            legResultDict[name] = d
+            if not d:
+                continue
+
+            timeList.extend(d['timeList'])
+            pnlList.extend(d['pnlList'])
+            nameList.extend([name] * len(d['timeList']))
+
+        if not timeList:
+            self.output(u'无交易结果')
+            return {}
+
+        df, barDf = self.calculateDailyResult()
+        if df is None:
+            return {}
+
+        # 按平仓时间排序，时间相同时保持各品种原有顺序
+        order = np.argsort(np.array(timeList, dtype='datetime64[us]'), kind='mergesort')
+        pnlArray = np.array(pnlList)[order]
+
+        d = {}
+        d['capital'] = barDf['balance'].iloc[-1]
+        d['maxCapital'] = barDf['highlevel'].iloc[-1]
+        d['drawdown'] = barDf['drawdown'].iloc[-1]
+        d['maxDrawdown'] = barDf['drawdown'].min()
+        d['maxDdPercent'] = barDf['ddPercent'].min()
+        d['totalResult'] = len(pnlArray)
+        d['timeList'] = [timeList[i] for i in order]
+        d['nameList'] = [nameList[i] for i in order]
+        d['pnlList'] = pnlArray.tolist()
+        d['winningRate'] = (pnlArray >= 0).sum() / len(pnlArray) * 100
+        d['dailyResult'] = df
+        d['barResult'] = barDf
+        d['statistics'] = calculateDailyStatistics(df, barDf, self.initcapital)
+        d['legResultDict'] = legResultDict
+
+        return d
+
+    #----------------------------------------------------------------------
+    def showBacktestingResult(self):
+        """显示组合回测结果"""
+        d = self.calculateBacktestingResult()
+        if not d:
+            return
+
+        self.output('-' * 30)
+        self.output(u'第一笔交易：\t%s' % d['timeList'][0])
+        self.output(u'最后一笔交易：\t%s' % d['timeList'][-1])
+        self.output(u'总交易次数：\t%s' % formatNumber(d['totalResult']))
+        self.output(u'总盈亏：\t%s' % formatNumber(d['capital'] - self.initcapital))
+        self.output(u'最大回撤: \t%s' % formatNumber(d['maxDrawdown']))
+        self.output(u'最大回撤百分比: \t%s%%' % formatNumber(d['maxDdPercent']))
+        self.output(u'夏普比率：\t%s' % formatNumber(d['statistics']['sharpeRatio']))
+        self.output(u'胜率\t\t%s%%' % formatNumber(d['winningRate']))
+
+        for name, engine in zip(self.nameList, self.legList):
+            legResult = d['legResultDict'][name]
+            if not legResult:
+                self.output(u'%s：无交易结果' % name)
+                continue
+            self.output(u'%s：资金 %s，交易次数 %s，总盈亏 %s' % (name,
+                                                        formatNumber(engine.initcapital),
+                                                        formatNumber(legResult['totalResult']),
+                                                        formatNumber(sum(legResult['pnlList']))))
+
+    #----------------------------------------------------------------------
+    def output(self, content):
+        """输出内容"""
+        print str(datetime.now()) + "\t" + content
+
+
+if __name__ == '__main__':
+    # 以下内容是一段组合回测脚本的演示，螺纹钢和热卷同时回测
+    from strategyFiveminHb import MultiCycleStrategy
+    from strategyFiveminCta import KkRatioStrategy
+
+    engine = PortfolioBacktestingEngine()
+    engine.setBacktestingMode(BacktestingEngine.BAR_MODE)
+    engine.setStartDate('20150601')
+    engine.setEndDate('20170601')
+    engine.setInitialCapital(200000)
+
+    # 螺纹钢和热卷的数据时间戳不完全一致，使用as-of对齐，最多容忍5分钟的时间差
+    engine.setAsofAlignment(True, timedelta(minutes=5))
+
+    engine.addSymbol('FutureData_Sequence', 'rb888_1min_modi', MultiCycleStrategy, {},
+                     size=10, rate=3/10000, slippage=1, priceTick=1)
+    engine.addSymbol('FutureData_Index', 'hc000_1min_modi', KkRatioStrategy, {},
+                     size=10, rate=3/10000, slippage=1, priceTick=2)
+
+    engine.runBacktesting()
+    engine.showBacktestingResult()
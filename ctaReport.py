@@ -0,0 +1,197 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测结果的绘图和报告导出。
+
+原先的showBacktestingResult直接导入matplotlib和seaborn并调用plt.show()，
+批量回测时会阻塞，而且回撤图对每笔交易画一个bar，交易数量上千时绘图非常慢。
+这里：
+1. 较长的序列使用LTTB（Largest-Triangle-Three-Buckets）算法抽取少量的点，
+   保留曲线的形状和极值，10万个点的资金曲线也能在1秒内画完
+2. 回撤使用fill_between绘制，代替逐笔的bar
+3. exportReport使用Agg后端直接生成PNG或HTML文件，不依赖pyplot和图形界面，
+   可以在没有显示器的服务器上批量运行
+
+matplotlib只在绘图时导入，不需要报告的批量回测完全不会导入绘图相关的库。
+'''
+
+import base64
+import io
+import os
+
+import numpy as np
+
+
+# 每条曲线绘制的最大点数
+DEFAULT_MAX_POINTS = 2000
+
+# 报告图片的尺寸（英寸）和分辨率
+REPORT_FIGSIZE = (12, 10)
+REPORT_DPI = 100
+
+HTML_TEMPLATE = u'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+</head>
+<body>
+<h2>%(title)s</h2>
+<pre>%(statistics)s</pre>
+<img src="data:image/png;base64,%(image)s">
+</body>
+</html>
+'''
+
+
+#----------------------------------------------------------------------
+def lttbIndex(y, threshold):
+    """
+    使用LTTB算法从序列中抽取threshold个点，返回抽取的点的位置
+    首尾两点总是保留，中间的点平均分为threshold-2个区间，每个区间内选择和
+    前一个已选点、后一个区间均值所组成三角形面积最大的点
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    x = np.arange(n, dtype=np.float64)
+
+    # 区间的边界，第i个区间为[edges[i], edges[i+1])
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts = edges[:-1]
+    ends = edges[1:]
+
+    # 每个区间的均值
+    ySum = np.append(0, np.cumsum(y))
+    avgY = (ySum[ends] - ySum[starts]) / (ends - starts)
+    avgX = (starts + ends - 1) / 2.0
+
+    index = np.empty(threshold, dtype=np.int64)
+    index[0] = 0
+    index[-1] = n - 1
+
+    a = 0
+    lastBucket = threshold - 3
+    for i in range(threshold - 2):
+        start = starts[i]
+        end = ends[i]
+        if i < lastBucket:
+            nextX = avgX[i + 1]
+            nextY = avgY[i + 1]
+        else:
+            nextX = x[-1]
+            nextY = y[-1]
+
+        area = np.abs((x[a] - nextX) * (y[start:end] - y[a]) -
+                      (x[a] - x[start:end]) * (nextY - y[a]))
+        a = start + area.argmax()
+        index[i + 1] = a
+
+    return index
+
+
+#----------------------------------------------------------------------
+def tradeTimeTicks(tradeTimes, count, tickCount=10):
+    """计算持仓图的横轴刻度位置和标签，只格式化用到的时间"""
+    if not count:
+        return [], []
+    step = max(1, int(count / tickCount))
+    xindex = np.arange(0, count, step)
+    labels = [tradeTimes[i].strftime('%Y/%m/%d %H:%M:%S') for i in xindex]
+    return xindex, labels
+
+
+#----------------------------------------------------------------------
+def drawBacktestingResult(fig, d, pnlPctToggle=False, maxPoints=DEFAULT_MAX_POINTS):
+    """在fig上绘制回测结果：净值、回撤、每笔盈亏分布、持仓"""
+    # 净值
+    networth = np.asarray(d['networthList'])
+    index = lttbIndex(networth, maxPoints)
+    timeList = np.asarray(d['timeList'], dtype=object)
+
+    pCapital = fig.add_subplot(4, 1, 1)
+    pCapital.set_ylabel('networth')
+    pCapital.plot(timeList[index], networth[index], color='r', lw=0.8)
+
+    # 回撤和每笔盈亏
+    if not pnlPctToggle:
+        ddName, drawdown = 'DD', np.asarray(d['drawdownList'])
+        pnlName, pnl = 'pnl', d['pnlList']
+    else:
+        ddName, drawdown = 'DD_PCT', np.asarray(d['drawdownpctList'])
+        pnlName, pnl = 'pnlPct', d['pnlPctList']
+
+    index = lttbIndex(drawdown, maxPoints)
+    pDD = fig.add_subplot(4, 1, 2)
+    pDD.set_ylabel(ddName)
+    pDD.fill_between(index, drawdown[index], 0, color='g', lw=0)
+    pDD.set_xlim(0, max(len(drawdown) - 1, 1))
+
+    pPnl = fig.add_subplot(4, 1, 3)
+    pPnl.set_ylabel(pnlName)
+    pPnl.hist(pnl, bins=50, color='c')
+
+    # 持仓，最后平仓后的空仓不显示
+    posList = np.asarray(d['posList'])
+    if len(posList) and posList[-1] == 0:
+        posList = posList[:-1]
+    index = lttbIndex(posList, maxPoints)
+
+    pPos = fig.add_subplot(4, 1, 4)
+    pPos.set_ylabel('Position')
+    pPos.plot(index, posList[index], color='k', drawstyle='steps-pre')
+    pPos.set_ylim(-1.2, 1.2)
+
+    xindex, labels = tradeTimeTicks(d['tradeTimeList'], len(d['tradeTimeList']))
+    pPos.set_xticks(xindex)
+    pPos.set_xticklabels(labels, rotation=10)
+
+    fig.tight_layout()
+
+
+#----------------------------------------------------------------------
+def renderPng(d, pnlPctToggle=False, maxPoints=DEFAULT_MAX_POINTS,
+              figsize=REPORT_FIGSIZE, dpi=REPORT_DPI):
+    """使用Agg后端将回测结果绘制为PNG，返回图片的二进制数据"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    drawBacktestingResult(fig, d, pnlPctToggle, maxPoints)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+#----------------------------------------------------------------------
+def escapeHtml(text):
+    """转义HTML中的特殊字符"""
+    return text.replace(u'&', u'&amp;').replace(u'<', u'&lt;').replace(u'>', u'&gt;')
+
+
+#----------------------------------------------------------------------
+def exportReport(d, filename, lines=None, pnlPctToggle=False, maxPoints=DEFAULT_MAX_POINTS,
+                 title=u'Backtesting Report'):
+    """
+    导出回测报告，不需要图形界面
+    文件扩展名为.html时生成包含统计结果文本和图片的HTML文件，否则生成PNG图片
+    lines为统计结果的文本行
+    """
+    image = renderPng(d, pnlPctToggle, maxPoints)
+
+    if os.path.splitext(filename)[1].lower() not in ('.html', '.htm'):
+        with open(filename, 'wb') as f:
+            f.write(image)
+        return filename
+
+    statistics = u'\n'.join([escapeHtml(line) for line in (lines or [])])
+    html = HTML_TEMPLATE % {'title': escapeHtml(title),
+                            'statistics': statistics,
+                            'image': base64.b64encode(image).decode('ascii')}
+    with io.open(filename, 'w', encoding='utf-8') as f:
+        f.write(html)
+    return filename
@@ -0,0 +1,143 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了参数优化结果的本地缓存。
+
+扩大参数范围后重新优化时，已经计算过的参数组合会全部重新回测。这里使用SQLite
+保存每个参数组合的目标值，缓存键为以下内容的哈希：
+1. 策略类（包括其父类）的源代码
+2. 参数字典
+3. 回测引擎的设置（模式、日期、资金、滑点、手续费、合约大小、最小价格变动、杠杆、
+   预先聚合的K线和提前终止条件）
+4. 回测数据的指纹（数据库中回测区间的数据量和最后一条数据的时间，或本地数据文件的大小
+   和修改时间），不需要载入数据
+同一个缓存键下按目标名称分别保存目标值，优化时只需要回测缓存中没有的参数组合。
+修改了策略代码、回测设置或者数据更新后，缓存键随之改变，不会读到过期的结果。
+'''
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+
+# 默认的缓存文件名
+DEFAULT_CACHE_FILENAME = 'optimizationCache.db'
+
+# 每次查询的缓存键数量，SQLite的参数数量有上限
+QUERY_BATCH_SIZE = 500
+
+
+#----------------------------------------------------------------------
+def jsonDefault(obj):
+    """序列化json不支持的对象：时间转为字符串，其他对象使用类名和属性字典"""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if hasattr(obj, '__dict__'):
+        return [obj.__class__.__name__, obj.__dict__]
+    return repr(obj)
+
+
+#----------------------------------------------------------------------
+def hashContent(content):
+    """将内容序列化为json后计算哈希"""
+    text = json.dumps(content, sort_keys=True, default=jsonDefault)
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+#----------------------------------------------------------------------
+def strategyFingerprint(strategyClass):
+    """策略类及其父类源代码的哈希，取不到源代码的类（如交互式定义的类）使用模块和类名"""
+    sourceList = []
+    for cls in inspect.getmro(strategyClass):
+        if cls is object:
+            continue
+        try:
+            source = inspect.getsource(cls)
+        except (IOError, TypeError):
+            source = '%s.%s' % (cls.__module__, cls.__name__)
+        if isinstance(source, str):
+            source = source.decode('utf-8', 'replace')
+        sourceList.append(source)
+    return hashContent(sourceList)
+
+
+#----------------------------------------------------------------------
+def directoryFingerprint(path):
+    """目录下全部文件的相对路径、大小和修改时间的哈希，用于本地数据文件"""
+    fileList = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            filePath = os.path.join(dirpath, filename)
+            stat = os.stat(filePath)
+            fileList.append([os.path.relpath(filePath, path), stat.st_size, stat.st_mtime])
+    return hashContent(sorted(fileList))
+
+
+#----------------------------------------------------------------------
+def makeCacheKey(strategyHash, setting, engineSetting, dataHash):
+    """参数组合的缓存键"""
+    return hashContent([strategyHash, setting, engineSetting, dataHash])
+
+
+########################################################################
+class ResultCache(object):
+    """
+    参数优化结果的SQLite缓存
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, path=''):
+        """Constructor"""
+        if not path:
+            path = os.path.join(os.getcwd(), DEFAULT_CACHE_FILENAME)
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS result ('
+                                'key TEXT, target TEXT, setting TEXT, value REAL, '
+                                'PRIMARY KEY (key, target))')
+        self.connection.commit()
+
+    #----------------------------------------------------------------------
+    def getResults(self, keyList, targetName):
+        """查询缓存的目标值，返回{缓存键: 目标值}，只包含缓存中存在的键"""
+        resultDict = {}
+        for start in range(0, len(keyList), QUERY_BATCH_SIZE):
+            batch = list(keyList[start:start+QUERY_BATCH_SIZE])
+            sql = ('SELECT key, value FROM result WHERE target = ? AND key IN (%s)'
+                   % ','.join(['?'] * len(batch)))
+            for key, value in self.connection.execute(sql, [targetName] + batch):
+                # NaN在SQLite中保存为NULL
+                resultDict[key] = float('nan') if value is None else value
+        return resultDict
+
+    #----------------------------------------------------------------------
+    def putResults(self, recordList, targetName):
+        """写入目标值，recordList为[(缓存键, 参数字符串, 目标值)]"""
+        self.connection.executemany('INSERT OR REPLACE INTO result VALUES (?, ?, ?, ?)',
+                                    [(key, targetName, setting, value)
+                                     for key, setting, value in recordList])
+        self.connection.commit()
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空缓存"""
+        self.connection.execute('DELETE FROM result')
+        self.connection.commit()
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """关闭数据库连接"""
+        self.connection.close()
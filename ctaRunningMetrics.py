@@ -0,0 +1,206 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测过程中在线更新的统计指标和提前终止条件。
+
+原先的统计指标全部在回测结束后由calculateBacktestingResult计算，
+参数优化时明显无效的参数组合也要跑完整个回测区间。这里：
+1. RunningMetrics在每笔成交时按先进先出配对平仓的交易，更新资金、最大回撤、
+   交易次数、胜率，每笔盈亏的均值和方差使用Welford算法，每笔成交的计算量为O(1)，
+   资金和回撤的计算方式和calculateBacktestingResult一致
+2. 终止条件为StopCondition的子类，回测引擎在每次数据推送后检查，
+   任一条件满足时停止回放。条件对象需要可以pickle，以便传递给多进程优化的子进程
+3. 参数优化中提前终止的参数组合，目标值记为STOPPED_TARGET_VALUE
+'''
+
+from __future__ import division
+
+from datetime import datetime
+
+from vnpy.trader.vtConstant import DIRECTION_LONG
+from vnpy.trader.app.ctaStrategy.ctaTradeWriter import FifoTradeMatcher
+
+
+# 提前终止的回测在参数优化中的目标值，排在所有正常结束的回测之后
+STOPPED_TARGET_VALUE = float('-inf')
+
+
+########################################################################
+class RunningMetrics(object):
+    """
+    在线更新的回测统计指标
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, initcapital=0, size=1, rate=0, slippage=0, leverage=1):
+        """Constructor"""
+        self.matcher = FifoTradeMatcher()
+        self.reset(initcapital, size, rate, slippage, leverage)
+
+    #----------------------------------------------------------------------
+    def reset(self, initcapital=0, size=1, rate=0, slippage=0, leverage=1):
+        """设置回测参数并清空统计"""
+        self.initcapital = initcapital
+        self.size = size
+        self.rate = rate
+        self.slippage = slippage
+        self.leverage = leverage
+        self.clear()
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空统计"""
+        self.matcher.clear()
+
+        self.capital = self.initcapital     # 资金
+        self.maxCapital = 0                 # 资金最高净值，和calculateBacktestingResult一样不低于0
+        self.drawdown = 0                   # 当前回撤
+        self.drawdownPct = 0                # 当前回撤比例
+        self.maxDrawdown = 0                # 最大回撤（负数）
+        self.maxDrawdownPct = 0             # 最大回撤比例（负数）
+
+        self.tradeCount = 0                 # 交易次数（平仓配对的数量）
+        self.winningCount = 0               # 盈利次数
+        self.pnlMean = 0                    # 每笔盈亏的均值
+        self.pnlM2 = 0                      # 每笔盈亏的离差平方和
+
+    #----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """处理一笔成交，更新平仓交易的统计"""
+        matched = self.matcher.match(trade.direction == DIRECTION_LONG, trade.price,
+                                     trade.volume, trade.dt)
+        for entryPrice, entryDt, volume in matched:
+            turnover = (entryPrice + trade.price) * self.size * abs(volume)
+            commission = turnover * self.rate
+            slippage = self.slippage * 2 * self.size * abs(volume)
+            pnl = (trade.price - entryPrice) * volume * self.size - commission - slippage
+            self.updateResult(pnl)
+
+    #----------------------------------------------------------------------
+    def updateResult(self, pnl):
+        """加入一笔交易的盈亏"""
+        pnl = self.leverage * pnl
+
+        # 资金和回撤
+        self.capital += pnl
+        if self.capital > self.maxCapital:
+            self.maxCapital = self.capital
+        self.drawdown = self.capital - self.maxCapital
+        self.drawdownPct = self.drawdown / self.maxCapital if self.maxCapital else 0
+        if self.drawdown < self.maxDrawdown:
+            self.maxDrawdown = self.drawdown
+        if self.drawdownPct < self.maxDrawdownPct:
+            self.maxDrawdownPct = self.drawdownPct
+
+        # 胜率，盈亏为0视为盈利
+        self.tradeCount += 1
+        if pnl >= 0:
+            self.winningCount += 1
+
+        # Welford算法更新均值和方差
+        delta = pnl - self.pnlMean
+        self.pnlMean += delta / self.tradeCount
+        self.pnlM2 += delta * (pnl - self.pnlMean)
+
+    #----------------------------------------------------------------------
+    @property
+    def winningRate(self):
+        """胜率（百分比）"""
+        if not self.tradeCount:
+            return 0
+        return self.winningCount / self.tradeCount * 100
+
+    #----------------------------------------------------------------------
+    @property
+    def pnlVariance(self):
+        """每笔盈亏的样本方差"""
+        if self.tradeCount < 2:
+            return 0
+        return self.pnlM2 / (self.tradeCount - 1)
+
+    #----------------------------------------------------------------------
+    @property
+    def pnlStd(self):
+        """每笔盈亏的样本标准差"""
+        return self.pnlVariance ** 0.5
+
+    #----------------------------------------------------------------------
+    def getResult(self):
+        """当前统计指标的字典"""
+        d = {}
+        d['capital'] = self.capital
+        d['maxCapital'] = self.maxCapital
+        d['drawdown'] = self.drawdown
+        d['maxDrawdown'] = self.maxDrawdown
+        d['maxDrawdownPct'] = self.maxDrawdownPct
+        d['totalResult'] = self.tradeCount
+        d['winningRate'] = self.winningRate
+        d['pnlMean'] = self.pnlMean
+        d['pnlStd'] = self.pnlStd
+        return d
+
+
+########################################################################
+class StopCondition(object):
+    """
+    回测提前终止条件的基类
+    """
+
+    #----------------------------------------------------------------------
+    def check(self, metrics, dt):
+        """检查是否需要终止回测，需要时返回终止原因，否则返回空字符串"""
+        raise NotImplementedError
+
+
+########################################################################
+class DrawdownStop(StopCondition):
+    """
+    回撤低于limit时终止，limit为负数，和回测结果中回撤的符号一致
+    pct为True时limit为回撤比例（如-0.3），否则为回撤金额
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, limit, pct=False):
+        """Constructor"""
+        self.limit = limit
+        self.pct = pct
+
+    #----------------------------------------------------------------------
+    def check(self, metrics, dt):
+        """检查当前回撤"""
+        drawdown = metrics.drawdownPct if self.pct else metrics.drawdown
+        if drawdown < self.limit:
+            return u'回撤%s低于%s' % (drawdown, self.limit)
+        return ''
+
+
+########################################################################
+class MinTradeCountStop(StopCondition):
+    """
+    到deadline时交易次数仍少于minCount则终止，deadline为datetime或'20170101'格式的字符串
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, minCount, deadline):
+        """Constructor"""
+        if not isinstance(deadline, datetime):
+            deadline = datetime.strptime(deadline, '%Y%m%d')
+        self.minCount = minCount
+        self.deadline = deadline
+
+    #----------------------------------------------------------------------
+    def check(self, metrics, dt):
+        """检查截止时间时的交易次数"""
+        if dt >= self.deadline and metrics.tradeCount < self.minCount:
+            return u'%s时交易次数%s少于%s' % (self.deadline, metrics.tradeCount, self.minCount)
+        return ''
+
+
+#----------------------------------------------------------------------
+def checkStopConditions(conditionList, metrics, dt):
+    """依次检查终止条件，返回第一个满足的条件的终止原因"""
+    for condition in conditionList:
+        reason = condition.check(metrics, dt)
+        if reason:
+            return reason
+    return ''
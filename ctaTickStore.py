@@ -0,0 +1,361 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测用的压缩Tick存储。
+
+Tick数据比分钟线大一个数量级，逐条从MongoDB读取并创建VtTickData，
+多个月的Tick回测在内存和耗时上都难以承受。这里将Tick按列压缩存储：
+1. 时间戳转化为微秒整数后差分编码
+2. 价格除以最小价格变动转化为整数跳数后差分编码
+3. 成交量、持仓量等整数字段差分编码
+4. 差分后的数组使用能容纳其取值范围的最小整数类型，再以npz压缩保存
+5. NaN和CTP以DBL_MAX表示的无效价格（如没有挂单时的买卖价）在编码前记为0
+
+数据按品种和自然日分区：
+    root/symbol/info.json           合约信息和最小价格变动
+    root/symbol/YYYYMMDD.npz        当日的压缩Tick数据
+
+解码使用cumsum完成，全部为向量化操作。回放时逐个分区解码，内存中只保留当天的数据。
+'''
+
+import os
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBarCache import DATETIME_COLUMN, DATETIME_DTYPE
+
+
+# 以最小价格变动为单位存储的价格字段
+TICK_PRICE_FIELDS = ['lastPrice', 'bidPrice1', 'askPrice1', 'upperLimit', 'lowerLimit']
+
+# 以整数存储的数量字段
+TICK_VOLUME_FIELDS = ['volume', 'openInterest', 'bidVolume1', 'askVolume1']
+
+TICK_FIELDS = [DATETIME_COLUMN] + TICK_PRICE_FIELDS + TICK_VOLUME_FIELDS
+
+INFO_FILENAME = 'info.json'
+DAY_FORMAT = '%Y%m%d'
+
+# 每次从列数据中转换为Python对象的Tick数量
+REPLAY_CHUNK_SIZE = 20000
+
+# 绝对值不小于该值的数据视为无效的占位值（如CTP的DBL_MAX），无法转换为整数跳数
+INVALID_VALUE_LIMIT = 1e15
+
+
+#----------------------------------------------------------------------
+def smallestIntType(values):
+    """返回能够容纳数组取值范围的最小整数类型"""
+    if not len(values):
+        return np.int8
+
+    low = values.min()
+    high = values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if low >= info.min and high <= info.max:
+            return dtype
+    return np.int64
+
+
+#----------------------------------------------------------------------
+def validValues(values):
+    """转化为浮点数组，NaN、无穷大和无效的占位值替换为0"""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        invalid = ~np.isfinite(values) | (np.abs(values) >= INVALID_VALUE_LIMIT)
+    return np.where(invalid, 0, values)
+
+
+#----------------------------------------------------------------------
+def deltaEncode(values):
+    """差分编码，返回(首个值, 差分数组)"""
+    values = np.asarray(values, dtype=np.int64)
+    if not len(values):
+        return 0, np.array([], dtype=np.int8)
+
+    deltas = np.diff(values)
+    return int(values[0]), deltas.astype(smallestIntType(deltas))
+
+
+#----------------------------------------------------------------------
+def deltaDecode(first, deltas):
+    """差分解码"""
+    values = np.empty(len(deltas) + 1, dtype=np.int64)
+    values[0] = first
+    np.cumsum(deltas, out=values[1:])
+    values[1:] += first
+    return values
+
+
+#----------------------------------------------------------------------
+def encodeTickArrays(arrays, priceTick):
+    """将Tick列数据编码为待压缩保存的数组字典"""
+    encoded = {}
+
+    datetimes = np.asarray(arrays[DATETIME_COLUMN], dtype=DATETIME_DTYPE).astype(np.int64)
+    encoded['count'] = np.array([len(datetimes)])
+    first, deltas = deltaEncode(datetimes)
+    encoded['first_' + DATETIME_COLUMN] = np.array([first])
+    encoded['delta_' + DATETIME_COLUMN] = deltas
+
+    for name in TICK_PRICE_FIELDS:
+        ticks = np.round(validValues(arrays[name]) / priceTick).astype(np.int64)
+        first, deltas = deltaEncode(ticks)
+        encoded['first_' + name] = np.array([first])
+        encoded['delta_' + name] = deltas
+
+    for name in TICK_VOLUME_FIELDS:
+        first, deltas = deltaEncode(np.round(validValues(arrays[name])))
+        encoded['first_' + name] = np.array([first])
+        encoded['delta_' + name] = deltas
+
+    return encoded
+
+
+#----------------------------------------------------------------------
+def emptyTickArrays(fields=None):
+    """生成空的Tick列数据字典"""
+    arrays = {}
+    for name in fields or TICK_FIELDS:
+        arrays[name] = np.array([], dtype=DATETIME_DTYPE if name == DATETIME_COLUMN else np.float64)
+    return arrays
+
+
+#----------------------------------------------------------------------
+def decodeTickArrays(encoded, priceTick, fields=None):
+    """
+    将压缩保存的数组字典解码为Tick列数据
+    fields为需要解码的字段，默认为全部字段，时间字段总是解码
+    """
+    fields = [DATETIME_COLUMN] + [name for name in fields or TICK_FIELDS if name != DATETIME_COLUMN]
+    if not int(encoded['count'][0]):
+        return emptyTickArrays(fields)
+
+    arrays = {}
+    for name in fields:
+        values = deltaDecode(encoded['first_' + name][0], encoded['delta_' + name])
+        if name == DATETIME_COLUMN:
+            arrays[name] = values.astype(DATETIME_DTYPE)
+        elif name in TICK_PRICE_FIELDS:
+            arrays[name] = values * priceTick
+        else:
+            arrays[name] = values
+
+    return arrays
+
+
+#----------------------------------------------------------------------
+def tickDocsToArrays(docs):
+    """将数据库中读出的Tick文档列表转化为列数据字典，缺失和无效的数值记为0"""
+    arrays = {DATETIME_COLUMN: np.array([d['datetime'] for d in docs], dtype=DATETIME_DTYPE)}
+    for name in TICK_PRICE_FIELDS + TICK_VOLUME_FIELDS:
+        arrays[name] = validValues([d.get(name) for d in docs])
+    return arrays
+
+
+########################################################################
+class ArrayTick(object):
+    """
+    轻量Tick对象
+    常用字段使用__slots__保存，其余VtTickData字段以类属性提供默认值
+    """
+    __slots__ = ['vtSymbol', 'symbol', 'exchange', 'datetime'] + TICK_PRICE_FIELDS + TICK_VOLUME_FIELDS
+
+    gatewayName = ''
+    rawData = None
+    lastVolume = 0
+    openPrice = 0.0
+    highPrice = 0.0
+    lowPrice = 0.0
+    preClosePrice = 0.0
+
+    bidPrice2 = bidPrice3 = bidPrice4 = bidPrice5 = 0.0
+    askPrice2 = askPrice3 = askPrice4 = askPrice5 = 0.0
+    bidVolume2 = bidVolume3 = bidVolume4 = bidVolume5 = 0
+    askVolume2 = askVolume3 = askVolume4 = askVolume5 = 0
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol='', symbol='', exchange=''):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.symbol = symbol
+        self.exchange = exchange
+        self.datetime = None
+
+    #----------------------------------------------------------------------
+    @property
+    def date(self):
+        """Tick日期字符串"""
+        return self.datetime.strftime('%Y%m%d')
+
+    #----------------------------------------------------------------------
+    @property
+    def time(self):
+        """Tick时间字符串"""
+        return self.datetime.strftime('%H:%M:%S.%f')[:-3]
+
+
+#----------------------------------------------------------------------
+def iterArrayTicks(arrays, info=None):
+    """从列数据中逐条生成ArrayTick"""
+    info = info or {}
+    vtSymbol = info.get('vtSymbol', '')
+    symbol = info.get('symbol', '')
+    exchange = info.get('exchange', '')
+
+    names = TICK_PRICE_FIELDS + TICK_VOLUME_FIELDS
+    total = len(arrays[DATETIME_COLUMN])
+
+    for start in range(0, total, REPLAY_CHUNK_SIZE):
+        end = min(start + REPLAY_CHUNK_SIZE, total)
+
+        datetimes = arrays[DATETIME_COLUMN][start:end].astype(object)
+        columns = [(name, arrays[name][start:end].tolist()) for name in names]
+
+        for i, dt in enumerate(datetimes):
+            tick = ArrayTick(vtSymbol, symbol, exchange)
+            tick.datetime = dt
+            for name, values in columns:
+                setattr(tick, name, values[i])
+            yield tick
+
+
+########################################################################
+class TickStore(object):
+    """
+    压缩Tick存储
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, root):
+        """Constructor"""
+        self.root = root
+
+    #----------------------------------------------------------------------
+    def getSymbolPath(self, symbol):
+        """获取品种数据所在的目录"""
+        return os.path.join(self.root, symbol)
+
+    #----------------------------------------------------------------------
+    def listDays(self, symbol):
+        """列出品种所有的日期分区，按时间排序"""
+        path = self.getSymbolPath(symbol)
+        if not os.path.isdir(path):
+            return []
+        return sorted([name[:8] for name in os.listdir(path) if name.endswith('.npz')])
+
+    #----------------------------------------------------------------------
+    def readInfo(self, symbol):
+        """读取合约信息，包含最小价格变动priceTick"""
+        with open(os.path.join(self.getSymbolPath(symbol), INFO_FILENAME)) as f:
+            return json.load(f)
+
+    #----------------------------------------------------------------------
+    def writeTickArrays(self, symbol, arrays, info):
+        """
+        写入Tick列数据，按自然日分区，同一日期的分区会被覆盖
+        info中必须包含最小价格变动priceTick
+        """
+        symbolPath = self.getSymbolPath(symbol)
+        if not os.path.isdir(symbolPath):
+            os.makedirs(symbolPath)
+
+        with open(os.path.join(symbolPath, INFO_FILENAME), 'w') as f:
+            json.dump(info, f)
+        priceTick = info['priceTick']
+
+        datetimes = np.asarray(arrays[DATETIME_COLUMN], dtype=DATETIME_DTYPE)
+        order = np.argsort(datetimes, kind='mergesort')
+        dayArray = datetimes[order].astype('datetime64[D]')
+
+        for day in np.unique(dayArray):
+            index = order[dayArray == day]
+            part = {name: np.asarray(arrays[name])[index] for name in TICK_FIELDS}
+
+            filename = os.path.join(symbolPath, day.astype(datetime).strftime(DAY_FORMAT) + '.npz')
+            np.savez_compressed(filename, **encodeTickArrays(part, priceTick))
+
+    #----------------------------------------------------------------------
+    def listRangeDays(self, symbol, startDate, endDate=None):
+        """列出[startDate, endDate]区间内的日期分区，endDate为空则到最后一个分区"""
+        startDay = startDate.strftime(DAY_FORMAT)
+        endDay = endDate.strftime(DAY_FORMAT) if endDate else None
+        return [d for d in self.listDays(symbol)
+                if d >= startDay and (endDay is None or d <= endDay)]
+
+    #----------------------------------------------------------------------
+    def iterDayArrays(self, symbol, startDate, endDate=None, fields=None):
+        """
+        逐个日期分区解码[startDate, endDate]区间的Tick列数据，每次只解码一天的数据
+        fields为需要解码的字段，默认为全部字段
+        """
+        priceTick = self.readInfo(symbol)['priceTick']
+        start = np.datetime64(startDate, 'us')
+        end = np.datetime64(endDate, 'us') if endDate else None
+
+        for day in self.listRangeDays(symbol, startDate, endDate):
+            with np.load(os.path.join(self.getSymbolPath(symbol), day + '.npz')) as encoded:
+                arrays = decodeTickArrays(encoded, priceTick, fields)
+
+            # 首尾分区按照精确的时间截取
+            datetimes = arrays[DATETIME_COLUMN]
+            i = datetimes.searchsorted(start)
+            j = datetimes.searchsorted(end, side='right') if end is not None else len(datetimes)
+            if j > i:
+                yield {k: v[i:j] for k, v in arrays.items()}
+
+    #----------------------------------------------------------------------
+    def iterTicks(self, symbol, startDate, endDate=None):
+        """逐日解码并生成[startDate, endDate]区间的ArrayTick，内存中只保留当天的数据"""
+        info = self.readInfo(symbol)
+        for arrays in self.iterDayArrays(symbol, startDate, endDate):
+            for tick in iterArrayTicks(arrays, info):
+                yield tick
+
+    #----------------------------------------------------------------------
+    def loadTickArrays(self, symbol, startDate, endDate=None, fields=None):
+        """
+        一次性载入[startDate, endDate]区间的Tick列数据，endDate为空则载入全部数据
+        fields为需要载入的字段，默认为全部字段，返回(列数据字典, 合约信息字典)
+        """
+        info = self.readInfo(symbol)
+        partList = list(self.iterDayArrays(symbol, startDate, endDate, fields))
+        if not partList:
+            return emptyTickArrays([DATETIME_COLUMN] + list(fields or TICK_FIELDS)), info
+
+        arrays = {}
+        for name in partList[0].keys():
+            arrays[name] = np.concatenate([p[name] for p in partList])
+        return arrays, info
+
+    #----------------------------------------------------------------------
+    def importFromMongo(self, collection, symbol, priceTick, startDate=None, endDate=None):
+        """按自然日分批从MongoDB读取Tick数据写入存储，避免一次性载入整个集合"""
+        if not startDate:
+            first = collection.find_one(sort=[('datetime', 1)])
+            if not first:
+                return 0
+            startDate = first['datetime']
+        if not endDate:
+            last = collection.find_one(sort=[('datetime', -1)])
+            endDate = last['datetime']
+
+        info = collection.find_one({}, {'_id': 0, 'vtSymbol': 1, 'symbol': 1, 'exchange': 1}) or {}
+        info['priceTick'] = priceTick
+
+        projection = dict([('_id', 0)] + [(name, 1) for name in TICK_FIELDS])
+        day = datetime(startDate.year, startDate.month, startDate.day)
+        total = 0
+        while day <= endDate:
+            nextDay = day + timedelta(1)
+            flt = {'datetime': {'$gte': day, '$lt': nextDay}}
+            docs = list(collection.find(flt, projection).sort('datetime'))
+            if docs:
+                self.writeTickArrays(symbol, tickDocsToArrays(docs), info)
+                total += len(docs)
+            day = nextDay
+
+        return total
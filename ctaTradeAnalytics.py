@@ -0,0 +1,167 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了交易结果文件的统计分析。
+
+CTA_Strategy_Output_Ananlysis.ipynb中的calPosPeriod在apply中逐行调用
+datetime.strptime解析开平仓时间，多空、盈亏的统计再逐个切片调用describe()。这里：
+1. 读取TradeWriter写出的交易结果（csv或列式格式），时间列使用pd.to_datetime
+   整列解析，可以一次读取多个文件并合并，增加source列标记来源
+2. 持仓周期（K线数量）由开平仓时间差直接计算
+3. 多空、盈亏的统计表通过一次groupby计算最细分组的数量、和、平方和、最小值、最大值，
+   再由这些结果汇总出多空合计、盈亏合计和总计，不需要对每个切片重复计算
+'''
+
+from __future__ import division
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from vnpy.trader.app.ctaStrategy.ctaTradeWriter import (readColumnarTrades, META_FILENAME,
+                                                        CSV_DATETIME_FORMAT)
+
+
+# 汇总行使用的标签
+ALL_LABEL = 'all'
+
+# 默认统计的列
+SUMMARY_COLUMNS = ['pnl', 'posPeriod']
+
+# 统计表的指标
+SUMMARY_STATS = ['count', 'sum', 'mean', 'std', 'min', 'max']
+
+
+#----------------------------------------------------------------------
+def parseDatetime(values):
+    """整列解析时间，优先使用TradeWriter的格式，不匹配时由pandas推断"""
+    try:
+        return pd.to_datetime(values, format=CSV_DATETIME_FORMAT)
+    except (ValueError, TypeError):
+        return pd.to_datetime(values, infer_datetime_format=True)
+
+
+#----------------------------------------------------------------------
+def loadTradeFile(path):
+    """读取一个交易结果文件，列式格式的path为目录"""
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, META_FILENAME)):
+        return pd.DataFrame(readColumnarTrades(path))
+
+    df = pd.read_csv(path)
+    for name in ['entryDt', 'exitDt']:
+        if name in df:
+            df[name] = parseDatetime(df[name])
+    return df
+
+
+#----------------------------------------------------------------------
+def loadTradeFiles(paths):
+    """
+    读取多个交易结果文件并合并，paths为路径列表或通配符（如'BacktestRA/*.csv'）
+    增加source列，值为文件名（不含扩展名）
+    """
+    if isinstance(paths, basestring):
+        paths = sorted(glob.glob(paths))
+
+    dfList = []
+    for path in paths:
+        df = loadTradeFile(path)
+        df['source'] = os.path.splitext(os.path.basename(os.path.normpath(path)))[0]
+        dfList.append(df)
+
+    if not dfList:
+        return pd.DataFrame()
+    return pd.concat(dfList, ignore_index=True)
+
+
+#----------------------------------------------------------------------
+def addHoldingPeriod(df, barBin=5):
+    """计算持仓周期，单位为barBin分钟的K线数量"""
+    df['posPeriod'] = (df['exitDt'] - df['entryDt']) / np.timedelta64(barBin, 'm')
+    return df
+
+
+#----------------------------------------------------------------------
+def classifyTrades(df):
+    """增加side（long/short）和outcome（win/loss/even）列"""
+    df['side'] = np.where(df['volume'] > 0, 'long', 'short')
+    df['outcome'] = np.where(df['pnl'] > 0, 'win', np.where(df['pnl'] < 0, 'loss', 'even'))
+    return df
+
+
+#----------------------------------------------------------------------
+def combineStats(agg, columns):
+    """由数量、和、平方和计算均值和样本标准差，整理为(列, 指标)的表格"""
+    result = {}
+    for name in columns:
+        count = agg[(name, 'count')].astype(np.int64)
+        total = agg[(name, 'sum')]
+        mean = total / count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            var = (agg[(name, 'sumsq')] - total * mean) / (count - 1)
+        result[(name, 'count')] = count
+        result[(name, 'sum')] = total
+        result[(name, 'mean')] = mean
+        result[(name, 'std')] = np.sqrt(np.maximum(var, 0))
+        result[(name, 'min')] = agg[(name, 'min')]
+        result[(name, 'max')] = agg[(name, 'max')]
+
+    table = pd.DataFrame(result)
+    return table[[(name, stat) for name in columns for stat in SUMMARY_STATS]]
+
+
+#----------------------------------------------------------------------
+def summarizeTrades(df, columns=SUMMARY_COLUMNS, by=None):
+    """
+    多空、盈亏分组的统计表
+    by为额外的分组列（如['source']），索引为by + [side, outcome]，
+    side和outcome的汇总行标记为'all'
+    """
+    by = list(by or [])
+    columns = [name for name in columns if name in df]
+    if 'side' not in df or 'outcome' not in df:
+        df = classifyTrades(df.copy())
+    keys = by + ['side', 'outcome']
+
+    # 一次groupby计算最细分组的结果
+    data = df[keys + columns].copy()
+    aggDict = {}
+    for name in columns:
+        data[name + 'Sq'] = data[name] ** 2
+        aggDict[name] = ['count', 'sum', 'min', 'max']
+        aggDict[name + 'Sq'] = ['sum']
+    grouped = data.groupby(keys).agg(aggDict)
+
+    finest = pd.DataFrame(index=grouped.index)
+    for name in columns:
+        for stat in ['count', 'sum', 'min', 'max']:
+            finest[(name, stat)] = grouped[(name, stat)]
+        finest[(name, 'sumsq')] = grouped[(name + 'Sq', 'sum')]
+
+    # 由最细分组汇总出多空合计、盈亏合计和总计
+    rollupDict = {}
+    for name in columns:
+        rollupDict[(name, 'count')] = 'sum'
+        rollupDict[(name, 'sum')] = 'sum'
+        rollupDict[(name, 'sumsq')] = 'sum'
+        rollupDict[(name, 'min')] = 'min'
+        rollupDict[(name, 'max')] = 'max'
+
+    tableList = [finest]
+    for level in [['side'], ['outcome'], []]:
+        groupKeys = by + level
+        if groupKeys:
+            rollup = finest.groupby(level=groupKeys).agg(rollupDict)
+        else:
+            rollup = finest.agg(rollupDict).to_frame().T
+        rollup = rollup.reset_index(drop=not groupKeys)
+        for key in ['side', 'outcome']:
+            if key not in level:
+                rollup[key] = ALL_LABEL
+        tableList.append(rollup.set_index(keys))
+
+    table = pd.concat(tableList).sort_index()
+    table.columns = pd.MultiIndex.from_tuples(table.columns)
+    return combineStats(table, columns)
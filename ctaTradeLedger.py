@@ -0,0 +1,451 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测用的成交和委托记录。
+
+原先每笔成交都会创建VtTradeData（停止单成交还要再创建VtOrderData），
+生成两次时间字符串，并一直保存在OrderedDict中，限价单字典和停止单字典
+也从不清理，在有数十万笔委托的Tick回测中占用了大量的内存。这里：
+1. 已成交的成交、已结束（全部成交或撤销）的委托追加保存在结构化的NumPy数组中，
+   编号保存为整数，时间保存为datetime64，方向、开平和状态保存为整数代码
+2. 推送给策略的成交和委托使用__slots__的轻量对象，时间字符串在访问时才生成，
+   推送后引擎不再保留引用
+3. 引擎的tradeDict、limitOrderDict和stopOrderDict改为只读的字典视图，
+   读取时才从记录中生成对象，原有遍历这些字典的代码无需修改
+'''
+
+from collections import Mapping
+
+import numpy as np
+
+from vnpy.trader.vtConstant import (DIRECTION_LONG, DIRECTION_SHORT, OFFSET_OPEN, OFFSET_CLOSE,
+                                    EMPTY_UNICODE)
+from vnpy.trader.app.ctaStrategy.ctaBarCache import DATETIME_DTYPE
+
+
+# 方向和开平的整数代码即在列表中的位置，委托类型无法识别时为空
+DIRECTION_LIST = [DIRECTION_LONG, DIRECTION_SHORT, EMPTY_UNICODE]
+OFFSET_LIST = [OFFSET_OPEN, OFFSET_CLOSE, EMPTY_UNICODE]
+
+TRADE_DTYPE = np.dtype([('tradeID', np.int64),
+                        ('orderID', np.int64),
+                        ('direction', np.int8),
+                        ('offset', np.int8),
+                        ('price', np.float64),
+                        ('volume', np.float64),
+                        ('datetime', DATETIME_DTYPE)])
+
+ORDER_DTYPE = np.dtype([('orderID', np.int64),
+                        ('direction', np.int8),
+                        ('offset', np.int8),
+                        ('price', np.float64),
+                        ('totalVolume', np.float64),
+                        ('tradedVolume', np.float64),
+                        ('status', np.int8),
+                        ('datetime', DATETIME_DTYPE),       # 发单时间
+                        ('cancelDt', DATETIME_DTYPE),       # 撤单时间，未撤销为NaT
+                        ('triggerDt', DATETIME_DTYPE)])     # 停止单触发时间，未触发为NaT
+
+# 记录数组的初始容量，写满后容量翻倍
+INITIAL_CAPACITY = 1024
+
+# 每次从记录中转换为Python对象的数量
+REPLAY_CHUNK_SIZE = 10000
+
+
+########################################################################
+class LedgerTrade(object):
+    """
+    轻量成交对象
+    属性和VtTradeData保持一致，tradeTime在访问时才由dt生成
+    """
+    __slots__ = ['vtSymbol', 'tradeID', 'orderID', 'direction', 'offset',
+                 'price', 'volume', 'dt']
+
+    gatewayName = ''
+    rawData = None
+    exchange = ''
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol, tradeID, orderID, direction, offset, price, volume, dt):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.tradeID = tradeID
+        self.orderID = orderID
+        self.direction = direction
+        self.offset = offset
+        self.price = price
+        self.volume = volume
+        self.dt = dt
+
+    #----------------------------------------------------------------------
+    @property
+    def symbol(self):
+        """合约代码"""
+        return self.vtSymbol
+
+    #----------------------------------------------------------------------
+    @property
+    def vtTradeID(self):
+        """成交编号"""
+        return self.tradeID
+
+    #----------------------------------------------------------------------
+    @property
+    def vtOrderID(self):
+        """委托编号"""
+        return self.orderID
+
+    #----------------------------------------------------------------------
+    @property
+    def tradeTime(self):
+        """成交时间字符串"""
+        return str(self.dt)
+
+
+########################################################################
+class LedgerOrder(object):
+    """
+    轻量委托对象
+    属性和VtOrderData保持一致，同时提供StopOrder的stopOrderID和volume，
+    orderTime、cancelTime、triggerTime在访问时才由dt、cancelDt、triggerDt生成
+    """
+    __slots__ = ['vtSymbol', 'orderID', 'direction', 'offset', 'price',
+                 'totalVolume', 'tradedVolume', 'status', 'dt', 'cancelDt', 'triggerDt']
+
+    gatewayName = ''
+    rawData = None
+    exchange = ''
+    strategy = None
+    frontID = 0
+    sessionID = 0
+
+    #----------------------------------------------------------------------
+    def __init__(self, vtSymbol, orderID, direction, offset, price, totalVolume, status, dt,
+                 tradedVolume=0, cancelDt=None, triggerDt=None):
+        """Constructor"""
+        self.vtSymbol = vtSymbol
+        self.orderID = orderID
+        self.direction = direction
+        self.offset = offset
+        self.price = price
+        self.totalVolume = totalVolume
+        self.tradedVolume = tradedVolume
+        self.status = status
+        self.dt = dt
+        self.cancelDt = cancelDt
+        self.triggerDt = triggerDt
+
+    #----------------------------------------------------------------------
+    @property
+    def symbol(self):
+        """合约代码"""
+        return self.vtSymbol
+
+    #----------------------------------------------------------------------
+    @property
+    def vtOrderID(self):
+        """委托编号"""
+        return self.orderID
+
+    #----------------------------------------------------------------------
+    @property
+    def stopOrderID(self):
+        """停止单编号，和委托编号相同"""
+        return self.orderID
+
+    #----------------------------------------------------------------------
+    @property
+    def volume(self):
+        """委托数量，和StopOrder的属性名一致"""
+        return self.totalVolume
+
+    #----------------------------------------------------------------------
+    @property
+    def orderTime(self):
+        """发单时间字符串"""
+        return str(self.dt)
+
+    #----------------------------------------------------------------------
+    @property
+    def cancelTime(self):
+        """撤单时间字符串"""
+        if self.cancelDt is None:
+            return ''
+        return str(self.cancelDt)
+
+    #----------------------------------------------------------------------
+    @property
+    def triggerTime(self):
+        """停止单触发时间字符串"""
+        if self.triggerDt is None:
+            return ''
+        return str(self.triggerDt)
+
+
+########################################################################
+class ArrayLedger(object):
+    """
+    基于结构化数组的追加记录
+    """
+    dtype = None
+
+    #----------------------------------------------------------------------
+    def __init__(self, prefix=''):
+        """Constructor"""
+        self.prefix = prefix        # 字符串编号的前缀，如停止单的STOPORDERPREFIX
+        self.vtSymbol = ''
+        self.clear()
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """记录数量"""
+        return self.count
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空记录"""
+        self.array = np.empty(INITIAL_CAPACITY, dtype=self.dtype)
+        self.count = 0
+        self.ordered = True         # 记录是否按编号递增追加
+        self.sortIndex = None       # 编号不递增时，(按编号排序的位置, 排序后的编号)，读取时才生成
+
+    #----------------------------------------------------------------------
+    def append(self, row):
+        """追加一条记录"""
+        if self.count == len(self.array):
+            array = np.empty(len(self.array) * 2, dtype=self.dtype)
+            array[:self.count] = self.array
+            self.array = array
+
+        # 委托在结束时才记录，编号不一定递增
+        if self.count and row[0] < self.array[self.count-1][self.idName]:
+            self.ordered = False
+        self.sortIndex = None
+
+        self.array[self.count] = row
+        self.count += 1
+
+    #----------------------------------------------------------------------
+    def getData(self):
+        """返回全部记录的结构化数组（视图）"""
+        return self.array[:self.count]
+
+    #----------------------------------------------------------------------
+    def toKey(self, number):
+        """整数编号转化为字符串编号"""
+        return self.prefix + str(number)
+
+    #----------------------------------------------------------------------
+    def toNumber(self, key):
+        """字符串编号转化为整数编号"""
+        return int(key[len(self.prefix):])
+
+    #----------------------------------------------------------------------
+    def getSortIndex(self):
+        """返回(按编号排序的位置, 排序后的编号)，追加记录之前重复使用"""
+        if self.sortIndex is None:
+            ids = self.getData()[self.idName]
+            index = ids.argsort(kind='mergesort')
+            self.sortIndex = (index, ids[index])
+        return self.sortIndex
+
+    #----------------------------------------------------------------------
+    def iterObjects(self):
+        """按编号顺序逐条生成(整数编号, 对象)"""
+        data = self.getData()
+        if not self.ordered:
+            data = data[self.getSortIndex()[0]]
+        for start in range(0, self.count, REPLAY_CHUNK_SIZE):
+            for item in self.makeObjects(data[start:start+REPLAY_CHUNK_SIZE]):
+                yield item
+
+    #----------------------------------------------------------------------
+    def getObject(self, number):
+        """按整数编号生成对象，不存在则返回None，编号按顺序排列后二分查找"""
+        data = self.getData()
+        if self.ordered:
+            index = None
+            ids = data[self.idName]
+        else:
+            index, ids = self.getSortIndex()
+
+        i = ids.searchsorted(number)
+        if i >= len(ids) or ids[i] != number:
+            return None
+        if index is not None:
+            i = index[i]
+        return self.makeObjects(data[i:i+1])[0][1]
+
+
+########################################################################
+class TradeLedger(ArrayLedger):
+    """
+    成交记录
+    """
+    dtype = TRADE_DTYPE
+    idName = 'tradeID'
+
+    #----------------------------------------------------------------------
+    def appendTrade(self, trade):
+        """记录一笔成交"""
+        self.vtSymbol = trade.vtSymbol
+        self.append((int(trade.tradeID),
+                     int(trade.orderID or 0),
+                     DIRECTION_LIST.index(trade.direction),
+                     OFFSET_LIST.index(trade.offset),
+                     trade.price,
+                     trade.volume,
+                     trade.dt))
+
+    #----------------------------------------------------------------------
+    def makeObjects(self, data):
+        """将记录转化为成交对象列表"""
+        datetimes = data['datetime'].astype(object)
+        columns = [data[name].tolist() for name in ('tradeID', 'orderID', 'direction', 'offset',
+                                                     'price', 'volume')]
+
+        objectList = []
+        for i, (tradeID, orderID, direction, offset, price, volume) in enumerate(zip(*columns)):
+            trade = LedgerTrade(self.vtSymbol, str(tradeID), str(orderID) if orderID else '',
+                                DIRECTION_LIST[direction], OFFSET_LIST[offset],
+                                price, volume, datetimes[i])
+            objectList.append((tradeID, trade))
+        return objectList
+
+
+########################################################################
+class OrderLedger(ArrayLedger):
+    """
+    已结束委托的记录
+    """
+    dtype = ORDER_DTYPE
+    idName = 'orderID'
+
+    #----------------------------------------------------------------------
+    def __init__(self, prefix=''):
+        """Constructor"""
+        super(OrderLedger, self).__init__(prefix)
+        self.statusList = []        # 状态的整数代码即在列表中的位置
+
+    #----------------------------------------------------------------------
+    def appendOrder(self, order):
+        """
+        记录一个已结束的委托，order为LedgerOrder或StopOrder
+        datetime列为发单时间，cancelDt列为撤单时间，triggerDt列为停止单触发时间
+        """
+        if order.status not in self.statusList:
+            self.statusList.append(order.status)
+
+        self.vtSymbol = order.vtSymbol
+        self.append((self.toNumber(order.stopOrderID),
+                     DIRECTION_LIST.index(order.direction),
+                     OFFSET_LIST.index(order.offset),
+                     order.price,
+                     order.volume,
+                     getattr(order, 'tradedVolume', 0),
+                     self.statusList.index(order.status),
+                     order.dt,
+                     getattr(order, 'cancelDt', None),
+                     getattr(order, 'triggerDt', None)))
+
+    #----------------------------------------------------------------------
+    def makeObjects(self, data):
+        """将记录转化为委托对象列表"""
+        datetimes = data['datetime'].astype(object)
+        cancelDatetimes = data['cancelDt'].astype(object)
+        triggerDatetimes = data['triggerDt'].astype(object)
+        columns = [data[name].tolist() for name in ('orderID', 'direction', 'offset', 'price',
+                                                     'totalVolume', 'tradedVolume', 'status')]
+
+        objectList = []
+        for i, (orderID, direction, offset, price, totalVolume, tradedVolume, status) in enumerate(zip(*columns)):
+            order = LedgerOrder(self.vtSymbol, self.toKey(orderID),
+                                DIRECTION_LIST[direction], OFFSET_LIST[offset],
+                                price, totalVolume, self.statusList[status], datetimes[i],
+                                tradedVolume, cancelDatetimes[i], triggerDatetimes[i])
+            objectList.append((orderID, order))
+        return objectList
+
+
+########################################################################
+class LedgerDictView(Mapping):
+    """
+    记录的只读字典视图
+    键为字符串编号，按编号顺序排列；workingDict中为尚未结束的委托对象，
+    已结束的委托和成交在读取时才从记录中生成对象
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, ledger, workingDict=None):
+        """Constructor"""
+        self.ledger = ledger
+        self.workingDict = workingDict if workingDict is not None else {}
+
+    #----------------------------------------------------------------------
+    def __len__(self):
+        """委托或成交的数量"""
+        return len(self.ledger) + len(self.workingDict)
+
+    #----------------------------------------------------------------------
+    def __contains__(self, key):
+        """是否包含该编号"""
+        return self.get(key) is not None
+
+    #----------------------------------------------------------------------
+    def __getitem__(self, key):
+        """按字符串编号读取对象"""
+        if key in self.workingDict:
+            return self.workingDict[key]
+
+        try:
+            number = self.ledger.toNumber(key)
+        except (TypeError, ValueError):
+            raise KeyError(key)
+
+        obj = self.ledger.getObject(number)
+        if obj is None:
+            raise KeyError(key)
+        return obj
+
+    #----------------------------------------------------------------------
+    def __iter__(self):
+        """按编号顺序遍历字符串编号"""
+        for key, obj in self.iteritems():
+            yield key
+
+    #----------------------------------------------------------------------
+    def iteritems(self):
+        """按编号顺序遍历(字符串编号, 对象)"""
+        ledger = self.ledger
+        if not self.workingDict:
+            for number, obj in ledger.iterObjects():
+                yield ledger.toKey(number), obj
+            return
+
+        itemList = list(ledger.iterObjects())
+        itemList.extend([(ledger.toNumber(key), obj) for key, obj in self.workingDict.items()])
+        itemList.sort(key=lambda x: x[0])
+        for number, obj in itemList:
+            yield ledger.toKey(number), obj
+
+    #----------------------------------------------------------------------
+    def itervalues(self):
+        """按编号顺序遍历对象"""
+        for key, obj in self.iteritems():
+            yield obj
+
+    #----------------------------------------------------------------------
+    def items(self):
+        """(字符串编号, 对象)列表"""
+        return list(self.iteritems())
+
+    #----------------------------------------------------------------------
+    def values(self):
+        """对象列表"""
+        return list(self.itervalues())
+
+    #----------------------------------------------------------------------
+    def keys(self):
+        """字符串编号列表"""
+        return list(self)
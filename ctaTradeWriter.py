@@ -0,0 +1,284 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了回测过程中逐笔写出交易结果的TradeWriter。
+
+原先的output_csv在回测结束后才把全部交易结果组装成DataFrame写入文件，
+路径也是写死的。这里：
+1. 成交发生时即按先进先出的规则和持仓配对，得到平仓的交易结果，
+   计算方式和calculateBacktestingResult一致
+2. 交易结果先写入固定长度的缓冲区，缓冲区满时追加写入文件并清空，
+   内存占用和回测长度无关，回测尚未结束时也可以读取已经写出的部分
+3. 支持两种格式：
+   csv：文本文件，每行一笔交易
+   col：列式二进制文件，输出目录下每列一个文件，使用ndarray.tofile追加写入，
+        可以用readColumnarTrades或np.fromfile/np.memmap读取
+'''
+
+import csv
+import json
+import os
+from collections import deque, OrderedDict
+
+import numpy as np
+
+from vnpy.trader.vtConstant import DIRECTION_LONG
+
+
+# 交易结果的列和数据类型
+RESULT_DTYPE = np.dtype([('entryPrice', np.float64),
+                         ('exitPrice', np.float64),
+                         ('entryDt', 'datetime64[us]'),
+                         ('exitDt', 'datetime64[us]'),
+                         ('volume', np.float64),
+                         ('turnover', np.float64),
+                         ('commission', np.float64),
+                         ('slippage', np.float64),
+                         ('pnl', np.float64),
+                         ('pnlPct', np.float64)])
+
+RESULT_COLUMNS = list(RESULT_DTYPE.names)
+
+# 输出格式
+FORMAT_CSV = 'csv'
+FORMAT_COLUMNAR = 'col'
+
+# 缓冲区默认长度（交易结果数量）
+DEFAULT_BUFFER_SIZE = 10000
+
+# 列式格式的元数据文件名
+META_FILENAME = 'meta.json'
+
+# CSV中时间的格式
+CSV_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+########################################################################
+class FifoTradeMatcher(object):
+    """
+    逐笔成交的先进先出配对，结果和matchTradesFifo一致
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.pos = 0                # 当前持仓
+        self.openQueue = deque()    # 未平仓的开仓成交，元素为[价格, 时间, 剩余数量]
+
+    #----------------------------------------------------------------------
+    def match(self, isLong, price, volume, dt):
+        """
+        处理一笔成交，返回平仓的配对列表，元素为(开仓价, 开仓时间, 配对数量)，
+        平掉多头时配对数量为正，平掉空头时为负
+        """
+        sign = 1 if isLong else -1
+        closeVolume = min(volume, max(-sign * self.pos, 0))
+        self.pos += sign * volume
+
+        openVolume = volume - closeVolume
+        matched = []
+        queue = self.openQueue
+        while closeVolume > 0:
+            entry = queue[0]
+            v = min(entry[2], closeVolume)
+            matched.append((entry[0], entry[1], -sign * v))
+            entry[2] -= v
+            closeVolume -= v
+            if entry[2] <= 0:
+                queue.popleft()
+
+        if openVolume > 0:
+            queue.append([price, dt, openVolume])
+        return matched
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空持仓"""
+        self.pos = 0
+        self.openQueue.clear()
+
+
+########################################################################
+class TradeWriter(object):
+    """
+    交易结果写出的基类，子类实现openFile、writeChunk和closeFile
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, path, size=1, rate=0, slippage=0, bufferSize=DEFAULT_BUFFER_SIZE):
+        """Constructor"""
+        self.path = path                # 输出路径
+        self.size = size                # 合约大小
+        self.rate = rate                # 手续费率
+        self.slippage = slippage        # 滑点
+
+        self.matcher = FifoTradeMatcher()
+        self.buffer = np.zeros(bufferSize, dtype=RESULT_DTYPE)
+        self.count = 0                  # 缓冲区中的交易结果数量
+        self.resultCount = 0            # 已经写出的交易结果数量
+
+        self.openFile()
+
+    #----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """处理一笔成交，平仓时写入交易结果"""
+        matched = self.matcher.match(trade.direction == DIRECTION_LONG, trade.price,
+                                     trade.volume, trade.dt)
+        for entryPrice, entryDt, volume in matched:
+            self.appendResult(entryPrice, trade.price, entryDt, trade.dt, volume)
+
+    #----------------------------------------------------------------------
+    def appendResult(self, entryPrice, exitPrice, entryDt, exitDt, volume):
+        """计算一笔交易结果并写入缓冲区，和calculateBacktestingResult的计算方式一致"""
+        turnover = (entryPrice + exitPrice) * self.size * abs(volume)
+        commission = turnover * self.rate
+        slippage = self.slippage * 2 * self.size * abs(volume)
+        pnl = (exitPrice - entryPrice) * volume * self.size - commission - slippage
+
+        self.buffer[self.count] = (entryPrice, exitPrice, entryDt, exitDt, volume, turnover,
+                                   commission, slippage, pnl, pnl / entryPrice)
+        self.count += 1
+        if self.count == len(self.buffer):
+            self.flush()
+
+    #----------------------------------------------------------------------
+    def flush(self):
+        """将缓冲区中的交易结果写入文件"""
+        if not self.count:
+            return
+        self.writeChunk(self.buffer[:self.count])
+        self.resultCount += self.count
+        self.count = 0
+
+    #----------------------------------------------------------------------
+    def close(self):
+        """写出剩余的交易结果并关闭文件"""
+        self.flush()
+        self.closeFile()
+
+    #----------------------------------------------------------------------
+    def openFile(self):
+        """打开输出文件"""
+        raise NotImplementedError
+
+    #----------------------------------------------------------------------
+    def writeChunk(self, chunk):
+        """追加写入一段交易结果"""
+        raise NotImplementedError
+
+    #----------------------------------------------------------------------
+    def closeFile(self):
+        """关闭输出文件"""
+        raise NotImplementedError
+
+
+########################################################################
+class CsvTradeWriter(TradeWriter):
+    """
+    写出CSV格式的交易结果
+    """
+
+    #----------------------------------------------------------------------
+    def openFile(self):
+        """打开输出文件，写入表头"""
+        self.file = open(self.path, 'wb')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(RESULT_COLUMNS)
+        self.file.flush()
+
+    #----------------------------------------------------------------------
+    def writeChunk(self, chunk):
+        """追加写入一段交易结果"""
+        columns = []
+        for name in RESULT_COLUMNS:
+            values = chunk[name]
+            if values.dtype.kind == 'M':
+                columns.append([dt.strftime(CSV_DATETIME_FORMAT) for dt in values.astype(object)])
+            else:
+                columns.append(values.tolist())
+
+        self.writer.writerows(zip(*columns))
+        self.file.flush()
+
+    #----------------------------------------------------------------------
+    def closeFile(self):
+        """关闭输出文件"""
+        self.file.close()
+
+
+########################################################################
+class ColumnarTradeWriter(TradeWriter):
+    """
+    写出列式二进制格式的交易结果，path为输出目录
+    """
+
+    #----------------------------------------------------------------------
+    def openFile(self):
+        """创建输出目录，写入元数据，并清空已有的列文件"""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        meta = {'columns': [[name, RESULT_DTYPE[name].str] for name in RESULT_COLUMNS]}
+        with open(os.path.join(self.path, META_FILENAME), 'w') as f:
+            json.dump(meta, f)
+
+        self.fileDict = OrderedDict()
+        for name in RESULT_COLUMNS:
+            self.fileDict[name] = open(columnFilename(self.path, name), 'wb')
+
+    #----------------------------------------------------------------------
+    def writeChunk(self, chunk):
+        """每列分别追加写入"""
+        for name, f in self.fileDict.items():
+            np.ascontiguousarray(chunk[name]).tofile(f)
+            f.flush()
+
+    #----------------------------------------------------------------------
+    def closeFile(self):
+        """关闭全部列文件"""
+        for f in self.fileDict.values():
+            f.close()
+
+
+#----------------------------------------------------------------------
+def columnFilename(path, name):
+    """列式格式中某一列的文件名"""
+    return os.path.join(path, name + '.bin')
+
+
+#----------------------------------------------------------------------
+def createTradeWriter(outputDir, name, fileFormat=FORMAT_CSV, size=1, rate=0, slippage=0,
+                      bufferSize=DEFAULT_BUFFER_SIZE):
+    """
+    创建交易结果的写出对象
+    csv格式写出到outputDir下的name.csv文件，列式格式写出到outputDir下的name目录
+    """
+    if not os.path.isdir(outputDir):
+        os.makedirs(outputDir)
+
+    if fileFormat == FORMAT_CSV:
+        return CsvTradeWriter(os.path.join(outputDir, name + '.csv'), size, rate, slippage,
+                              bufferSize)
+    elif fileFormat == FORMAT_COLUMNAR:
+        return ColumnarTradeWriter(os.path.join(outputDir, name), size, rate, slippage,
+                                   bufferSize)
+    raise ValueError(u'不支持的交易结果格式：%s' % fileFormat)
+
+
+#----------------------------------------------------------------------
+def readColumnarTrades(path):
+    """
+    读取列式格式的交易结果，返回{列名: 数组}
+    回测仍在进行时各列文件的长度可能不同，只返回完整写出的部分
+    """
+    with open(os.path.join(path, META_FILENAME)) as f:
+        meta = json.load(f)
+
+    arrays = OrderedDict()
+    for name, dtype in meta['columns']:
+        arrays[str(name)] = np.fromfile(columnFilename(path, name), dtype=np.dtype(str(dtype)))
+
+    count = min([len(values) for values in arrays.values()])
+    for name in arrays:
+        arrays[name] = arrays[name][:count]
+    return arrays
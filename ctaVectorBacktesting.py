@@ -0,0 +1,791 @@
+# encoding: UTF-8
+
+'''
+本文件中实现了向量化回测需要的工具。
+
+对于KK通道加openRatioModi这类完全可以用数组表达的策略，逐根K线通过
+onBar、onFiveBar和talib驱动的事件回测在参数研究时过于缓慢。向量化回测中：
+1. 策略在整个回测区间的大周期K线上一次性计算入场信号和入场价格
+2. 引擎根据信号和止损规则，用NumPy直接找出每笔委托在1分钟数据上的成交位置，
+   只在委托成交和入场信号之间循环，不再逐根K线循环
+
+交易规则由VectorStrategyTemplate统一定义，和KkRatioStrategy的委托处理方式相同，
+同一个策略既可以在事件回测（以及实盘）中逐根K线运行，也可以在向量化回测中运行：
+1. 空仓时，若有入场信号则以入场价格发出限价单，多头信号优先。入场限价单不撤销，
+   一直挂到成交为止，最后一次发出的入场价格记为该方向的持仓成本
+2. 持仓时，每根大周期K线走完发出一张数量为当前持仓的停止单，下一根K线走完时撤销：
+   出现出场信号或收盘价触及相对持仓成本的固定止损时在收盘价外cutLossOffset处，
+   否则在持仓期内最高价（最低价）回撤trailingPrcnt处
+3. 同一根1分钟K线上先撮合限价单再撮合停止单，因此挂着的入场单可能使持仓增加或反向
+
+checkVectorParity用于在同一份数据上对比事件回测和向量化回测的成交是否一致，
+事件回测既可以使用向量化策略本身，也可以使用原有的策略（如KkRatioStrategy）。
+'''
+from __future__ import division
+
+import time
+from bisect import insort
+
+import numpy as np
+
+from vnpy.trader.vtObject import VtBarData
+from vnpy.trader.vtConstant import OFFSET_OPEN, OFFSET_CLOSE
+from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+from vnpy.trader.app.ctaStrategy.ctaBarArray import checkBarGenerators
+
+
+# 策略信号字典的键
+LONG_ENTRY = 'longEntry'        # 多头入场信号
+SHORT_ENTRY = 'shortEntry'      # 空头入场信号
+LONG_PRICE = 'longPrice'        # 多头入场限价
+SHORT_PRICE = 'shortPrice'      # 空头入场限价
+LONG_EXIT = 'longExit'          # 多头出场信号，可选
+SHORT_EXIT = 'shortExit'        # 空头出场信号，可选
+
+# 大周期K线数组中的字段
+SIGNAL_BAR_COLUMNS = ['open', 'high', 'low', 'close', 'volume', 'openInterest', 'openRatioModi']
+
+# 向后查找成交位置时每次处理的K线数量，逐次翻倍
+SEARCH_CHUNK = 64
+
+
+#----------------------------------------------------------------------
+def rollingWindow(values, n):
+    """返回形状为(len(values)-n+1, n)的滑动窗口视图"""
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    rows = len(values) - n + 1
+    if rows <= 0:
+        return np.empty((0, n))
+
+    stride = values.strides[0]
+    return np.lib.stride_tricks.as_strided(values, shape=(rows, n), strides=(stride, stride))
+
+
+#----------------------------------------------------------------------
+def windowMean(values, period, window):
+    """
+    在每个长度为window的滑动窗口内计算简单移动平均，取窗口的最后一个值，
+    和在长度为window的缓存数组上调用talib.MA(values, period)[-1]的计算方式相同：
+    先顺序累加前period个值，之后每次减去最早的值再加上新的值
+    """
+    windows = rollingWindow(values, window)
+    result = np.full(len(values), np.nan)
+    if not len(windows) or window < period:
+        return result
+
+    total = windows[:, 0].copy()
+    for i in range(1, period):
+        total += windows[:, i]
+    for i in range(period, window):
+        total -= windows[:, i - period]
+        total += windows[:, i]
+
+    result[window-1:] = total / period
+    return result
+
+
+#----------------------------------------------------------------------
+def windowAtr(high, low, close, period, window):
+    """
+    在每个长度为window的滑动窗口内计算ATR（Wilder平滑），取窗口的最后一个值，
+    和在长度为window的缓存数组上调用talib.ATR(high, low, close, period)[-1]的计算方式相同
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+
+    total = len(close)
+    result = np.full(total, np.nan)
+    if total < window or window <= period:
+        return result
+
+    prevClose = close[:-1]
+    tr = np.full(total, np.nan)
+    tr[1:] = np.maximum(high[1:] - low[1:],
+                        np.maximum(np.abs(high[1:] - prevClose), np.abs(low[1:] - prevClose)))
+
+    # 结束位置为t的窗口中，第一个真实波幅的位置为t-window+2
+    base = np.arange(total - window + 1) + 1
+
+    atr = tr[base].copy()
+    for i in range(1, period):
+        atr += tr[base + i]
+    atr /= period
+
+    for i in range(period, window - 1):
+        atr = (atr * (period - 1) + tr[base + i]) / period
+
+    result[window-1:] = atr
+    return result
+
+
+#----------------------------------------------------------------------
+def segmentIndex(starts, ends):
+    """
+    将多个[start, end]区间展开为位置数组
+    返回(位置数组, 每个位置所属的区间序号)
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.maximum(np.asarray(ends, dtype=np.int64) - starts + 1, 0)
+
+    segment = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return starts[segment] + offsets, segment
+
+
+#----------------------------------------------------------------------
+def firstCrossIndex(starts, ends, crossFunc):
+    """
+    在每个[start, end]区间内查找第一个满足条件的位置，没有则为-1
+    crossFunc(位置数组, 区间序号数组)返回是否满足条件的布尔数组
+    """
+    result = np.full(len(starts), -1, dtype=np.int64)
+
+    index, segment = segmentIndex(starts, ends)
+    if not len(index):
+        return result
+
+    hit = np.flatnonzero(crossFunc(index, segment))
+    if len(hit):
+        crossed, first = np.unique(segment[hit], return_index=True)
+        result[crossed] = index[hit[first]]
+    return result
+
+
+#----------------------------------------------------------------------
+def openRatioModiCore(volumes, deltas, starts):
+    """
+    按区间计算openRatioModi，volumes和deltas为各区间首尾相接的1分钟成交量和持仓量变化，
+    starts为每个区间的起始位置
+    """
+    lengths = np.diff(np.append(starts, len(volumes)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrtVolumes = np.sqrt(volumes)
+        weights = sqrtVolumes / np.repeat(np.add.reduceat(sqrtVolumes, starts), lengths)
+        ratios = weights * (deltas / volumes)
+        return np.add.reduceat(ratios, starts) / lengths
+
+
+#----------------------------------------------------------------------
+def barOpenRatioModi(volumeList, openInterestList):
+    """
+    计算一根大周期K线的openRatioModi
+    openInterestList的第一个元素为上一根大周期K线结束时的持仓量
+    """
+    volumes = np.array(volumeList, dtype=np.float64)
+    openInterests = np.array(openInterestList, dtype=np.float64)
+    deltas = openInterests[1:] - openInterests[:-1]
+    return openRatioModiCore(volumes, deltas, np.array([0]))[0]
+
+
+#----------------------------------------------------------------------
+def makeSignalBars(arrays, resampled):
+    """
+    由1分钟列数据和resampleBarArrays的聚合结果生成策略计算信号用的大周期K线数组，
+    包括每根K线的openRatioModi
+    """
+    bars = {'datetime': resampled['datetime']}
+    for name in SIGNAL_BAR_COLUMNS[:-1]:
+        bars[name] = np.asarray(resampled[name], dtype=np.float64)
+
+    starts = resampled['start']
+    if not len(starts):
+        bars['openRatioModi'] = np.array([], dtype=np.float64)
+        return bars
+
+    index, segment = segmentIndex(starts, resampled['end'])
+    volumes = np.asarray(arrays['volume'], dtype=np.float64)[index]
+    openInterests = np.asarray(arrays['openInterest'], dtype=np.float64)
+
+    # 每个区间第一根K线的前一个持仓量为上一根大周期K线结束时的持仓量，第一根为0
+    prevEnd = resampled['prevEnd']
+    firstPrev = np.where(prevEnd >= 0, openInterests[np.maximum(prevEnd, 0)], 0)
+    prevOpenInterests = openInterests[np.maximum(index - 1, 0)]
+    lengths = resampled['end'] - starts + 1
+    segmentStarts = np.cumsum(lengths) - lengths
+    prevOpenInterests[segmentStarts] = firstPrev
+
+    deltas = openInterests[index] - prevOpenInterests
+    bars['openRatioModi'] = openRatioModiCore(volumes, deltas, segmentStarts)
+    return bars
+
+
+#----------------------------------------------------------------------
+def roundToPriceTick(prices, priceTick):
+    """取整价格到合约最小价格变动，和BacktestingEngine.roundToPriceTick的四舍五入方式一致"""
+    prices = np.asarray(prices, dtype=np.float64)
+    if not priceTick:
+        return prices
+
+    ticks = prices / priceTick
+    magnitude = np.abs(ticks)
+    rounded = np.floor(magnitude)
+    rounded += (magnitude - rounded) >= 0.5
+    return np.copysign(rounded, ticks) * priceTick
+
+
+#----------------------------------------------------------------------
+def searchForward(start, end, crossFunc):
+    """
+    在[start, end]内查找第一个满足条件的位置，没有则为-1
+    crossFunc(起始位置, 结束位置)返回该切片上是否满足条件的布尔数组，切片长度逐次翻倍
+    """
+    chunk = SEARCH_CHUNK
+    while start <= end:
+        stop = min(start + chunk, end + 1)
+        hit = np.flatnonzero(crossFunc(start, stop))
+        if len(hit):
+            return start + hit[0]
+
+        start = stop
+        chunk *= 2
+    return -1
+
+
+########################################################################
+class VectorTradeSimulator(object):
+    """
+    根据信号计算成交，委托规则和VectorStrategyTemplate的事件回测一致
+    空仓且没有挂着的入场单时直接跳到下一个入场信号，持仓时用数组一次计算多根K线的止损价，
+    跳到第一个止损触发或入场单成交的K线，只在这些K线上逐根处理
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, arrays, ends, bars, signals, startIndex, fixedSize,
+                 trailingPrcnt, fixedCutLoss, cutLossOffset, priceTick=0):
+        """
+        arrays为1分钟列数据，ends为每根大周期K线最后一根1分钟K线的位置，
+        startIndex为回测开始（策略启动）的1分钟K线位置，之前的K线只用于初始化，不发出委托
+        """
+        self.opens = np.asarray(arrays['open'], dtype=np.float64)
+        self.highs = np.asarray(arrays['high'], dtype=np.float64)
+        self.lows = np.asarray(arrays['low'], dtype=np.float64)
+
+        # 每根大周期K线走完时发出的停止单，在下一根大周期K线走完（撤单）之前有效
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.count = len(self.ends)
+        self.windowStarts = self.ends + 1
+        self.windowEnds = np.append(self.ends[1:], len(self.opens) - 1)
+        self.startBar = self.ends.searchsorted(startIndex)
+
+        self.barHighs = np.asarray(bars['high'], dtype=np.float64)
+        self.barLows = np.asarray(bars['low'], dtype=np.float64)
+        self.barCloses = np.asarray(bars['close'], dtype=np.float64)
+
+        self.longEntry = self.getSignal(signals, LONG_ENTRY)
+        self.shortEntry = self.getSignal(signals, SHORT_ENTRY) & ~self.longEntry
+        self.longExit = self.getSignal(signals, LONG_EXIT)
+        self.shortExit = self.getSignal(signals, SHORT_EXIT)
+        self.longPrice = np.asarray(signals[LONG_PRICE], dtype=np.float64)
+        self.shortPrice = np.asarray(signals[SHORT_PRICE], dtype=np.float64)
+        self.entryBars = np.flatnonzero(self.longEntry | self.shortEntry)
+
+        self.fixedSize = fixedSize
+        self.trailingPrcnt = trailingPrcnt
+        self.fixedCutLoss = fixedCutLoss
+        self.cutLossOffset = cutLossOffset
+        self.priceTick = priceTick
+
+        self.pos = 0                # 持仓
+        self.longCost = 0           # 多头持仓成本
+        self.shortCost = 0          # 空头持仓成本
+        self.intraTradeHigh = 0     # 持仓期内的最高点
+        self.intraTradeLow = 0      # 持仓期内的最低点
+        self.orderCount = 0         # 入场委托编号
+        self.pendingList = []       # 挂着的入场单，元素为(成交位置, 委托编号, 方向, 委托价格)
+        self.tradeList = []         # 成交列表，元素为(1分钟K线位置, 方向(1或-1), 开平, 价格, 数量)
+
+    #----------------------------------------------------------------------
+    def getSignal(self, signals, name):
+        """读取布尔信号数组，没有提供的信号为全False"""
+        if name not in signals:
+            return np.zeros(self.count, dtype=bool)
+        return np.asarray(signals[name], dtype=bool)
+
+    #----------------------------------------------------------------------
+    def run(self):
+        """计算全部成交"""
+        k = self.startBar
+        while k < self.count:
+            if self.pos == 0:
+                k = self.skipFlatBars(k)
+            else:
+                k = self.skipHoldingBars(k)
+
+            if k >= self.count:
+                break
+
+            self.processBar(k)
+            k += 1
+
+        return self.tradeList
+
+    #----------------------------------------------------------------------
+    def nextPendingBar(self):
+        """下一笔入场单成交所在窗口对应的大周期K线位置"""
+        if not self.pendingList:
+            return self.count
+        return self.ends.searchsorted(self.pendingList[0][0]) - 1
+
+    #----------------------------------------------------------------------
+    def skipFlatBars(self, k):
+        """空仓时跳过没有入场信号、也没有入场单成交的K线"""
+        n = self.entryBars.searchsorted(k)
+        if n < len(self.entryBars):
+            nextEntry = self.entryBars[n]
+        else:
+            nextEntry = self.count
+        return min(nextEntry, self.nextPendingBar())
+
+    #----------------------------------------------------------------------
+    def holdingStops(self, k, stop):
+        """持仓不变时第k到stop-1根K线走完发出的停止单价格，以及持仓期内的最高价（最低价）"""
+        closes = self.barCloses[k:stop]
+        if self.pos > 0:
+            extremes = np.maximum.accumulate(np.append(self.intraTradeHigh, self.barHighs[k:stop]))[1:]
+            cutLoss = (closes < (1 - self.fixedCutLoss / 100) * self.longCost) | self.longExit[k:stop]
+            stops = np.where(cutLoss, closes - self.cutLossOffset, extremes * (1 - self.trailingPrcnt / 100))
+        else:
+            extremes = np.minimum.accumulate(np.append(self.intraTradeLow, self.barLows[k:stop]))[1:]
+            cutLoss = (closes >= (1 + self.fixedCutLoss / 100) * self.shortCost) | self.shortExit[k:stop]
+            stops = np.where(cutLoss, closes + self.cutLossOffset, extremes * (1 + self.trailingPrcnt / 100))
+        return roundToPriceTick(stops, self.priceTick), extremes
+
+    #----------------------------------------------------------------------
+    def skipHoldingBars(self, k):
+        """持仓时跳过停止单没有触发、也没有入场单成交的K线"""
+        limit = self.nextPendingBar()
+        highs = self.highs
+        lows = self.lows
+
+        chunk = SEARCH_CHUNK
+        while k < limit:
+            stop = min(k + chunk, limit)
+            stops, extremes = self.holdingStops(k, stop)
+
+            if self.pos > 0:
+                crossFunc = lambda index, segment: lows[index] <= stops[segment]
+            else:
+                crossFunc = lambda index, segment: highs[index] >= stops[segment]
+
+            hit = np.flatnonzero(firstCrossIndex(self.windowStarts[k:stop], self.windowEnds[k:stop], crossFunc) >= 0)
+            if len(hit):
+                stop = k + hit[0]
+                if stop == k:
+                    return k
+                extremes = extremes[:hit[0]]
+
+            # 更新到跳过的最后一根K线走完时的状态
+            if self.pos > 0:
+                self.intraTradeHigh = extremes[-1]
+                self.intraTradeLow = self.barLows[stop-1]
+            else:
+                self.intraTradeHigh = self.barHighs[stop-1]
+                self.intraTradeLow = extremes[-1]
+
+            if len(hit):
+                return stop
+
+            k = stop
+            chunk *= 2
+
+        return k
+
+    #----------------------------------------------------------------------
+    def processBar(self, k):
+        """第k根大周期K线走完时按策略规则发出委托，并撮合到下一根大周期K线走完为止的成交"""
+        stopOrder = None
+        close = self.barCloses[k]
+
+        if self.pos == 0:
+            self.intraTradeHigh = self.barHighs[k]
+            self.intraTradeLow = self.barLows[k]
+            if self.longEntry[k]:
+                self.longCost = self.longPrice[k]
+                self.sendEntryOrder(k, 1, self.longCost)
+            elif self.shortEntry[k]:
+                self.shortCost = self.shortPrice[k]
+                self.sendEntryOrder(k, -1, self.shortCost)
+
+        elif self.pos > 0:
+            self.intraTradeHigh = max(self.intraTradeHigh, self.barHighs[k])
+            self.intraTradeLow = self.barLows[k]
+            if close < (1 - self.fixedCutLoss / 100) * self.longCost or self.longExit[k]:
+                price = close - self.cutLossOffset
+            else:
+                price = self.intraTradeHigh * (1 - self.trailingPrcnt / 100)
+            stopOrder = (-1, float(roundToPriceTick(price, self.priceTick)), abs(self.pos))
+
+        else:
+            self.intraTradeHigh = self.barHighs[k]
+            self.intraTradeLow = min(self.intraTradeLow, self.barLows[k])
+            if close >= (1 + self.fixedCutLoss / 100) * self.shortCost or self.shortExit[k]:
+                price = close + self.cutLossOffset
+            else:
+                price = self.intraTradeLow * (1 + self.trailingPrcnt / 100)
+            stopOrder = (1, float(roundToPriceTick(price, self.priceTick)), abs(self.pos))
+
+        self.crossWindow(k, stopOrder)
+
+    #----------------------------------------------------------------------
+    def sendEntryOrder(self, k, direction, cost):
+        """发出入场限价单，直接查找之后第一根能成交的1分钟K线"""
+        price = float(roundToPriceTick(cost, self.priceTick))
+        if direction > 0:
+            lows = self.lows
+            crossFunc = lambda start, stop: (lows[start:stop] <= price) & (lows[start:stop] > 0)
+        else:
+            highs = self.highs
+            crossFunc = lambda start, stop: (highs[start:stop] >= price) & (highs[start:stop] > 0)
+
+        self.orderCount += 1
+        index = searchForward(self.windowStarts[k], len(self.opens) - 1, crossFunc)
+        if index >= 0:
+            insort(self.pendingList, (index, self.orderCount, direction, price))
+
+    #----------------------------------------------------------------------
+    def crossWindow(self, k, stopOrder):
+        """撮合第k根大周期K线之后窗口内的入场单和停止单，同一根1分钟K线上先撮合入场单"""
+        start = self.windowStarts[k]
+        end = self.windowEnds[k]
+
+        stopIndex = -1
+        if stopOrder:
+            direction, price = stopOrder[:2]
+            if direction > 0:
+                hit = np.flatnonzero(self.highs[start:end+1] >= price)
+            else:
+                hit = np.flatnonzero(self.lows[start:end+1] <= price)
+            if len(hit):
+                stopIndex = start + hit[0]
+
+        pendingList = self.pendingList
+        while pendingList and pendingList[0][0] <= end:
+            index, orderID, direction, price = pendingList.pop(0)
+            if 0 <= stopIndex < index:
+                self.fillStopOrder(stopIndex, stopOrder)
+                stopIndex = -1
+
+            if direction > 0:
+                price = min(price, self.opens[index])
+            else:
+                price = max(price, self.opens[index])
+            self.pos += direction * self.fixedSize
+            self.tradeList.append((index, direction, OFFSET_OPEN, price, self.fixedSize))
+
+        if stopIndex >= 0:
+            self.fillStopOrder(stopIndex, stopOrder)
+
+    #----------------------------------------------------------------------
+    def fillStopOrder(self, index, stopOrder):
+        """停止单在第index根1分钟K线上触发"""
+        direction, price, volume = stopOrder
+        if direction > 0:
+            price = max(price, self.opens[index])
+        else:
+            price = min(price, self.opens[index])
+        self.pos += direction * volume
+        self.tradeList.append((index, direction, OFFSET_CLOSE, price, volume))
+
+
+#----------------------------------------------------------------------
+def simulateVectorTrades(arrays, ends, bars, signals, startIndex, fixedSize,
+                         trailingPrcnt, fixedCutLoss, cutLossOffset, priceTick=0):
+    """
+    根据信号计算成交，参数见VectorTradeSimulator
+    返回成交列表，元素为(1分钟K线位置, 方向(1或-1), 开平, 价格, 数量)
+    """
+    simulator = VectorTradeSimulator(arrays, ends, bars, signals, startIndex, fixedSize,
+                                     trailingPrcnt, fixedCutLoss, cutLossOffset, priceTick)
+    return simulator.run()
+
+
+########################################################################
+class VectorStrategyTemplate(CtaTemplate):
+    """
+    可向量化回测的策略模板
+    子类实现calculateSignals，在大周期K线数组上计算入场、出场信号和入场价格。
+    事件回测中以最近bufferSize根K线的缓存数组调用calculateSignals并取最后一个值，
+    因此信号只能使用bufferSize根K线以内的数据，并且计算结果不能依赖数组的长度
+    """
+    className = 'VectorStrategyTemplate'
+    author = u'toriphy'
+
+    # 策略参数
+    barBin = 5                  # 大周期K线的分钟数
+    barOffset = 1               # 1对应(minute+1) % barBin == 0时K线走完，0对应minute % barBin == 0
+    bufferSize = 18             # 需要缓存的K线数量
+    fixedSize = 1               # 每次交易的数量
+    trailingPrcnt = 1           # 移动止损百分比
+    fixedCutLoss = 2            # 相对持仓成本的固定止损百分比
+    cutLossOffset = 5           # 固定止损停止单相对收盘价的距离
+    initDays = 10               # 初始化数据所用的天数
+    engineAggregation = False   # 是否由回测引擎预先聚合K线并推送到onFiveBar
+
+    # 策略变量
+    bufferCount = 0             # 目前已经缓存了的K线的计数
+    intraTradeHigh = 0          # 持仓期内的最高点
+    intraTradeLow = 0           # 持仓期内的最低点
+    longCost = 0                # 最后一次发出的多头入场价格，用于固定止损
+    shortCost = 0               # 最后一次发出的空头入场价格
+    preBarOpenInterest = 0      # 上一根大周期K线结束时的持仓量
+
+    paramList = ['name',
+                 'className',
+                 'author',
+                 'vtSymbol',
+                 'engineAggregation',
+                 'barBin',
+                 'barOffset',
+                 'fixedSize',
+                 'trailingPrcnt',
+                 'fixedCutLoss',
+                 'cutLossOffset']
+
+    varList = ['inited',
+               'trading',
+               'pos',
+               'intraTradeHigh',
+               'intraTradeLow',
+               'longCost',
+               'shortCost']
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(VectorStrategyTemplate, self).__init__(ctaEngine, setting)
+
+        self.orderList = []         # 保存停止单代码的列表
+        self.minuteBarList = []     # 当前大周期K线内的1分钟K线
+        self.barBuffer = dict([(name, []) for name in SIGNAL_BAR_COLUMNS])
+
+    #----------------------------------------------------------------------
+    def calculateSignals(self, bars):
+        """
+        计算信号（必须由用户继承实现）
+        bars为大周期K线的数组字典，包括open、high、low、close、volume、openInterest、openRatioModi，
+        返回包括LONG_ENTRY、SHORT_ENTRY、LONG_PRICE、SHORT_PRICE的数组字典，
+        可选LONG_EXIT、SHORT_EXIT出场信号
+        """
+        raise NotImplementedError
+
+    #----------------------------------------------------------------------
+    def calculateVectorSignals(self, bars):
+        """在整个回测区间上计算信号，缓存未满的K线上不产生信号"""
+        signals = self.calculateSignals(bars)
+        for name in (LONG_ENTRY, SHORT_ENTRY, LONG_EXIT, SHORT_EXIT):
+            if name in signals:
+                signal = np.array(signals[name], dtype=bool)
+                signal[:self.bufferSize-1] = False
+                signals[name] = signal
+        return signals
+
+    #----------------------------------------------------------------------
+    def onInit(self):
+        """初始化策略"""
+        self.writeCtaLog(u'%s策略初始化' % self.name)
+
+        # 由回测引擎预先聚合K线时，引擎必须设置了对应的大周期K线
+        checkBarGenerators(self, [(self.barBin, 'onFiveBar')])
+
+        initData = self.loadBar(self.initDays)
+        for bar in initData:
+            self.onBar(bar)
+
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onStart(self):
+        """启动策略"""
+        self.writeCtaLog(u'%s策略启动' % self.name)
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onStop(self):
+        """停止策略"""
+        self.writeCtaLog(u'%s策略停止' % self.name)
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onOrder(self, order):
+        """收到委托变化推送"""
+        pass
+
+    #----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """收到成交推送"""
+        self.putEvent()
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """收到Bar推送，聚合为大周期K线，规则和resampleBarArrays一致"""
+        # 回测引擎没有预先聚合大周期K线时，由1分钟K线逐根聚合
+        if not self.engineAggregation:
+            if (bar.datetime.minute + self.barOffset) % self.barBin == 0:
+                # 没有开始K线的周期直接丢弃
+                if self.minuteBarList:
+                    self.minuteBarList.append(bar)
+                    self.onFiveBar(self.makeFiveBar(self.minuteBarList))
+                    self.preBarOpenInterest = bar.openInterest
+                    self.minuteBarList = []
+            else:
+                self.minuteBarList.append(bar)
+
+    #----------------------------------------------------------------------
+    def makeFiveBar(self, barList):
+        """由1分钟K线列表生成大周期K线"""
+        first = barList[0]
+        last = barList[-1]
+
+        fiveBar = VtBarData()
+        fiveBar.vtSymbol = first.vtSymbol
+        fiveBar.symbol = first.symbol
+        fiveBar.exchange = first.exchange
+
+        fiveBar.open = first.open
+        fiveBar.high = max([b.high for b in barList])
+        fiveBar.low = min([b.low for b in barList])
+        fiveBar.close = last.close
+        fiveBar.volume = sum([b.volume for b in barList])
+        fiveBar.openInterest = last.openInterest
+
+        fiveBar.volumeList = [b.volume for b in barList]
+        fiveBar.openInterestList = [self.preBarOpenInterest] + [b.openInterest for b in barList]
+
+        fiveBar.date = first.date
+        fiveBar.time = first.time
+        fiveBar.datetime = first.datetime
+        return fiveBar
+
+    #----------------------------------------------------------------------
+    def onFiveBar(self, bar):
+        """收到大周期K线"""
+        # 撤销上一根K线发出的停止单，入场限价单一直挂到成交为止
+        for orderID in self.orderList:
+            self.cancelOrder(orderID)
+        self.orderList = []
+
+        # 保存K线数据
+        values = [bar.open, bar.high, bar.low, bar.close, bar.volume, bar.openInterest,
+                  barOpenRatioModi(bar.volumeList, bar.openInterestList)]
+        for name, value in zip(SIGNAL_BAR_COLUMNS, values):
+            l = self.barBuffer[name]
+            l.append(value)
+            if len(l) > self.bufferSize:
+                del l[0]
+
+        self.bufferCount += 1
+        if self.bufferCount < self.bufferSize:
+            return
+
+        bars = dict([(name, np.array(l, dtype=np.float64)) for name, l in self.barBuffer.items()])
+        signals = self.calculateSignals(bars)
+
+        # 当前无仓位
+        if self.pos == 0:
+            self.intraTradeHigh = bar.high
+            self.intraTradeLow = bar.low
+
+            if signals[LONG_ENTRY][-1]:
+                self.longCost = signals[LONG_PRICE][-1]
+                self.buy(self.longCost, self.fixedSize)
+            elif signals[SHORT_ENTRY][-1]:
+                self.shortCost = signals[SHORT_PRICE][-1]
+                self.short(self.shortCost, self.fixedSize)
+
+        # 持有多头仓位
+        elif self.pos > 0:
+            self.intraTradeHigh = max(self.intraTradeHigh, bar.high)
+            self.intraTradeLow = bar.low
+            exitSignal = LONG_EXIT in signals and signals[LONG_EXIT][-1]
+            if bar.close < (1 - self.fixedCutLoss / 100) * self.longCost or exitSignal:
+                longStop = bar.close - self.cutLossOffset
+            else:
+                longStop = self.intraTradeHigh * (1 - self.trailingPrcnt / 100)
+            self.orderList.append(self.sell(longStop, abs(self.pos), stop=True))
+
+        # 持有空头仓位
+        else:
+            self.intraTradeHigh = bar.high
+            self.intraTradeLow = min(self.intraTradeLow, bar.low)
+            exitSignal = SHORT_EXIT in signals and signals[SHORT_EXIT][-1]
+            if bar.close >= (1 + self.fixedCutLoss / 100) * self.shortCost or exitSignal:
+                shortStop = bar.close + self.cutLossOffset
+            else:
+                shortStop = self.intraTradeLow * (1 + self.trailingPrcnt / 100)
+            self.orderList.append(self.cover(shortStop, abs(self.pos), stop=True))
+
+        # 发出状态更新事件
+        self.putEvent()
+
+
+#----------------------------------------------------------------------
+def checkVectorParity(createEngine, strategyClass, setting=None, eventStrategyClass=None):
+    """
+    在同一份数据上分别运行事件回测和向量化回测，对比成交是否一致
+    createEngine为返回已设置好数据和合约参数的回测引擎的函数，strategyClass为向量化回测的策略，
+    eventStrategyClass为事件回测的策略，默认和strategyClass相同；传入KkRatioStrategy这类原有策略时，
+    对比的是原有策略的事件回测和strategyClass的向量化回测，两者使用同一个参数设置。
+    返回(是否一致, 事件回测耗时, 向量化回测耗时)
+    """
+    resultList = []
+    timeList = []
+
+    for vector in (False, True):
+        engine = createEngine()
+        if vector:
+            engine.initStrategy(strategyClass, setting)
+        else:
+            engine.initStrategy(eventStrategyClass or strategyClass, setting)
+
+        start = time.time()
+        if vector:
+            engine.runVectorBacktesting()
+        else:
+            engine.runBacktesting()
+        timeList.append(time.time() - start)
+
+        resultList.append([(trade.dt, trade.direction, trade.offset, trade.price, trade.volume)
+                           for trade in engine.tradeDict.values()])
+
+    eventTrades, vectorTrades = resultList
+    consistent = eventTrades == vectorTrades
+
+    eventName = (eventStrategyClass or strategyClass).className
+    engine.output(u'%s事件回测成交数量：%s，耗时：%.3f秒' %(eventName, len(eventTrades), timeList[0]))
+    engine.output(u'%s向量化回测成交数量：%s，耗时：%.3f秒' %(strategyClass.className, len(vectorTrades),
+                                                           timeList[1]))
+
+    if consistent:
+        engine.output(u'两种回测的成交完全一致')
+    else:
+        for n, (eventTrade, vectorTrade) in enumerate(zip(eventTrades, vectorTrades)):
+            if eventTrade != vectorTrade:
+                engine.output(u'第%s笔成交不一致：%s / %s' %(n + 1, eventTrade, vectorTrade))
+                break
+
+    return consistent, timeList[0], timeList[1]
+
+
+if __name__ == '__main__':
+    # 以下内容是一段对比事件回测和向量化回测的演示
+    from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine
+    from strategyFiveminCta import KkRatioStrategy, KkRatioVectorStrategy
+
+    def createEngine():
+        """创建回测引擎"""
+        engine = BacktestingEngine()
+        engine.setBacktestingMode(engine.BAR_MODE)
+        engine.setStartDate('20160601')
+        engine.setEndDate('20170601')
+        engine.setInitialCapital(20000)
+        engine.setSlippage(1)
+        engine.setRate(3 / 10000)
+        engine.setSize(10)
+        engine.setPriceTick(1)
+        engine.setDatabase('FutureData_Index', 'rb000_1min_modi')
+        engine.setBarCache()
+        return engine
+
+    checkVectorParity(createEngine, KkRatioVectorStrategy, eventStrategyClass=KkRatioStrategy)
@@ -18,6 +18,7 @@ import numpy as np
 from vnpy.trader.vtObject import VtBarData
 from vnpy.trader.vtConstant import EMPTY_STRING
 from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+from vnpy.trader.app.ctaStrategy.ctaBarArray import checkBarGenerators
 
 
 
@@ -57,6 +58,7 @@ class AtrOpenRatioStrategy(CtaTemplate):
     initDays = 10  # 初始化数据所用的天数
     fixedSize = 1  # 每次交易的数量
     barBin = 5  # 五分钟线
+    engineAggregation = False   # 是否由回测引擎预先聚合K线并推送到onFiveBar
 
     atrCount = 0  # 目前已经缓存了的ATR的计数
     atrArray = np.zeros(bufferSize)  # ATR指标的数组
@@ -82,6 +84,7 @@ class AtrOpenRatioStrategy(CtaTemplate):
                  'className',
                  'author',
                  'vtSymbol',
+                 'engineAggregation',
                  'atrLength',
                  'atrMaLength',
                  'rsiLength',
@@ -107,6 +110,9 @@ class AtrOpenRatioStrategy(CtaTemplate):
         """初始化策略（必须由用户继承实现）"""
         self.writeCtaLog(u'%s策略初始化' % self.name)
 
+        # 由回测引擎预先聚合K线时，引擎必须设置了对应的大周期K线
+        checkBarGenerators(self, [(self.barBin, 'onFiveBar')])
+
         # 载入历史数据，并采用回放计算的方式初始化策略数值
         self.rsiBuy = 50 + self.rsiEntry
         self.rsiSell = 50 - self.rsiEntry
@@ -167,55 +173,57 @@ class AtrOpenRatioStrategy(CtaTemplate):
     # ----------------------------------------------------------------------
     def onBar(self, bar):
         """收到Bar推送（必须由用户继承实现）"""
-        # 如果当前是一个5分钟走完
-        if bar.datetime.minute % self.barBin == 0:
-            # 如果已经有聚合5分钟K线
-            if self.fiveBar:
-                # 将最新分钟的数据更新到目前5分钟线中
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume+= bar.volume
-                fiveBar.openInterest = bar.openInterest
-
-                #print fiveBar.volume
-
-
-                # 推送5分钟线数据
-                self.onFiveBar(fiveBar)
-
-                # 清空5分钟线数据缓存
-                self.fiveBar = None
-        else:
-            # 如果没有缓存则新建
-            if not self.fiveBar:
-                fiveBar = VtBarData()
-
-                fiveBar.vtSymbol = bar.vtSymbol
-                fiveBar.symbol = bar.symbol
-                fiveBar.exchange = bar.exchange
-
-                fiveBar.open = bar.open
-                fiveBar.high = bar.high
-                fiveBar.low = bar.low
-                fiveBar.close = bar.close
-                fiveBar.volume = bar.volume
-                fiveBar.openInterest = bar.openInterest
-
-
-                fiveBar.date = bar.date
-                fiveBar.time = bar.time
-                fiveBar.datetime = bar.datetime
-
-                self.fiveBar = fiveBar
+        # 回测引擎没有预先聚合5分钟K线时，由1分钟K线逐根聚合
+        if not self.engineAggregation:
+            # 如果当前是一个5分钟走完
+            if bar.datetime.minute % self.barBin == 0:
+                # 如果已经有聚合5分钟K线
+                if self.fiveBar:
+                    # 将最新分钟的数据更新到目前5分钟线中
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume+= bar.volume
+                    fiveBar.openInterest = bar.openInterest
+
+                    #print fiveBar.volume
+
+
+                    # 推送5分钟线数据
+                    self.onFiveBar(fiveBar)
+
+                    # 清空5分钟线数据缓存
+                    self.fiveBar = None
             else:
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume += bar.volume
-                fiveBar.openInterest = bar.openInterest
+                # 如果没有缓存则新建
+                if not self.fiveBar:
+                    fiveBar = VtBarData()
+
+                    fiveBar.vtSymbol = bar.vtSymbol
+                    fiveBar.symbol = bar.symbol
+                    fiveBar.exchange = bar.exchange
+
+                    fiveBar.open = bar.open
+                    fiveBar.high = bar.high
+                    fiveBar.low = bar.low
+                    fiveBar.close = bar.close
+                    fiveBar.volume = bar.volume
+                    fiveBar.openInterest = bar.openInterest
+
+
+                    fiveBar.date = bar.date
+                    fiveBar.time = bar.time
+                    fiveBar.datetime = bar.datetime
+
+                    self.fiveBar = fiveBar
+                else:
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume += bar.volume
+                    fiveBar.openInterest = bar.openInterest
 
 
     # ----------------------------------------------------------------------
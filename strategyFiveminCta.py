@@ -18,6 +18,9 @@ import numpy as np
 from vnpy.trader.vtObject import VtBarData
 from vnpy.trader.vtConstant import EMPTY_STRING
 from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+from vnpy.trader.app.ctaStrategy.ctaBarArray import checkBarGenerators
+from vnpy.trader.app.ctaStrategy.ctaVectorBacktesting import (VectorStrategyTemplate, windowMean, windowAtr,
+                                                              LONG_ENTRY, SHORT_ENTRY, LONG_PRICE, SHORT_PRICE)
 
 
 
@@ -49,6 +52,7 @@ class KkRatioStrategy(CtaTemplate):
     initDays = 10  # 初始化数据所用的天数
     fixedSize = 1  # 每次交易的数量
     barBin = 5  # 五分钟线
+    engineAggregation = False   # 是否由回测引擎预先聚合K线并推送到onFiveBar
 
 
     SVDShort = 5  # 计算SVD指标的短窗口数  # 8,15,20 是一组很好的参数
@@ -113,6 +117,7 @@ class KkRatioStrategy(CtaTemplate):
                  'className',
                  'author',
                  'vtSymbol',
+                 'engineAggregation',
                  'kkLength',
                  'kkDevUp',
                  'kkDevDown',
@@ -145,6 +150,9 @@ class KkRatioStrategy(CtaTemplate):
         """初始化策略（必须由用户继承实现）"""
         self.writeCtaLog(u'%s策略初始化' % self.name)
 
+        # 由回测引擎预先聚合K线时，引擎必须设置了对应的大周期K线
+        checkBarGenerators(self, [(self.barBin, 'onFiveBar')])
+
         # 载入历史数据，并采用回放计算的方式初始化策略数值
         initData = self.loadBar(self.initDays)
         for bar in initData:
@@ -213,75 +221,77 @@ class KkRatioStrategy(CtaTemplate):
     # ----------------------------------------------------------------------
     def onBar(self, bar):
         """收到Bar推送（必须由用户继承实现）"""
-        # 如果当前是一个5分钟走完
-        if (bar.datetime.minute+1) % self.barBin == 0:
-            # 如果已经有聚合5分钟K线
-            if self.fiveBar:
-                # 将最新分钟的数据更新到目前5分钟线中
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume += bar.volume
-                fiveBar.openInterest = bar.openInterest
-
-                fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
-
-                # print fiveBar.volume
-
-                self.preBarOpenInterest = bar.openInterest  # 记录前一个Bar线的持仓数据
-
-                #  推送5分钟线数据
-                self.onFiveBar(fiveBar)
-
-                # 清空5分钟线数据缓存
-                #print preBarOpenInterest
-                self.fiveBar = None
-        else:
-            # 如果没有缓存则新建
-            if not self.fiveBar:
-                fiveBar = VtBarData()
-                fiveBar.volumeList = []   # 创建成交量List
-                try:
-                    #print 'read last openInterest data'
-                    fiveBar.openInterestList = [self.preBarOpenInterest]    # 创建持仓量List
-                except:
-                    fiveBar.openInterestList = []  # 创建持仓量List
+        # 回测引擎没有预先聚合5分钟K线时，由1分钟K线逐根聚合
+        if not self.engineAggregation:
+            # 如果当前是一个5分钟走完
+            if (bar.datetime.minute+1) % self.barBin == 0:
+                # 如果已经有聚合5分钟K线
+                if self.fiveBar:
+                    # 将最新分钟的数据更新到目前5分钟线中
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume += bar.volume
+                    fiveBar.openInterest = bar.openInterest
+
+                    fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
+
+                    # print fiveBar.volume
+
+                    self.preBarOpenInterest = bar.openInterest  # 记录前一个Bar线的持仓数据
+
+                    #  推送5分钟线数据
+                    self.onFiveBar(fiveBar)
+
+                    # 清空5分钟线数据缓存
+                    #print preBarOpenInterest
+                    self.fiveBar = None
+            else:
+                # 如果没有缓存则新建
+                if not self.fiveBar:
+                    fiveBar = VtBarData()
+                    fiveBar.volumeList = []   # 创建成交量List
+                    try:
+                        #print 'read last openInterest data'
+                        fiveBar.openInterestList = [self.preBarOpenInterest]    # 创建持仓量List
+                    except:
+                        fiveBar.openInterestList = []  # 创建持仓量List
 
-                fiveBar.vtSymbol = bar.vtSymbol
-                fiveBar.symbol = bar.symbol
-                fiveBar.exchange = bar.exchange
+                    fiveBar.vtSymbol = bar.vtSymbol
+                    fiveBar.symbol = bar.symbol
+                    fiveBar.exchange = bar.exchange
 
-                fiveBar.open = bar.open
-                fiveBar.high = bar.high
-                fiveBar.low = bar.low
-                fiveBar.close = bar.close
-                fiveBar.volume = bar.volume
-                fiveBar.openInterest = bar.openInterest
+                    fiveBar.open = bar.open
+                    fiveBar.high = bar.high
+                    fiveBar.low = bar.low
+                    fiveBar.close = bar.close
+                    fiveBar.volume = bar.volume
+                    fiveBar.openInterest = bar.openInterest
 
-                fiveBar.volumeList.append(bar.volume)   # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
+                    fiveBar.volumeList.append(bar.volume)   # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
 
 
 
-                fiveBar.date = bar.date
-                fiveBar.time = bar.time
-                fiveBar.datetime = bar.datetime
+                    fiveBar.date = bar.date
+                    fiveBar.time = bar.time
+                    fiveBar.datetime = bar.datetime
 
 
 
-                self.fiveBar = fiveBar
-            else:
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume += bar.volume
-                fiveBar.openInterest = bar.openInterest
+                    self.fiveBar = fiveBar
+                else:
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume += bar.volume
+                    fiveBar.openInterest = bar.openInterest
 
-                fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
+                    fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
 
 
     # ----------------------------------------------------------------------
@@ -485,6 +495,52 @@ class KkRatioStrategy(CtaTemplate):
         self.orderList.append(self.shortOrderID)
 
 
+########################################################################
+class KkRatioVectorStrategy(VectorStrategyTemplate):
+    """
+    可向量化回测的King Keltner通道策略
+    信号、委托和止损规则和KkRatioStrategy相同，默认参数下两者的成交一致，
+    可以通过BacktestingEngine.runVectorBacktesting快速回测，
+    并用checkVectorParity和KkRatioStrategy的事件回测对比
+    """
+    className = 'KkRatioVectorStrategy'
+    author = u'toriphy'
+
+    # 策略参数
+    kkLength = 15           # 计算通道中值的窗口数
+    kkDevUp = 2.1           # 计算通道宽度的偏差
+    kkDevDown = 1.9
+    openRatioBuy = 0.023    # 多头入场的openRatioModi阈值
+    openRatioSell = 0.026   # 空头入场的openRatioModi阈值
+    entryOffset = 5         # 入场限价相对收盘价的距离
+
+    paramList = VectorStrategyTemplate.paramList + ['kkLength',
+                                                    'kkDevUp',
+                                                    'kkDevDown',
+                                                    'openRatioBuy',
+                                                    'openRatioSell',
+                                                    'entryOffset']
+
+    #----------------------------------------------------------------------
+    def calculateSignals(self, bars):
+        """计算KK通道突破信号"""
+        close = bars['close']
+        kkMid = windowMean(close, self.kkLength, self.bufferSize)
+        atr = windowAtr(bars['high'], bars['low'], close, self.kkLength, self.bufferSize)
+        kkUp = kkMid + atr * self.kkDevUp
+        kkDown = kkMid - atr * self.kkDevDown
+
+        openRatioModi = bars['openRatioModi']
+        with np.errstate(invalid='ignore'):
+            longEntry = (close > kkUp) & (openRatioModi > self.openRatioBuy)
+            shortEntry = (close < kkDown) & (openRatioModi > self.openRatioSell)
+
+        return {LONG_ENTRY: longEntry,
+                SHORT_ENTRY: shortEntry,
+                LONG_PRICE: close + self.entryOffset,
+                SHORT_PRICE: close - self.entryOffset}
+
+
 if __name__ == '__main__':
     # 提供直接双击回测的功能
     # 导入PyQt4的包是为了保证matplotlib使用PyQt4而不是PySide，防止初始化出错
@@ -20,6 +20,8 @@ from vnpy.trader.vtConstant import EMPTY_STRING,STATUS_NOTTRADED,STATUS_PARTTRAD
     STATUS_ALLTRADED,STATUS_CANCELLED,STATUS_REJECTED
 
 from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+from vnpy.trader.app.ctaStrategy.ctaLogger import writeStrategyLog, LOG_DEBUG
+from vnpy.trader.app.ctaStrategy.ctaBarArray import checkBarGenerators
 
 
 
@@ -50,6 +52,7 @@ class MultiCycleStrategy(CtaTemplate):
     initDays = 10  # 初始化数据所用的天数,注意这个值是天数而不是bar的个数
     fixedSize = 1  # 每次交易的数量
     barBin = 5  # 五分钟线 短周期
+    engineAggregation = False   # 是否由回测引擎预先聚合K线并推送到onFiveBar
     barLongBin = 15  # 十五分钟线，长周期
 
 
@@ -132,6 +135,7 @@ class MultiCycleStrategy(CtaTemplate):
                  'className',
                  'author',
                  'vtSymbol',
+                 'engineAggregation',
                  'kkLength',
                  'kkDevUp',
                  'kkDevDown',
@@ -162,6 +166,9 @@ class MultiCycleStrategy(CtaTemplate):
         """初始化策略（必须由用户继承实现）"""
         self.writeCtaLog(u'%s策略初始化' % self.name)
 
+        # 由回测引擎预先聚合K线时，引擎必须设置了对应的大周期K线
+        checkBarGenerators(self, [(self.barBin, 'onFiveBar'), (self.barLongBin, 'onLongCycle')])
+
         # 载入历史数据，并采用回放计算的方式初始化策略数值
         initData = self.loadBar(self.initDays)
         for bar in initData:
@@ -229,76 +236,78 @@ class MultiCycleStrategy(CtaTemplate):
     # ----------------------------------------------------------------------
     def onBar(self, bar):
         """收到Bar推送（必须由用户继承实现）"""
-        # 如果当前是一个5分钟走完
-        if (bar.datetime.minute+1) % self.barBin == 0:
-
-            # 如果已经有聚合5分钟K线
-            if self.fiveBar:
-                # 将最新分钟的数据更新到目前5分钟线中
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume += bar.volume
-                fiveBar.openInterest = bar.openInterest
-
-                fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
-
-                # print fiveBar.volume
-
-                self.preBarOpenInterest = bar.openInterest  # 记录前一个Bar线的持仓数据
-
-                #  推送5分钟线数据
-                self.onFiveBar(fiveBar)
+        # 回测引擎没有预先聚合5分钟K线时，由1分钟K线逐根聚合
+        if not self.engineAggregation:
+            # 如果当前是一个5分钟走完
+            if (bar.datetime.minute+1) % self.barBin == 0:
+
+                # 如果已经有聚合5分钟K线
+                if self.fiveBar:
+                    # 将最新分钟的数据更新到目前5分钟线中
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume += bar.volume
+                    fiveBar.openInterest = bar.openInterest
+
+                    fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
+
+                    # print fiveBar.volume
+
+                    self.preBarOpenInterest = bar.openInterest  # 记录前一个Bar线的持仓数据
+
+                    #  推送5分钟线数据
+                    self.onFiveBar(fiveBar)
+
+                    # 清空5分钟线数据缓存
+                    #print preBarOpenInterest
+                    self.fiveBar = None
+            else:
+                # 如果没有缓存则新建
+                if not self.fiveBar:
+                    fiveBar = VtBarData()
+                    fiveBar.volumeList = []   # 创建成交量List
+                    try:
+                        #print 'read last openInterest data'
+                        fiveBar.openInterestList = [self.preBarOpenInterest]    # 创建持仓量List
+                    except:
+                        fiveBar.openInterestList = []  # 创建持仓量List
 
-                # 清空5分钟线数据缓存
-                #print preBarOpenInterest
-                self.fiveBar = None
-        else:
-            # 如果没有缓存则新建
-            if not self.fiveBar:
-                fiveBar = VtBarData()
-                fiveBar.volumeList = []   # 创建成交量List
-                try:
-                    #print 'read last openInterest data'
-                    fiveBar.openInterestList = [self.preBarOpenInterest]    # 创建持仓量List
-                except:
-                    fiveBar.openInterestList = []  # 创建持仓量List
+                    fiveBar.vtSymbol = bar.vtSymbol
+                    fiveBar.symbol = bar.symbol
+                    fiveBar.exchange = bar.exchange
 
-                fiveBar.vtSymbol = bar.vtSymbol
-                fiveBar.symbol = bar.symbol
-                fiveBar.exchange = bar.exchange
+                    fiveBar.open = bar.open
+                    fiveBar.high = bar.high
+                    fiveBar.low = bar.low
+                    fiveBar.close = bar.close
+                    fiveBar.volume = bar.volume
+                    fiveBar.openInterest = bar.openInterest
 
-                fiveBar.open = bar.open
-                fiveBar.high = bar.high
-                fiveBar.low = bar.low
-                fiveBar.close = bar.close
-                fiveBar.volume = bar.volume
-                fiveBar.openInterest = bar.openInterest
+                    fiveBar.volumeList.append(bar.volume)   # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
 
-                fiveBar.volumeList.append(bar.volume)   # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
 
 
+                    fiveBar.date = bar.date
+                    fiveBar.time = bar.time
+                    fiveBar.datetime = bar.datetime
 
-                fiveBar.date = bar.date
-                fiveBar.time = bar.time
-                fiveBar.datetime = bar.datetime
 
 
+                    self.fiveBar = fiveBar
+                else:
+                    fiveBar = self.fiveBar
+                    fiveBar.high = max(fiveBar.high, bar.high)
+                    fiveBar.low = min(fiveBar.low, bar.low)
+                    fiveBar.close = bar.close
+                    fiveBar.volume += bar.volume
+                    fiveBar.openInterest = bar.openInterest
 
-                self.fiveBar = fiveBar
-            else:
-                fiveBar = self.fiveBar
-                fiveBar.high = max(fiveBar.high, bar.high)
-                fiveBar.low = min(fiveBar.low, bar.low)
-                fiveBar.close = bar.close
-                fiveBar.volume += bar.volume
-                fiveBar.openInterest = bar.openInterest
-
-                fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
-                fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
+                    fiveBar.volumeList.append(bar.volume)  # 记录每个bar的成交量（此处为1分钟）
+                    fiveBar.openInterestList.append(bar.openInterest)  # 记录每个bar的持仓数据
 
 
     # ----------------------------------------------------------------------
@@ -309,51 +318,53 @@ class MultiCycleStrategy(CtaTemplate):
             self.cancelOrder(orderID)
         #print bar.openInterestList
         #print bar.datetime.minute
-        # 如果当前是一个15分钟走完
-        if (bar.datetime.minute + 1 * self.barBin) % self.barLongBin == 0:
-            # 如果已经有聚合5分钟K线
-            if self.longCycleBar:
-                # 将最新分钟的数据更新到目前5分钟线中
-                longCycleBar = self.longCycleBar
-                longCycleBar.high = max(longCycleBar.high, bar.high)
-                longCycleBar.low = min(longCycleBar.low, bar.low)
-                longCycleBar.close = bar.close
-                longCycleBar.volume += bar.volume
-                longCycleBar.openInterest = bar.openInterest
-
-                #  推送5分钟线数据
-                self.onLongCycle(longCycleBar)
-
-                # 清空5分钟线数据缓存
-                # print preBarOpenInterest
-                self.longCycleBar = None
-        else:
-            # 如果没有缓存则新建
-            if not self.longCycleBar:
-                longCycleBar = VtBarData()
-                longCycleBar.vtSymbol = bar.vtSymbol
-                longCycleBar.symbol = bar.symbol
-                longCycleBar.exchange = bar.exchange
-
-                longCycleBar.open = bar.open
-                longCycleBar.high = bar.high
-                longCycleBar.low = bar.low
-                longCycleBar.close = bar.close
-                longCycleBar.volume = bar.volume
-                longCycleBar.openInterest = bar.openInterest
-
-                longCycleBar.date = bar.date
-                longCycleBar.time = bar.time
-                longCycleBar.datetime = bar.datetime
-
-                self.longCycleBar = longCycleBar
+        # 回测引擎没有预先聚合15分钟K线时（预先聚合时由引擎推送到onLongCycle），逐根聚合
+        if not self.engineAggregation:
+            # 如果当前是一个15分钟走完
+            if (bar.datetime.minute + 1 * self.barBin) % self.barLongBin == 0:
+                # 如果已经有聚合5分钟K线
+                if self.longCycleBar:
+                    # 将最新分钟的数据更新到目前5分钟线中
+                    longCycleBar = self.longCycleBar
+                    longCycleBar.high = max(longCycleBar.high, bar.high)
+                    longCycleBar.low = min(longCycleBar.low, bar.low)
+                    longCycleBar.close = bar.close
+                    longCycleBar.volume += bar.volume
+                    longCycleBar.openInterest = bar.openInterest
+
+                    #  推送5分钟线数据
+                    self.onLongCycle(longCycleBar)
+
+                    # 清空5分钟线数据缓存
+                    # print preBarOpenInterest
+                    self.longCycleBar = None
             else:
-                longCycleBar = self.longCycleBar
-                longCycleBar.high = max(longCycleBar.high, bar.high)
-                longCycleBar.low = min(longCycleBar.low, bar.low)
-                longCycleBar.close = bar.close
-                longCycleBar.volume += bar.volume
-                longCycleBar.openInterest = bar.openInterest
+                # 如果没有缓存则新建
+                if not self.longCycleBar:
+                    longCycleBar = VtBarData()
+                    longCycleBar.vtSymbol = bar.vtSymbol
+                    longCycleBar.symbol = bar.symbol
+                    longCycleBar.exchange = bar.exchange
+
+                    longCycleBar.open = bar.open
+                    longCycleBar.high = bar.high
+                    longCycleBar.low = bar.low
+                    longCycleBar.close = bar.close
+                    longCycleBar.volume = bar.volume
+                    longCycleBar.openInterest = bar.openInterest
+
+                    longCycleBar.date = bar.date
+                    longCycleBar.time = bar.time
+                    longCycleBar.datetime = bar.datetime
+
+                    self.longCycleBar = longCycleBar
+                else:
+                    longCycleBar = self.longCycleBar
+                    longCycleBar.high = max(longCycleBar.high, bar.high)
+                    longCycleBar.low = min(longCycleBar.low, bar.low)
+                    longCycleBar.close = bar.close
+                    longCycleBar.volume += bar.volume
+                    longCycleBar.openInterest = bar.openInterest
 
         vArray1min = np.array(bar.volumeList)
 
@@ -365,7 +376,7 @@ class MultiCycleStrategy(CtaTemplate):
         #print 'Volume Array:', vArray1min, '\n', 'OpenInterestArray:', oArray1min,'\n','OpenRatioMOdi:',barOpenRatioModi
 
 
-        print 'Long cycle:',self.longCycleTradingFlag
+        writeStrategyLog(self, 'Long cycle: %s', self.longCycleTradingFlag, level=LOG_DEBUG)
         self.orderList = []
 
         # 保存K线数据
@@ -494,7 +505,7 @@ class MultiCycleStrategy(CtaTemplate):
             orderID = self.sell(self.longStop,
                             abs(self.pos), stop=True)
             self.buycutProfitList.append(orderID)
-            self.writeCtaLog(u'多头止损价格：' + str(self.longStop))
+            writeStrategyLog(self, u'多头止损价格：%s', self.longStop, level=LOG_DEBUG)
             self.orderList.append(orderID)
 
         # 持有空头仓位
@@ -506,7 +517,7 @@ class MultiCycleStrategy(CtaTemplate):
             orderID = self.cover(self.shortStop,
                                  abs(self.pos), stop=True)
             self.sellcutProfitList.append(orderID)
-            self.writeCtaLog(u'空头头止损价格：' + str(self.shortStop))
+            writeStrategyLog(self, u'空头头止损价格：%s', self.shortStop, level=LOG_DEBUG)
             self.orderList.append(orderID)
 
         # 发出状态更新事件
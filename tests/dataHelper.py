@@ -0,0 +1,321 @@
+# encoding: UTF-8
+
+"""
+测试用的数据工具：合成的K线文档和Tick数据、本地文件数据源、简单的测试策略，
+以及只实现了回测代码用到的查询的内存集合
+"""
+
+import copy
+import random
+from datetime import timedelta
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaTemplate import CtaTemplate
+from vnpy.trader.app.ctaStrategy.ctaBarCache import barDocsToArrays
+from vnpy.trader.app.ctaStrategy.ctaFileDataSource import FileDataSource
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine
+
+
+PRICE_TICK = 0.5    # 合成Tick数据的最小价格变动
+
+
+#----------------------------------------------------------------------
+def makeBarDocs(start, n, symbol='rb888_1min_modi', seed=1):
+    """生成n根连续的1分钟K线文档，价格为随机游走"""
+    rng = random.Random(seed)
+    docs = []
+    price = 3000.0
+    openInterest = 100000.0
+    for i in range(n):
+        dt = start + timedelta(minutes=i)
+        high = price + rng.randint(0, 5)
+        low = price - rng.randint(0, 5)
+        close = float(rng.randint(int(low), int(high)))
+        openInterest += rng.randint(-50, 50)
+        docs.append({'_id': i,
+                     'vtSymbol': symbol,
+                     'symbol': symbol,
+                     'exchange': '',
+                     'open': price,
+                     'high': high,
+                     'low': low,
+                     'close': close,
+                     'volume': float(rng.randint(100, 1000)),
+                     'openInterest': openInterest,
+                     'datetime': dt,
+                     'date': dt.strftime('%Y%m%d'),
+                     'time': dt.strftime('%H:%M:%S')})
+        price = close
+    return docs
+
+
+#----------------------------------------------------------------------
+def makeTickArrays(start, n, seed=3):
+    """生成n个Tick的列数据，间隔为0.5秒到3秒，价格是最小价格变动的整数倍"""
+    rng = np.random.RandomState(seed)
+    steps = rng.randint(1, 7, n) * 500000
+    datetimes = np.datetime64(start, 'us') + np.cumsum(steps).astype('timedelta64[us]')
+
+    lastPrice = 3000 + np.cumsum(rng.randint(-2, 3, n)) * PRICE_TICK
+    arrays = {'datetime': datetimes,
+              'lastPrice': lastPrice,
+              'bidPrice1': lastPrice - PRICE_TICK,
+              'askPrice1': lastPrice + PRICE_TICK,
+              'upperLimit': np.full(n, 3300.0),
+              'lowerLimit': np.full(n, 2700.0),
+              'volume': np.cumsum(rng.randint(0, 20, n)).astype(np.float64),
+              'openInterest': 100000 + np.cumsum(rng.randint(-5, 6, n)).astype(np.float64),
+              'bidVolume1': rng.randint(1, 50, n).astype(np.float64),
+              'askVolume1': rng.randint(1, 50, n).astype(np.float64)}
+    return arrays
+
+
+#----------------------------------------------------------------------
+def writeDataSource(root, symbol, docs):
+    """将K线文档写入本地文件数据源"""
+    info = {'vtSymbol': symbol, 'symbol': symbol, 'exchange': ''}
+    FileDataSource(root).writeBarArrays(symbol, barDocsToArrays(docs), info)
+
+
+#----------------------------------------------------------------------
+def makeEngine(root, symbol, startDate='20170103', endDate='20170106',
+               engineClass=BacktestingEngine):
+    """使用本地文件数据源的K线回测引擎，root为空时使用数据库"""
+    engine = engineClass()
+    engine.setBacktestingMode(engine.BAR_MODE)
+    engine.setStartDate(startDate, 1)
+    engine.setEndDate(endDate)
+    engine.setInitialCapital(100000)
+    engine.setSlippage(1)
+    engine.setRate(0.0003)
+    engine.setSize(10)
+    engine.setPriceTick(1)
+    if root:
+        engine.setDataSource(root, symbol)
+    else:
+        engine.setDatabase('db', symbol)
+    return engine
+
+
+########################################################################
+class ChannelStrategy(CtaTemplate):
+    """
+    测试用的通道突破策略，同时使用限价单和停止单
+    holdBars为0时入场后一直持有，不再平仓
+    """
+    className = 'ChannelStrategy'
+    author = 'test'
+
+    window = 20         # 通道的K线数量
+    holdBars = 15       # 持仓的K线数量
+    stopOffset = 8      # 止损停止单的距离
+
+    paramList = ['name', 'className', 'author', 'vtSymbol', 'window', 'holdBars', 'stopOffset']
+    varList = ['inited', 'trading', 'pos']
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(ChannelStrategy, self).__init__(ctaEngine, setting)
+        self.closeList = []
+        self.orderList = []
+        self.barCount = 0
+        self.entryBar = 0
+
+    #----------------------------------------------------------------------
+    def onInit(self):
+        """初始化"""
+        for bar in self.loadBar(1):
+            self.onBar(bar)
+
+    #----------------------------------------------------------------------
+    def onStart(self):
+        """启动"""
+        pass
+
+    #----------------------------------------------------------------------
+    def onStop(self):
+        """停止"""
+        pass
+
+    #----------------------------------------------------------------------
+    def onTick(self, tick):
+        """Tick推送"""
+        pass
+
+    #----------------------------------------------------------------------
+    def onOrder(self, order):
+        """委托推送"""
+        pass
+
+    #----------------------------------------------------------------------
+    def onTrade(self, trade):
+        """成交推送"""
+        self.entryBar = self.barCount
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        self.barCount += 1
+        self.closeList.append(bar.close)
+        if not self.trading or len(self.closeList) < self.window:
+            return
+
+        for orderID in self.orderList:
+            self.cancelOrder(orderID)
+        self.orderList = []
+
+        channel = self.closeList[-self.window:]
+        if self.pos == 0:
+            if bar.close >= max(channel):
+                self.orderList.append(self.buy(bar.close + 1, 1))
+            elif bar.close <= min(channel):
+                self.orderList.append(self.short(bar.close - 1, 1))
+        elif self.holdBars and self.barCount - self.entryBar >= self.holdBars:
+            if self.pos > 0:
+                self.orderList.append(self.sell(bar.close - 1, abs(self.pos)))
+            else:
+                self.orderList.append(self.cover(bar.close + 1, abs(self.pos)))
+        elif self.holdBars:
+            if self.pos > 0:
+                self.orderList.append(self.sell(bar.close - self.stopOffset, abs(self.pos), True))
+            else:
+                self.orderList.append(self.cover(bar.close + self.stopOffset, abs(self.pos), True))
+
+
+#----------------------------------------------------------------------
+def matchDoc(d, flt):
+    """判断文档是否满足查询条件，只支持相等和比较运算"""
+    for key, cond in flt.items():
+        value = d.get(key)
+        if isinstance(cond, dict):
+            for op, x in cond.items():
+                if op == '$gte' and not value >= x:
+                    return False
+                if op == '$gt' and not value > x:
+                    return False
+                if op == '$lte' and not value <= x:
+                    return False
+                if op == '$lt' and not value < x:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+#----------------------------------------------------------------------
+def projectDoc(d, projection):
+    """按投影返回文档的副本"""
+    if not projection:
+        return copy.copy(d)
+    include = [k for k, v in projection.items() if v]
+    if include:
+        keys = include + ([] if projection.get('_id', 1) == 0 else ['_id'])
+        return dict((k, d[k]) for k in keys if k in d)
+    return dict((k, v) for k, v in d.items() if projection.get(k, 1))
+
+
+########################################################################
+class MemoryCursor(object):
+    """内存查询结果"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, docs, projection=None):
+        """Constructor"""
+        self.docs = docs
+        self.projection = projection
+
+    #----------------------------------------------------------------------
+    def sort(self, key, direction=1):
+        """排序"""
+        if isinstance(key, list):
+            key, direction = key[0]
+        self.docs = sorted(self.docs, key=lambda d: d[key], reverse=(direction == -1))
+        return self
+
+    #----------------------------------------------------------------------
+    def limit(self, n):
+        """限制数量"""
+        if n:
+            self.docs = self.docs[:n]
+        return self
+
+    #----------------------------------------------------------------------
+    def batch_size(self, n):
+        """批大小，内存查询中没有作用"""
+        return self
+
+    #----------------------------------------------------------------------
+    def count(self):
+        """数量"""
+        return len(self.docs)
+
+    #----------------------------------------------------------------------
+    def __iter__(self):
+        """遍历"""
+        for d in self.docs:
+            yield projectDoc(d, self.projection)
+
+
+########################################################################
+class MemoryCollection(object):
+    """
+    内存集合，支持find、find_one、count和只有$match、$group阶段的aggregate
+    """
+
+    #----------------------------------------------------------------------
+    def __init__(self, docs):
+        """Constructor"""
+        self.docs = docs
+        self.findCount = 0      # find调用的次数
+        self.projectionList = []    # 每次find使用的投影
+
+    #----------------------------------------------------------------------
+    def find(self, flt=None, projection=None, **kwargs):
+        """查询"""
+        self.findCount += 1
+        self.projectionList.append(projection)
+        cursor = MemoryCursor([d for d in self.docs if matchDoc(d, flt or {})], projection)
+        if 'sort' in kwargs:
+            cursor.sort(kwargs['sort'])
+        return cursor
+
+    #----------------------------------------------------------------------
+    def find_one(self, flt=None, projection=None, sort=None):
+        """查询一条"""
+        cursor = self.find(flt, projection)
+        if sort:
+            cursor.sort(sort)
+        for d in cursor:
+            return d
+        return None
+
+    #----------------------------------------------------------------------
+    def count(self, flt=None):
+        """数量"""
+        return len([d for d in self.docs if matchDoc(d, flt or {})])
+
+    #----------------------------------------------------------------------
+    def aggregate(self, pipeline):
+        """聚合"""
+        docs = self.docs
+        for stage in pipeline:
+            if '$match' in stage:
+                docs = [d for d in docs if matchDoc(d, stage['$match'])]
+            elif '$group' in stage:
+                if not docs:
+                    return []
+                result = {'_id': None}
+                for name, acc in stage['$group'].items():
+                    if name == '_id':
+                        continue
+                    op, field = list(acc.items())[0]
+                    if isinstance(field, basestring):
+                        values = [d.get(field[1:]) for d in docs]
+                        values = [v for v in values if v is not None]
+                    else:
+                        values = [field] * len(docs)
+                    result[name] = sum(values) if op == '$sum' else max(values)
+                docs = [result]
+        return docs
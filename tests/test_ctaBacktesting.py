@@ -0,0 +1,288 @@
+# encoding: UTF-8
+
+"""
+回测引擎的测试：先进先出配对、回测结果和各种数据载入方式的回放
+"""
+
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.vtObject import VtBarData
+from vnpy.trader.app.ctaStrategy import ctaBacktesting
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import (BacktestingEngine, TradingResult,
+                                                        matchTradesFifo)
+from vnpy.trader.vtConstant import DIRECTION_LONG
+
+from dataHelper import (makeBarDocs, writeDataSource, makeEngine, ChannelStrategy,
+                        MemoryCollection)
+
+
+#----------------------------------------------------------------------
+def matchTradesLoop(isLong, volumes):
+    """逐笔成交循环配对，和原先calculateBacktestingResult中的做法一致"""
+    longQueue = []      # 未平仓的多头成交，元素为[位置, 剩余数量]
+    shortQueue = []
+    pairList = []
+    for i, (buy, volume) in enumerate(zip(isLong, volumes)):
+        if buy:
+            ownQueue, otherQueue, sign = longQueue, shortQueue, -1
+        else:
+            ownQueue, otherQueue, sign = shortQueue, longQueue, 1
+
+        while volume and otherQueue:
+            entry = otherQueue[0]
+            closedVolume = min(volume, entry[1])
+            pairList.append((entry[0], i, sign * closedVolume))
+            entry[1] -= closedVolume
+            volume -= closedVolume
+            if not entry[1]:
+                otherQueue.pop(0)
+
+        if volume:
+            ownQueue.append([i, volume])
+    return pairList
+
+
+#----------------------------------------------------------------------
+def calculateResultLoop(engine):
+    """用TradingResult逐笔计算回测结果，作为向量化计算的对照"""
+    tradeList = list(engine.tradeDict.values())
+    isLong = [trade.direction == DIRECTION_LONG for trade in tradeList]
+    pairList = matchTradesLoop(isLong, [trade.volume for trade in tradeList])
+
+    capital = engine.initcapital
+    maxCapital = 0
+    d = {'pnlList': [], 'capitalList': [], 'drawdownList': [], 'posList': [0],
+         'tradeTimeList': [], 'totalTurnover': 0, 'totalCommission': 0, 'totalSlippage': 0}
+    for entry, exit, volume in pairList:
+        result = TradingResult(tradeList[entry].price, tradeList[entry].dt,
+                               tradeList[exit].price, tradeList[exit].dt,
+                               volume, engine.rate, engine.slippage, engine.size)
+        capital += engine.leverage * result.pnl
+        maxCapital = max(capital, maxCapital)
+        d['pnlList'].append(engine.leverage * result.pnl)
+        d['capitalList'].append(capital)
+        d['drawdownList'].append(capital - maxCapital)
+        d['posList'].extend([1 if volume > 0 else -1, 0])
+        d['tradeTimeList'].extend([result.entryDt, result.exitDt])
+        d['totalTurnover'] += result.turnover
+        d['totalCommission'] += result.commission
+        d['totalSlippage'] += result.slippage
+    d['capital'] = capital
+    d['maxCapital'] = maxCapital
+    return d
+
+
+########################################################################
+class RandomOrderStrategy(ChannelStrategy):
+    """随机发出1到3手的买卖限价单，持仓会反复穿过0，用于检查配对"""
+    className = 'RandomOrderStrategy'
+
+    seed = 1
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(RandomOrderStrategy, self).__init__(ctaEngine, setting)
+        self.rng = random.Random(self.seed)
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        if not self.trading:
+            return
+
+        for orderID in self.orderList:
+            self.cancelOrder(orderID)
+        self.orderList = []
+
+        n = self.rng.random()
+        volume = self.rng.randint(1, 3)
+        if n < 0.1:
+            self.orderList.append(self.buy(bar.close + 2, volume))
+        elif n < 0.2:
+            self.orderList.append(self.short(bar.close - 2, volume))
+
+
+########################################################################
+class FifoTest(unittest.TestCase):
+    """matchTradesFifo和逐笔循环配对的结果一致"""
+
+    #----------------------------------------------------------------------
+    def testMatchesLoop(self):
+        """随机的成交序列，包括部分平仓和反手"""
+        rng = np.random.RandomState(5)
+        for n in (0, 1, 2, 10, 200):
+            isLong = rng.randint(0, 2, n).astype(bool)
+            volumes = rng.randint(1, 6, n)
+            entryIndex, exitIndex, volume = matchTradesFifo(isLong, volumes)
+            self.assertEqual(list(zip(entryIndex.tolist(), exitIndex.tolist(), volume.tolist())),
+                             matchTradesLoop(isLong.tolist(), volumes.tolist()))
+
+    #----------------------------------------------------------------------
+    def testFlip(self):
+        """反手的成交先平掉全部持仓，剩余部分作为新的开仓"""
+        entryIndex, exitIndex, volume = matchTradesFifo(np.array([True, True, False, True]),
+                                                        [1, 2, 5, 1])
+        self.assertEqual(entryIndex.tolist(), [0, 1, 2])
+        self.assertEqual(exitIndex.tolist(), [2, 2, 3])
+        self.assertEqual(volume.tolist(), [1, 2, -1])
+
+
+########################################################################
+class BacktestingResultTest(unittest.TestCase):
+    """向量化的回测结果和逐笔计算的结果一致"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 3), 4 * 1440))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def testMatchesTradingResultLoop(self):
+        """随机下单的回测"""
+        engine = makeEngine(self.root, 'rb')
+        engine.setLeverage(2)
+        engine.initStrategy(RandomOrderStrategy, {})
+        engine.runBacktesting()
+        d = engine.calculateBacktestingResult()
+        expected = calculateResultLoop(engine)
+
+        self.assertTrue(len(expected['pnlList']) > 50)
+        self.assertTrue(max(abs(pos) for pos in engine.tradeLedger.getData()['volume']) > 1)
+        for key in ('capital', 'maxCapital', 'totalTurnover', 'totalCommission',
+                    'totalSlippage'):
+            self.assertEqual(d[key], expected[key], key)
+        for key in ('pnlList', 'capitalList', 'drawdownList', 'posList', 'tradeTimeList'):
+            self.assertEqual(list(d[key]), expected[key], key)
+
+    #----------------------------------------------------------------------
+    def testNoTrade(self):
+        """没有成交时返回空字典"""
+        engine = makeEngine(self.root, 'rb')
+        engine.initStrategy(ChannelStrategy, {'window': 100000})
+        engine.runBacktesting()
+        self.assertEqual(engine.calculateBacktestingResult(), {})
+
+
+########################################################################
+class MemoryClient(object):
+    """替代MongoClient，返回内存集合"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, symbol, collection):
+        """Constructor"""
+        self.symbol = symbol
+        self.collection = collection
+
+    #----------------------------------------------------------------------
+    def __call__(self, host=None, port=None):
+        """创建连接"""
+        return self
+
+    #----------------------------------------------------------------------
+    def __getitem__(self, dbName):
+        """数据库，只包含一个集合"""
+        return {self.symbol: self.collection}
+
+
+########################################################################
+class LegacyEngine(BacktestingEngine):
+    """
+    原先的载入方式：一次性读取全部文档，逐条转化为VtBarData，
+    按启动时间分为初始化数据和回测数据
+    """
+
+    #----------------------------------------------------------------------
+    def loadHistoryData(self):
+        """载入历史数据"""
+        collection = ctaBacktesting.pymongo.MongoClient()[self.dbName][self.symbol]
+        dataList = []
+        for d in collection.find(self.makeDataFilter()).sort('datetime'):
+            bar = VtBarData()
+            bar.__dict__ = dict(d)
+            dataList.append(bar)
+        self.setDataStream(dataList)
+
+
+########################################################################
+class ReplayTest(unittest.TestCase):
+    """各种数据载入和回放方式得到同样的成交"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """同样的K线同时写入本地文件数据源和内存集合"""
+        self.root = tempfile.mkdtemp()
+        self.docs = makeBarDocs(datetime(2017, 1, 3), 4 * 1440, 'rb')
+        writeDataSource(self.root, 'rb', self.docs)
+
+        self.mongoClient = ctaBacktesting.pymongo.MongoClient
+        ctaBacktesting.pymongo.MongoClient = MemoryClient('rb', MemoryCollection(self.docs))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """恢复MongoClient，删除数据目录"""
+        ctaBacktesting.pymongo.MongoClient = self.mongoClient
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def runEngine(self, engine, strategyClass=ChannelStrategy):
+        """运行回测，返回成交列表"""
+        engine.initStrategy(strategyClass, {})
+        engine.runBacktesting()
+        return [(trade.dt, trade.direction, trade.price, trade.volume)
+                for trade in engine.tradeDict.values()]
+
+    #----------------------------------------------------------------------
+    def testSameTrades(self):
+        """本地文件、数据库查询指针、预读取和K线缓存的回放与原先的载入方式一致"""
+        for strategyClass in (ChannelStrategy, RandomOrderStrategy):
+            expected = self.runEngine(makeEngine('', 'rb', engineClass=LegacyEngine),
+                                      strategyClass)
+            self.assertTrue(len(expected) > 20)
+
+            self.assertEqual(self.runEngine(makeEngine(self.root, 'rb'), strategyClass), expected)
+            self.assertEqual(self.runEngine(makeEngine('', 'rb'), strategyClass), expected)
+
+            engine = makeEngine('', 'rb')
+            engine.setPrefetch(1000, 2)
+            self.assertEqual(self.runEngine(engine, strategyClass), expected)
+
+            engine = makeEngine('', 'rb')
+            engine.setBarCache(tempfile.mkdtemp(dir=self.root))
+            self.assertEqual(self.runEngine(engine, strategyClass), expected)
+
+    #----------------------------------------------------------------------
+    def testInitStream(self):
+        """初始化数据和回测数据共用同一个数据流，策略没有读完的初始化数据被跳过"""
+        engine = makeEngine(self.root, 'rb')
+        engine.initStrategy(ChannelStrategy, {})
+        engine.loadHistoryData()
+        initList = [bar.datetime for bar, n in zip(engine.initData, range(100))]
+        replayList = [bar.datetime for bar in engine.backtestingData]
+
+        self.assertEqual(initList, [d['datetime'] for d in self.docs[:100]])
+        self.assertEqual(replayList[0], engine.strategyStartDate)
+        startDate, endDate = engine.strategyStartDate, engine.dataEndDate
+        self.assertEqual(replayList, [d['datetime'] for d in self.docs
+                                      if startDate <= d['datetime'] <= endDate])
+
+        engine.loadHistoryData()
+        initList = [bar.datetime for bar in engine.loadBar('db', 'rb', None)]
+        self.assertEqual(initList, [d['datetime'] for d in self.docs
+                                    if d['datetime'] < engine.strategyStartDate])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+# encoding: UTF-8
+
+"""
+K线列数据回放和引擎预先聚合大周期K线的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBarArray import checkBarGenerators
+from vnpy.trader.app.ctaStrategy.ctaVectorBacktesting import (VectorStrategyTemplate, LONG_ENTRY,
+                                                              SHORT_ENTRY, LONG_PRICE, SHORT_PRICE)
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine
+
+
+########################################################################
+class RecordStrategy(VectorStrategyTemplate):
+    """记录收到的大周期K线，不发出委托"""
+    className = 'RecordStrategy'
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(RecordStrategy, self).__init__(ctaEngine, setting)
+        self.fiveBarList = []
+
+    #----------------------------------------------------------------------
+    def calculateSignals(self, bars):
+        """没有信号"""
+        noSignal = np.zeros(len(bars['close']), dtype=bool)
+        return {LONG_ENTRY: noSignal, SHORT_ENTRY: noSignal,
+                LONG_PRICE: bars['close'], SHORT_PRICE: bars['close']}
+
+    #----------------------------------------------------------------------
+    def onFiveBar(self, bar):
+        """记录大周期K线"""
+        self.fiveBarList.append((bar.datetime, bar.open, bar.high, bar.low, bar.close,
+                                 bar.volume, bar.openInterest,
+                                 [float(v) for v in bar.volumeList],
+                                 [float(v) for v in bar.openInterestList]))
+        super(RecordStrategy, self).onFiveBar(bar)
+
+
+########################################################################
+class EngineAggregationTest(unittest.TestCase):
+    """引擎预先聚合的大周期K线和策略逐根聚合的结果一致"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """有缺失的1分钟K线"""
+        self.root = tempfile.mkdtemp()
+        docs = makeBarDocs(datetime(2017, 1, 2), 5000)
+        docs = [d for n, d in enumerate(docs) if n % 17 and n % 23]
+        writeDataSource(self.root, 'rb', docs)
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def runStrategy(self, aggregation, barOffset):
+        """回测并返回策略收到的大周期K线"""
+        engine = makeEngine(self.root, 'rb')
+        if aggregation:
+            engine.setBarGenerator(5, 'onFiveBar', barOffset)
+        engine.initStrategy(RecordStrategy, {'engineAggregation': aggregation,
+                                             'barOffset': barOffset})
+        engine.runBacktesting()
+        return engine.strategy.fiveBarList
+
+    #----------------------------------------------------------------------
+    def testSameBars(self):
+        """两种聚合方式推送的K线相同，包括初始化数据"""
+        for barOffset in (0, 1):
+            strategyBars = self.runStrategy(False, barOffset)
+            engineBars = self.runStrategy(True, barOffset)
+            self.assertTrue(len(strategyBars) > 500)
+            self.assertEqual(engineBars, strategyBars)
+
+    #----------------------------------------------------------------------
+    def testMissingGenerator(self):
+        """开启engineAggregation但引擎没有设置对应的K线时报错"""
+        engine = makeEngine(self.root, 'rb')
+        engine.setBarGenerator(15, 'onFiveBar')
+        engine.initStrategy(RecordStrategy, {'engineAggregation': True})
+        self.assertRaises(ValueError, engine.runBacktesting)
+
+        strategy = RecordStrategy(makeEngine(self.root, 'rb'), {'engineAggregation': False})
+        checkBarGenerators(strategy, [(5, 'onFiveBar')])
+
+
+if __name__ == '__main__':
+    unittest.main()
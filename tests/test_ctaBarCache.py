@@ -0,0 +1,89 @@
+# encoding: UTF-8
+
+"""
+K线列式缓存的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBarCache import BarCache, CACHE_PROJECTION
+
+from dataHelper import makeBarDocs, MemoryCollection
+
+
+START_DATE = datetime(2017, 1, 31)
+END_DATE = datetime(2017, 2, 1, 23, 59)
+
+
+########################################################################
+class BarCacheTest(unittest.TestCase):
+    """BarCache的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """跨越两个自然月的K线"""
+        self.cachePath = tempfile.mkdtemp()
+        self.cache = BarCache(self.cachePath)
+        self.collection = MemoryCollection(makeBarDocs(datetime(2017, 1, 31, 20, 0), 600))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除缓存目录"""
+        shutil.rmtree(self.cachePath)
+
+    #----------------------------------------------------------------------
+    def load(self):
+        """载入缓存，返回列数据字典"""
+        arrays, info = self.cache.loadBarArrays(self.collection, 'db', 'rb', START_DATE, END_DATE)
+        return arrays
+
+    #----------------------------------------------------------------------
+    def refreshCount(self):
+        """读取缓存数据的查询次数"""
+        return self.collection.projectionList.count(CACHE_PROJECTION)
+
+    #----------------------------------------------------------------------
+    def testLoadMatchesDocs(self):
+        """缓存的数据和数据库一致"""
+        arrays = self.load()
+        docs = self.collection.docs
+        self.assertEqual(len(arrays['datetime']), len(docs))
+        self.assertEqual(arrays['datetime'][0].item(), docs[0]['datetime'])
+        np.testing.assert_array_equal(arrays['close'], [d['close'] for d in docs])
+        np.testing.assert_array_equal(arrays['openInterest'], [d['openInterest'] for d in docs])
+
+    #----------------------------------------------------------------------
+    def testReloadDoesNotReadDocs(self):
+        """数据没有变化时，再次载入不读取文档"""
+        self.load()
+        self.assertEqual(self.refreshCount(), 2)
+        self.load()
+        self.assertEqual(self.refreshCount(), 2)
+
+    #----------------------------------------------------------------------
+    def testInPlaceCorrectionRefreshesMonth(self):
+        """原地修正某根K线的数值后，只重新读取所在的月份"""
+        self.load()
+        doc = self.collection.docs[-1]
+        doc['close'] += 14
+
+        arrays = self.load()
+        self.assertEqual(arrays['close'][-1], doc['close'])
+        self.assertEqual(self.refreshCount(), 3)
+
+    #----------------------------------------------------------------------
+    def testAppendedBarsRefreshMonth(self):
+        """集合中增加数据后，缓存随之更新"""
+        self.load()
+        self.collection.docs.extend(makeBarDocs(datetime(2017, 2, 1, 6, 0), 10, seed=2))
+        arrays = self.load()
+        self.assertEqual(len(arrays['datetime']), 610)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# encoding: UTF-8
+
+"""
+逐日盯市结果计算的测试
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaDailyResult import calculateDailyResult
+
+
+########################################################################
+class DailyResultTest(unittest.TestCase):
+    """calculateDailyResult的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """两个交易日的K线，第一天开多仓后一直持有"""
+        self.barTimes = np.array(['2017-01-03T09:00', '2017-01-03T14:59',
+                                  '2017-01-04T09:00', '2017-01-04T14:59'], dtype='datetime64[us]')
+        self.closes = np.array([3000., 3010., 3005., 3020.])
+        self.tradeTimes = np.array(['2017-01-03T09:00'], dtype='datetime64[us]')
+        self.path = tempfile.mkdtemp()
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除临时目录"""
+        shutil.rmtree(self.path)
+
+    #----------------------------------------------------------------------
+    def calculate(self, barTimes):
+        """按每手10吨、没有手续费和滑点计算"""
+        return calculateDailyResult(barTimes, self.closes, self.tradeTimes, [3000.], [1.],
+                                    datetime(2017, 1, 3), 100000, 10, 0, 0)
+
+    #----------------------------------------------------------------------
+    def testOpenPositionMarkedToClose(self):
+        """持仓按每个交易日的收盘价盯市"""
+        df, barDf = self.calculate(self.barTimes)
+        self.assertEqual(df['netPnl'].tolist(), [100., 100.])
+        self.assertEqual(df['endPos'].tolist(), [1., 1.])
+        self.assertEqual(barDf['balance'].tolist(), [100000., 100100., 100050., 100200.])
+        self.assertEqual(barDf['drawdown'].min(), -50.)
+
+    #----------------------------------------------------------------------
+    def testReadOnlyArrays(self):
+        """缓存和本地数据源以只读内存映射载入的时间数组也可以计算"""
+        filename = os.path.join(self.path, 'datetime.npy')
+        np.save(filename, self.barTimes)
+        barTimes = np.load(filename, mmap_mode='r')
+
+        df, barDf = self.calculate(barTimes)
+        self.assertEqual(barDf['balance'].iloc[-1], 100200.)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+# encoding: UTF-8
+
+"""
+结构化日志的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from vnpy.trader.app.ctaStrategy.ctaLogger import (CtaLogger, writeStrategyLog, LOG_DEBUG,
+                                                   LOG_INFO, LOG_WARNING, LOG_DISABLED)
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class CountingValue(object):
+    """记录被格式化次数的日志参数"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.count = 0
+
+    #----------------------------------------------------------------------
+    def __str__(self):
+        """格式化"""
+        self.count += 1
+        return 'value'
+
+
+########################################################################
+class LoggingStrategy(ChannelStrategy):
+    """每根K线写一条引擎日志和一条延迟格式化的调试日志"""
+    className = 'LoggingStrategy'
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        super(LoggingStrategy, self).onBar(bar)
+        if self.trading:
+            self.writeCtaLog(u'收盘价：%s' % bar.close)
+            writeStrategyLog(self, u'K线数量：%s', self.barCount, level=LOG_DEBUG)
+
+
+########################################################################
+class FailingStrategy(LoggingStrategy):
+    """回测开始后出错的策略"""
+    className = 'FailingStrategy'
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        if self.trading:
+            raise ValueError(u'策略出错')
+
+
+########################################################################
+class LiveEngine(object):
+    """没有结构化日志的引擎，如实盘引擎"""
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.logList = []
+
+    #----------------------------------------------------------------------
+    def writeCtaLog(self, content):
+        """记录日志"""
+        self.logList.append(content)
+
+
+########################################################################
+class CtaLoggerTest(unittest.TestCase):
+    """CtaLogger的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.dt = datetime(2017, 1, 3, 9, 0)
+
+    #----------------------------------------------------------------------
+    def testDeferredFormat(self):
+        """记录时不格式化，读取时才格式化"""
+        logger = CtaLogger()
+        value = CountingValue()
+        logger.log(self.dt, LOG_INFO, u'参数：%s', (value,))
+        logger.log(self.dt, LOG_INFO, u'100%')
+        self.assertEqual(value.count, 0)
+        self.assertEqual(logger.render(), [str(self.dt) + u' 参数：value', str(self.dt) + u' 100%'])
+        self.assertEqual(value.count, 1)
+
+    #----------------------------------------------------------------------
+    def testLevel(self):
+        """低于设置级别的日志直接丢弃，读取时也可以按级别过滤"""
+        logger = CtaLogger(LOG_INFO)
+        value = CountingValue()
+        logger.log(self.dt, LOG_DEBUG, u'调试：%s', (value,))
+        logger.log(self.dt, LOG_INFO, u'信息')
+        logger.log(self.dt, LOG_WARNING, u'警告')
+        self.assertEqual(len(logger), 2)
+        self.assertEqual(logger.render(LOG_WARNING, withLevel=True),
+                         [str(self.dt) + u' WARNING 警告'])
+
+        logger.setLevel(LOG_DISABLED)
+        logger.log(self.dt, LOG_WARNING, u'警告')
+        self.assertEqual(len(logger), 2)
+        self.assertEqual(value.count, 0)
+
+    #----------------------------------------------------------------------
+    def testBufferSize(self):
+        """超出环形缓冲区长度时丢弃最早的日志"""
+        logger = CtaLogger(bufferSize=3)
+        for i in range(5):
+            logger.log(self.dt, LOG_INFO, '%s', (i,))
+        self.assertEqual([message for dt, level, message in logger.iterRecords()], ['2', '3', '4'])
+
+        logger.setBufferSize(2)
+        self.assertEqual([message for dt, level, message in logger.iterRecords()], ['3', '4'])
+
+    #----------------------------------------------------------------------
+    def testLiveEngine(self):
+        """没有结构化日志的引擎中格式化后调用策略的writeCtaLog"""
+        engine = LiveEngine()
+        strategy = ChannelStrategy(engine, {})
+        writeStrategyLog(strategy, u'价格：%s', 3000, level=LOG_DEBUG)
+        self.assertEqual(engine.logList, [u'价格：3000'])
+
+
+########################################################################
+class EngineLogTest(unittest.TestCase):
+    """回测引擎中的日志"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 3), 2 * 1440))
+        self.engine = makeEngine(self.root, 'rb', endDate='20170105')
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def testLogList(self):
+        """logList的格式和原先的时间加内容一致，调试日志默认不记录"""
+        self.engine.initStrategy(LoggingStrategy, {})
+        self.engine.runBacktesting()
+        logList = self.engine.logList
+        self.assertEqual(len(logList), 1440)
+        self.assertTrue(logList[0].startswith(u'2017-01-04 00:00:00 收盘价：'))
+
+        self.engine.setLogLevel(LOG_DEBUG)
+        self.engine.logger.clear()
+        self.engine.initStrategy(LoggingStrategy, {})
+        self.engine.runBacktesting()
+        self.assertEqual(len(self.engine.logList), 2 * 1440)
+
+    #----------------------------------------------------------------------
+    def testOptimizationRestoresLevel(self):
+        """优化时关闭日志，策略出错时也恢复原来的日志级别"""
+        self.engine.setLogLevel(LOG_DEBUG)
+        self.engine.runSettingList(LoggingStrategy, [{}], 'capital')
+        self.assertEqual(len(self.engine.logger), 0)
+        self.assertEqual(self.engine.logger.level, LOG_DEBUG)
+
+        self.assertRaises(ValueError, self.engine.runSettingList, FailingStrategy, [{}],
+                          'capital')
+        self.assertEqual(self.engine.logger.level, LOG_DEBUG)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+# encoding: UTF-8
+
+"""
+多进程优化的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from vnpy.trader.vtObject import VtBarData
+from vnpy.trader.app.ctaStrategy.ctaTickStore import TickStore
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import BacktestingEngine
+from vnpy.trader.app.ctaStrategy.ctaOptimizer import applyEngineSetting
+
+from dataHelper import (makeBarDocs, writeDataSource, makeEngine, makeTickArrays, ChannelStrategy,
+                        PRICE_TICK)
+
+
+########################################################################
+class TickChannelStrategy(ChannelStrategy):
+    """用每个Tick的最新价作为收盘价，驱动通道突破逻辑"""
+    className = 'TickChannelStrategy'
+
+    #----------------------------------------------------------------------
+    def onInit(self):
+        """初始化"""
+        for tick in self.loadTick(1):
+            self.onTick(tick)
+
+    #----------------------------------------------------------------------
+    def onTick(self, tick):
+        """Tick推送"""
+        bar = VtBarData()
+        bar.vtSymbol = tick.vtSymbol
+        bar.datetime = tick.datetime
+        bar.close = tick.lastPrice
+        self.onBar(bar)
+
+
+#----------------------------------------------------------------------
+def makeTickEngine(root=''):
+    """使用压缩Tick存储的Tick回测引擎，root为空时不设置数据来源"""
+    engine = BacktestingEngine()
+    engine.setBacktestingMode(engine.TICK_MODE)
+    engine.setStartDate('20170103', 1)
+    engine.setEndDate('20170105')
+    engine.setInitialCapital(100000)
+    engine.setSlippage(PRICE_TICK)
+    engine.setRate(0.0003)
+    engine.setSize(10)
+    engine.setPriceTick(PRICE_TICK)
+    if root:
+        engine.setTickStore(root, 'rb')
+    return engine
+
+
+########################################################################
+class EngineSettingTest(unittest.TestCase):
+    """子进程按导出的设置重建回测引擎"""
+
+    #----------------------------------------------------------------------
+    def testDataSourceRoundTrip(self):
+        """本地文件数据源、压缩Tick存储和K线缓存都传给子进程"""
+        engine = makeEngine('/data/bars', 'rb')
+        engine.setDataSource('/data/bars', 'rb', 'csv')
+        engine.setTickStore('/data/ticks', 'rb')
+        engine.setBarCache('/data/cache')
+        engine.setReuseBar(True)
+        engine.setPrefetch(1000, 2)
+
+        setting = engine.getEngineSetting()
+        setting['sharedDataPath'] = ''
+        worker = BacktestingEngine()
+        applyEngineSetting(worker, setting)
+
+        self.assertEqual(worker.symbol, 'rb')
+        self.assertEqual(worker.dataSource.root, '/data/bars')
+        self.assertEqual(worker.dataSource.fileFormat, 'csv')
+        self.assertEqual(worker.tickStore.root, '/data/ticks')
+        self.assertEqual(worker.barCache.cachePath, engine.barCache.cachePath)
+        self.assertTrue(worker.reuseBar)
+        self.assertEqual((worker.prefetchBatchSize, worker.prefetchQueueSize), (1000, 2))
+        self.assertEqual(worker.getEngineSetting(), engine.getEngineSetting())
+
+    #----------------------------------------------------------------------
+    def testMissingSourceRaises(self):
+        """没有子进程可用的数据来源时直接报错，而不是把所有目标值记为0"""
+        engine = makeTickEngine()
+        self.assertRaises(ValueError, engine.runParallelSettingList, TickChannelStrategy,
+                          [{}], 'capital')
+
+        engine.setBacktestingMode(engine.BAR_MODE)
+        self.assertRaises(ValueError, engine.runParallelSettingList, ChannelStrategy,
+                          [{}], 'capital')
+
+
+########################################################################
+class ParallelOptimizationTest(unittest.TestCase):
+    """多进程优化和逐个回测的结果一致"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.root = tempfile.mkdtemp()
+        self.settingList = [{'window': window} for window in (200, 400, 800)]
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def checkParallel(self, engine, strategyClass):
+        """并行与逐个回测的目标值相同，且确实发生了交易"""
+        serial = sorted(engine.runSettingList(strategyClass, self.settingList, 'capital'))
+        parallel = sorted(engine.runParallelSettingList(strategyClass, self.settingList, 'capital'))
+        self.assertEqual(parallel, serial)
+        self.assertTrue(all(targetValue for settingStr, targetValue in parallel))
+
+    #----------------------------------------------------------------------
+    def testTickStore(self):
+        """Tick模式下子进程从压缩Tick存储载入数据"""
+        arrays = makeTickArrays(datetime(2017, 1, 3), 80000)
+        TickStore(self.root).writeTickArrays('rb', arrays, {'vtSymbol': 'rb',
+                                                            'priceTick': PRICE_TICK})
+        self.checkParallel(makeTickEngine(self.root), TickChannelStrategy)
+
+    #----------------------------------------------------------------------
+    def testDataSource(self):
+        """K线模式下父进程从本地文件数据源载入共享数据"""
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 3), 3 * 1440))
+        self.settingList = [{'window': window} for window in (10, 20, 40)]
+        self.checkParallel(makeEngine(self.root, 'rb'), ChannelStrategy)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+# encoding: UTF-8
+
+"""
+撮合用委托簿的测试，和原先遍历全部活动委托的撮合方式对照
+"""
+
+import random
+import shutil
+import tempfile
+import unittest
+from collections import OrderedDict
+from datetime import datetime
+
+from vnpy.trader.vtConstant import DIRECTION_LONG, DIRECTION_SHORT
+from vnpy.trader.app.ctaStrategy.ctaOrderBook import LimitOrderBook, StopOrderBook
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class ScanLimitOrderBook(object):
+    """遍历全部活动委托的限价单撮合，即原先crossLimitOrder的做法"""
+    idName = 'vtOrderID'
+
+    #----------------------------------------------------------------------
+    def __init__(self):
+        """Constructor"""
+        self.orderDict = OrderedDict()
+
+    #----------------------------------------------------------------------
+    def add(self, order):
+        """加入委托"""
+        self.orderDict[getattr(order, self.idName)] = order
+
+    #----------------------------------------------------------------------
+    def remove(self, order):
+        """移除委托"""
+        self.orderDict.pop(getattr(order, self.idName), None)
+
+    #----------------------------------------------------------------------
+    def isCrossed(self, order, buyCrossPrice, sellCrossPrice):
+        """委托是否成交"""
+        if order.direction == DIRECTION_LONG:
+            return order.price >= buyCrossPrice and buyCrossPrice > 0
+        return order.price <= sellCrossPrice and sellCrossPrice > 0
+
+    #----------------------------------------------------------------------
+    def popCrossedOrders(self, buyCrossPrice, sellCrossPrice):
+        """按发单顺序取出会成交的委托"""
+        crossed = [order for order in self.orderDict.values()
+                   if self.isCrossed(order, buyCrossPrice, sellCrossPrice)]
+        for order in crossed:
+            self.remove(order)
+        return crossed
+
+    #----------------------------------------------------------------------
+    def popAllOrders(self):
+        """取出全部委托"""
+        crossed = list(self.orderDict.values())
+        self.orderDict.clear()
+        return crossed
+
+    #----------------------------------------------------------------------
+    def clear(self):
+        """清空"""
+        self.orderDict.clear()
+
+
+########################################################################
+class ScanStopOrderBook(ScanLimitOrderBook):
+    """遍历全部活动停止单的撮合，即原先crossStopOrder的做法"""
+    idName = 'stopOrderID'
+
+    #----------------------------------------------------------------------
+    def isCrossed(self, order, buyCrossPrice, sellCrossPrice):
+        """停止单是否触发"""
+        if order.direction == DIRECTION_LONG:
+            return order.price <= buyCrossPrice
+        return order.price >= sellCrossPrice
+
+
+########################################################################
+class Order(object):
+    """只有撮合用到的属性的委托"""
+
+    #----------------------------------------------------------------------
+    def __init__(self, orderID, direction, price):
+        """Constructor"""
+        self.vtOrderID = self.stopOrderID = orderID
+        self.direction = direction
+        self.price = price
+
+
+########################################################################
+class GridStrategy(ChannelStrategy):
+    """在收盘价上下同时挂出多档限价单和停止单，并随机撤销一部分"""
+    className = 'GridStrategy'
+
+    #----------------------------------------------------------------------
+    def __init__(self, ctaEngine, setting):
+        """Constructor"""
+        super(GridStrategy, self).__init__(ctaEngine, setting)
+        self.rng = random.Random(2)
+
+    #----------------------------------------------------------------------
+    def onBar(self, bar):
+        """K线推送"""
+        if not self.trading:
+            return
+
+        for orderID in self.rng.sample(self.orderList, len(self.orderList) // 2):
+            self.cancelOrder(orderID)
+        if self.rng.random() < 0.02:
+            self.cancelAll()
+
+        for i in range(1, 4):
+            offset = self.rng.randint(1, 8) * i
+            self.orderList.append(self.buy(bar.close - offset, 1))
+            self.orderList.append(self.short(bar.close + offset, 1))
+            self.orderList.append(self.buy(bar.close + offset, 1, True))
+            self.orderList.append(self.short(bar.close - offset, 1, True))
+        self.orderList = self.orderList[-60:]
+
+
+########################################################################
+class OrderBookTest(unittest.TestCase):
+    """委托簿和遍历撮合的结果一致"""
+
+    #----------------------------------------------------------------------
+    def checkBook(self, book, scanBook):
+        """随机的加入、撤单和撮合"""
+        rng = random.Random(7)
+        working = []
+        for n in range(3000):
+            action = rng.random()
+            if action < 0.6:
+                direction = rng.choice([DIRECTION_LONG, DIRECTION_SHORT])
+                order = Order(str(n), direction, float(rng.randint(90, 110)))
+                book.add(order)
+                scanBook.add(order)
+                working.append(order)
+            elif action < 0.8 and working:
+                order = working.pop(rng.randrange(len(working)))
+                book.remove(order)
+                scanBook.remove(order)
+            elif action < 0.99:
+                buyCrossPrice = float(rng.choice([0, rng.randint(90, 110)]))
+                sellCrossPrice = float(rng.choice([0, rng.randint(90, 110)]))
+                crossed = book.popCrossedOrders(buyCrossPrice, sellCrossPrice)
+                self.assertEqual(crossed, scanBook.popCrossedOrders(buyCrossPrice, sellCrossPrice))
+                working = [order for order in working if order not in crossed]
+            else:
+                self.assertEqual(book.popAllOrders(), scanBook.popAllOrders())
+                working = []
+        self.assertEqual(book.popAllOrders(), scanBook.popAllOrders())
+        self.assertEqual(book.keyDict, {})
+
+    #----------------------------------------------------------------------
+    def testLimitOrderBook(self):
+        """限价单"""
+        self.checkBook(LimitOrderBook(), ScanLimitOrderBook())
+
+    #----------------------------------------------------------------------
+    def testStopOrderBook(self):
+        """停止单"""
+        self.checkBook(StopOrderBook(), ScanStopOrderBook())
+
+
+########################################################################
+class EngineOrderBookTest(unittest.TestCase):
+    """回测引擎使用委托簿和遍历撮合得到同样的成交和委托记录"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 3), 3 * 1440))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def runEngine(self, scan):
+        """运行回测，返回成交、限价单和停止单记录"""
+        engine = makeEngine(self.root, 'rb')
+        if scan:
+            engine.limitOrderBook = ScanLimitOrderBook()
+            engine.stopOrderBook = ScanStopOrderBook()
+        engine.initStrategy(GridStrategy, {})
+        engine.runBacktesting()
+        return [('trade', engine.tradeLedger.getData().tolist()),
+                ('limitOrder', engine.limitOrderLedger.getData().tolist()),
+                ('stopOrder', engine.stopOrderLedger.getData().tolist())]
+
+    #----------------------------------------------------------------------
+    def testSameRecords(self):
+        """网格策略"""
+        expected = self.runEngine(True)
+        self.assertTrue(len(expected[0][1]) > 1000)
+        for (name, rows), (expectedName, expectedRows) in zip(self.runEngine(False), expected):
+            self.assertEqual(len(rows), len(expectedRows), name)
+            for n, (row, expectedRow) in enumerate(zip(rows, expectedRows)):
+                self.assertEqual(row, expectedRow, '%s %s' % (name, n))
+
+
+if __name__ == '__main__':
+    unittest.main()
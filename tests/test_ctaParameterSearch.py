@@ -0,0 +1,123 @@
+# encoding: UTF-8
+
+"""
+抽样搜索和逐级减半的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from itertools import product
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaBacktesting import OptimizationSetting
+from vnpy.trader.app.ctaStrategy.ctaParameterSearch import (SEARCH_RANDOM, SEARCH_LHS,
+                                                            decodeGridIndex, randomGridIndex,
+                                                            latinHypercubeIndex, halvingWindows,
+                                                            rankResults, promoteCount)
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class SamplingTest(unittest.TestCase):
+    """参数组合的抽样"""
+
+    #----------------------------------------------------------------------
+    def testDecodeGridIndex(self):
+        """组合编号的顺序和itertools.product一致"""
+        sizeList = [3, 1, 4, 2]
+        index = decodeGridIndex(np.arange(24), sizeList)
+        self.assertEqual([tuple(row) for row in index.tolist()],
+                         list(product(*[range(size) for size in sizeList])))
+
+    #----------------------------------------------------------------------
+    def testRandomGridIndex(self):
+        """无放回抽样，数量不超过全部组合"""
+        rng = np.random.RandomState(0)
+        index = randomGridIndex([10, 20, 30], 500, rng)
+        self.assertEqual(len(set(map(tuple, index.tolist()))), 500)
+        self.assertTrue((index < [10, 20, 30]).all() and (index >= 0).all())
+        self.assertEqual(len(randomGridIndex([2, 3], 10, rng)), 6)
+
+    #----------------------------------------------------------------------
+    def testLatinHypercube(self):
+        """每个参数的每一层恰好一个点；映射到网格后重复的组合补足到要求的数量"""
+        rng = np.random.RandomState(1)
+        index = latinHypercubeIndex([50, 50, 50], 50, rng)
+        for j in range(3):
+            self.assertEqual(sorted(index[:, j].tolist()), list(range(50)))
+
+        for sizeList, sampleNum, expected in (([2, 2], 4, 4), ([3, 3], 8, 8), ([2, 3], 20, 6)):
+            index = latinHypercubeIndex(sizeList, sampleNum, rng)
+            self.assertEqual(len(index), expected)
+            self.assertEqual(len(set(map(tuple, index.tolist()))), expected)
+
+    #----------------------------------------------------------------------
+    def testGenerateSetting(self):
+        """抽样的参数组合都是网格上的取值，同样的种子结果相同"""
+        setting = OptimizationSetting()
+        setting.addParameter('window', 10, 100, 10)
+        setting.addParameter('holdBars', 5, 50, 5)
+        grid = setting.generateSetting()
+        for mode in (SEARCH_RANDOM, SEARCH_LHS):
+            setting.setSearchMode(mode, 30, seed=3)
+            settingList = setting.generateSetting()
+            self.assertEqual(len(settingList), 30)
+            self.assertTrue(all(s in grid for s in settingList))
+            self.assertEqual(settingList, setting.generateSetting())
+
+
+########################################################################
+class HalvingTest(unittest.TestCase):
+    """逐级减半"""
+
+    #----------------------------------------------------------------------
+    def testHalvingWindows(self):
+        """窗口从短到长，最短不少于minDays天，最后一级为完整区间"""
+        windowList = halvingWindows(datetime(2017, 1, 1), datetime(2017, 12, 31), 3, 10)
+        self.assertEqual(windowList, ['20170115', '20170211', '20170503', '20171231'])
+        self.assertEqual(halvingWindows(datetime(2017, 1, 1), datetime(2017, 1, 20), 3, 10),
+                         ['20170120'])
+
+    #----------------------------------------------------------------------
+    def testRankResults(self):
+        """目标值相同时按参数组合的顺序排列"""
+        settingList = [{'x': i} for i in range(4)]
+        resultList = [("{'x': 3}", 1.0), ("{'x': 1}", 1.0), ("{'x': 2}", 2.0), ("{'x': 0}", 1.0)]
+        self.assertEqual([result[0] for result in rankResults(resultList, settingList)],
+                         ["{'x': 2}", "{'x': 0}", "{'x': 1}", "{'x': 3}"])
+        self.assertEqual([promoteCount(n) for n in (1, 2, 3, 4, 9, 10)], [1, 1, 1, 2, 3, 4])
+
+    #----------------------------------------------------------------------
+    def testSuccessiveHalving(self):
+        """较短窗口上靠前的参数组合进入完整区间的回测"""
+        root = tempfile.mkdtemp()
+        try:
+            writeDataSource(root, 'rb', makeBarDocs(datetime(2017, 1, 3), 9 * 1440))
+            engine = makeEngine(root, 'rb', endDate='20170112')
+            setting = OptimizationSetting()
+            setting.setOptimizeTarget('capital')
+            setting.addParameter('window', 10, 90, 10)
+            settingList = setting.generateSetting()
+
+            windowList = halvingWindows(engine.strategyStartDate, engine.dataEndDate, 3, 2)
+            self.assertEqual(len(windowList), 2)
+            engine.setEndDate(windowList[0])
+            promoted = rankResults(engine.runSettingList(ChannelStrategy, settingList, 'capital'),
+                                   settingList)[:3]
+            promotedList = [s for s in settingList if str(s) in dict(promoted)]
+            engine.setEndDate('20170112')
+            expected = rankResults(engine.runSettingList(ChannelStrategy, promotedList, 'capital'),
+                                   promotedList)
+
+            self.assertEqual(engine.runSuccessiveHalving(ChannelStrategy, setting, 3, 2), expected)
+            self.assertEqual(engine.endDate, '20170112')
+        finally:
+            shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+# encoding: UTF-8
+
+"""
+组合回测引擎的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaPortfolioBacktesting import PortfolioBacktestingEngine
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class PortfolioBacktestingTest(unittest.TestCase):
+    """PortfolioBacktestingEngine的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """两个品种的K线，时间戳错开30秒"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 2), 6000, 'rb', seed=1))
+        writeDataSource(self.root, 'hc', makeBarDocs(datetime(2017, 1, 2, 0, 0, 30), 6000, 'hc',
+                                                     seed=2))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def makePortfolio(self, capital=200000):
+        """组合回测引擎"""
+        portfolio = PortfolioBacktestingEngine()
+        portfolio.setStartDate('20170102', 1)
+        portfolio.setEndDate('20170105')
+        portfolio.setInitialCapital(capital)
+        return portfolio
+
+    #----------------------------------------------------------------------
+    def addLeg(self, portfolio, symbol, setting=None, capital=0, name=''):
+        """增加使用本地文件数据源的品种"""
+        engine = portfolio.addSymbol('', symbol, ChannelStrategy, setting, size=10, rate=0.0003,
+                                     slippage=1, priceTick=1, capital=capital, name=name)
+        engine.setDataSource(self.root, symbol)
+        return engine
+
+    #----------------------------------------------------------------------
+    def testCapitalSplit(self):
+        """未设置资金的品种平分组合剩余的资金"""
+        portfolio = self.makePortfolio()
+        rb = self.addLeg(portfolio, 'rb')
+        hc = self.addLeg(portfolio, 'hc')
+        portfolio.runBacktesting()
+        self.assertEqual(rb.initcapital, 100000)
+        self.assertEqual(hc.initcapital, 100000)
+
+        portfolio = self.makePortfolio()
+        rb = self.addLeg(portfolio, 'rb', capital=50000)
+        hc = self.addLeg(portfolio, 'hc')
+        portfolio.runBacktesting()
+        self.assertEqual(rb.initcapital, 50000)
+        self.assertEqual(hc.initcapital, 150000)
+
+    #----------------------------------------------------------------------
+    def testOverAllocatedCapital(self):
+        """组合资金不足以分配时报错"""
+        portfolio = self.makePortfolio(100000)
+        self.addLeg(portfolio, 'rb', capital=100000)
+        self.addLeg(portfolio, 'hc')
+        self.assertRaises(ValueError, portfolio.runBacktesting)
+
+    #----------------------------------------------------------------------
+    def testMissingStartDate(self):
+        """没有设置启动日期时报错"""
+        portfolio = PortfolioBacktestingEngine()
+        portfolio.setInitialCapital(100000)
+        self.addLeg(portfolio, 'rb')
+        self.assertRaises(ValueError, portfolio.runBacktesting)
+
+    #----------------------------------------------------------------------
+    def testDuplicateName(self):
+        """同一合约添加多次时必须指定名称"""
+        portfolio = self.makePortfolio()
+        self.addLeg(portfolio, 'rb')
+        self.assertRaises(ValueError, self.addLeg, portfolio, 'rb')
+
+    #----------------------------------------------------------------------
+    def testLegsMatchSingleEngine(self):
+        """同一合约的两个品种按名称分别保存结果，和单独回测的结果一致"""
+        portfolio = self.makePortfolio()
+        self.addLeg(portfolio, 'rb', {'window': 20}, name='rbFast')
+        self.addLeg(portfolio, 'rb', {'window': 40}, name='rbSlow')
+        portfolio.runBacktesting()
+        d = portfolio.calculateBacktestingResult()
+
+        for name, window in [('rbFast', 20), ('rbSlow', 40)]:
+            engine = makeEngine(self.root, 'rb', '20170102', '20170105')
+            engine.setInitialCapital(100000)
+            engine.initStrategy(ChannelStrategy, {'window': window})
+            engine.runBacktesting()
+            single = engine.calculateBacktestingResult()
+
+            legResult = d['legResultDict'][name]
+            self.assertEqual(legResult['totalResult'], single['totalResult'])
+            np.testing.assert_array_equal(legResult['pnlList'], single['pnlList'])
+
+        self.assertEqual(d['totalResult'], sum(d['legResultDict'][name]['totalResult']
+                                               for name in ['rbFast', 'rbSlow']))
+
+    #----------------------------------------------------------------------
+    def testMarkToMarket(self):
+        """持仓一直不平仓时，组合资金曲线包含各品种的浮动盈亏"""
+        portfolio = self.makePortfolio()
+        rb = self.addLeg(portfolio, 'rb', {'holdBars': 0})
+        hc = self.addLeg(portfolio, 'hc', {'holdBars': 0})
+        portfolio.runBacktesting()
+        df, barDf = portfolio.calculateDailyResult()
+
+        self.assertNotEqual(rb.strategy.pos, 0)
+        self.assertNotEqual(hc.strategy.pos, 0)
+
+        # 最后的资金等于各品种开仓成交后按最后收盘价盯市的权益之和
+        balance = portfolio.initcapital
+        for engine in [rb, hc]:
+            trades = engine.tradeLedger.getData()
+            self.assertEqual(len(trades), 1)
+            lastClose = engine.markArrays['close'][-1]
+            price = trades['price'][0]
+            pos = engine.strategy.pos
+            cost = price * 10 * 0.0003 + 10 * 1
+            balance += pos * (lastClose - price) * 10 - cost
+
+        self.assertAlmostEqual(barDf['balance'].iloc[-1], balance)
+        self.assertAlmostEqual(df['balance'].iloc[-1], balance)
+        self.assertTrue(barDf['drawdown'].min() < 0)
+
+        # 两个品种的时间戳错开，组合的资金曲线包含双方的全部时间点
+        rbTimes = rb.markArrays['datetime']
+        self.assertTrue(len(barDf) > len(rbTimes))
+        self.assertTrue(np.all(np.diff(barDf.index.values) > np.timedelta64(0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# encoding: UTF-8
+
+"""
+优化结果缓存的测试
+"""
+
+import math
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from vnpy.trader.app.ctaStrategy.ctaResultCache import ResultCache, QUERY_BATCH_SIZE
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class ResultCacheTest(unittest.TestCase):
+    """ResultCache的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.path = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.path, 'cache', 'result.db'))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除缓存文件"""
+        self.cache.close()
+        shutil.rmtree(self.path)
+
+    #----------------------------------------------------------------------
+    def testRoundTrip(self):
+        """按目标名称分别保存，超过单次查询数量时分批查询"""
+        n = QUERY_BATCH_SIZE * 2 + 1
+        self.cache.putResults([('key%s' % i, str(i), float(i)) for i in range(n)], 'capital')
+        self.cache.putResults([('key0', '0', float('nan'))], 'sharpeRatio')
+
+        keyList = ['key%s' % i for i in range(n + 10)]
+        resultDict = self.cache.getResults(keyList, 'capital')
+        self.assertEqual(resultDict, dict(('key%s' % i, float(i)) for i in range(n)))
+        self.assertTrue(math.isnan(self.cache.getResults(keyList, 'sharpeRatio')['key0']))
+
+        self.cache.clear()
+        self.assertEqual(self.cache.getResults(keyList, 'capital'), {})
+
+
+########################################################################
+class EngineCacheTest(unittest.TestCase):
+    """回测引擎中使用优化结果缓存"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.root = tempfile.mkdtemp()
+        self.docs = makeBarDocs(datetime(2017, 1, 3), 3 * 1440)
+        writeDataSource(self.root, 'rb', self.docs)
+        self.settingList = [{'window': window} for window in (10, 20, 40)]
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def makeEngine(self):
+        """开启了缓存的回测引擎，记录回测的次数"""
+        engine = makeEngine(self.root, 'rb')
+        engine.setResultCache(os.path.join(self.root, 'cache.db'))
+        engine.runCount = 0
+        runBacktesting = engine.runBacktesting
+
+        def countingRun():
+            engine.runCount += 1
+            runBacktesting()
+        engine.runBacktesting = countingRun
+        return engine
+
+    #----------------------------------------------------------------------
+    def testCachedResults(self):
+        """缓存命中时直接读取，结果和回测的一致"""
+        engine = self.makeEngine()
+        expected = engine.runSettingList(ChannelStrategy, self.settingList, 'capital')
+        self.assertEqual(engine.runCount, 3)
+
+        engine = self.makeEngine()
+        settingList = self.settingList + [{'window': 80}]
+        resultList = engine.runSettingList(ChannelStrategy, settingList, 'capital')
+        self.assertEqual(engine.runCount, 1)
+        self.assertEqual(resultList[:3], expected)
+
+        # 其他目标名称分别缓存
+        engine.runSettingList(ChannelStrategy, settingList, 'totalResult')
+        self.assertEqual(engine.runCount, 5)
+
+    #----------------------------------------------------------------------
+    def testKeyChanges(self):
+        """回测设置或数据改变后重新回测"""
+        engine = self.makeEngine()
+        engine.runSettingList(ChannelStrategy, self.settingList, 'capital')
+
+        engine = self.makeEngine()
+        engine.setSlippage(2)
+        engine.runSettingList(ChannelStrategy, self.settingList, 'capital')
+        self.assertEqual(engine.runCount, 3)
+
+        self.docs[-1]['close'] += 1
+        writeDataSource(self.root, 'rb', self.docs)
+        engine = self.makeEngine()
+        engine.runSettingList(ChannelStrategy, self.settingList, 'capital')
+        self.assertEqual(engine.runCount, 3)
+
+    #----------------------------------------------------------------------
+    def testParallelUsesCache(self):
+        """多进程优化读取和写入同一个缓存"""
+        engine = self.makeEngine()
+        expected = engine.runSettingList(ChannelStrategy, self.settingList, 'capital')
+
+        settingList = self.settingList + [{'window': 80}]
+        resultList = engine.runParallelSettingList(ChannelStrategy, settingList, 'capital')
+        self.assertEqual(resultList[:3], expected)
+
+        engine = self.makeEngine()
+        self.assertEqual(sorted(engine.runSettingList(ChannelStrategy, settingList, 'capital')),
+                         sorted(resultList))
+        self.assertEqual(engine.runCount, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+# encoding: UTF-8
+
+"""
+压缩Tick存储的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy import ctaTickStore
+from vnpy.trader.app.ctaStrategy.ctaTickStore import (TickStore, encodeTickArrays, decodeTickArrays,
+                                                      tickDocsToArrays, TICK_FIELDS,
+                                                      TICK_PRICE_FIELDS, TICK_VOLUME_FIELDS)
+
+from dataHelper import makeTickArrays, PRICE_TICK
+
+
+DBL_MAX = 1.7976931348623157e308
+
+
+########################################################################
+class TickStoreTest(unittest.TestCase):
+    """TickStore的测试"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """约三天半的Tick数据"""
+        self.root = tempfile.mkdtemp()
+        self.store = TickStore(self.root)
+        self.arrays = makeTickArrays(datetime(2017, 1, 3), 100000)
+        self.store.writeTickArrays('rb', self.arrays, {'vtSymbol': 'rb', 'priceTick': PRICE_TICK})
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除存储目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def testEncodeDecodeRoundTrip(self):
+        """编码后解码得到原来的数据"""
+        decoded = decodeTickArrays(encodeTickArrays(self.arrays, PRICE_TICK), PRICE_TICK)
+        for name in TICK_FIELDS:
+            np.testing.assert_array_equal(decoded[name], self.arrays[name])
+
+    #----------------------------------------------------------------------
+    def testInvalidValues(self):
+        """NaN、DBL_MAX和缺失的数值记为0"""
+        docs = []
+        for i in range(3):
+            d = dict((name, float(self.arrays[name][i])) for name in TICK_PRICE_FIELDS + TICK_VOLUME_FIELDS)
+            d['datetime'] = self.arrays['datetime'][i].item()
+            docs.append(d)
+        docs[0]['askPrice1'] = DBL_MAX
+        docs[1]['bidPrice1'] = float('nan')
+        del docs[2]['upperLimit']
+        docs[2]['lowerLimit'] = None
+
+        arrays = tickDocsToArrays(docs)
+        decoded = decodeTickArrays(encodeTickArrays(arrays, PRICE_TICK), PRICE_TICK)
+        self.assertEqual(decoded['askPrice1'][0], 0)
+        self.assertEqual(decoded['bidPrice1'][1], 0)
+        self.assertEqual(decoded['upperLimit'][2], 0)
+        self.assertEqual(decoded['lowerLimit'][2], 0)
+        self.assertEqual(decoded['lastPrice'].tolist(), self.arrays['lastPrice'][:3].tolist())
+
+        # 直接写入的列数据同样处理
+        arrays['askPrice1'][1] = DBL_MAX
+        decoded = decodeTickArrays(encodeTickArrays(arrays, PRICE_TICK), PRICE_TICK)
+        self.assertEqual(decoded['askPrice1'][1], 0)
+
+    #----------------------------------------------------------------------
+    def testLoadRange(self):
+        """按精确的时间截取区间"""
+        start = datetime(2017, 1, 3, 12)
+        end = datetime(2017, 1, 5, 6)
+        arrays, info = self.store.loadTickArrays('rb', start, end)
+
+        datetimes = self.arrays['datetime']
+        mask = (datetimes >= np.datetime64(start, 'us')) & (datetimes <= np.datetime64(end, 'us'))
+        for name in TICK_FIELDS:
+            np.testing.assert_array_equal(arrays[name], self.arrays[name][mask])
+        self.assertEqual(info['priceTick'], PRICE_TICK)
+
+    #----------------------------------------------------------------------
+    def testLoadFields(self):
+        """只载入指定的字段"""
+        arrays, info = self.store.loadTickArrays('rb', datetime(2017, 1, 3), None, ['lastPrice'])
+        self.assertEqual(sorted(arrays.keys()), ['datetime', 'lastPrice'])
+        np.testing.assert_array_equal(arrays['lastPrice'], self.arrays['lastPrice'])
+
+    #----------------------------------------------------------------------
+    def testIterTicksDecodesOneDayAtATime(self):
+        """逐日回放时每次只解码一个分区，回放结果和一次性载入一致"""
+        decodeCount = [0]
+        decode = ctaTickStore.decodeTickArrays
+
+        def countingDecode(*args):
+            decodeCount[0] += 1
+            return decode(*args)
+
+        ctaTickStore.decodeTickArrays = countingDecode
+        try:
+            ticks = self.store.iterTicks('rb', datetime(2017, 1, 3))
+            first = next(ticks)
+            self.assertEqual(decodeCount[0], 1)
+
+            tickList = [first] + list(ticks)
+            self.assertEqual(decodeCount[0], len(self.store.listDays('rb')))
+        finally:
+            ctaTickStore.decodeTickArrays = decode
+
+        self.assertEqual(len(tickList), len(self.arrays['datetime']))
+        self.assertEqual(tickList[-1].datetime, self.arrays['datetime'][-1].item())
+        self.assertEqual([t.lastPrice for t in tickList], self.arrays['lastPrice'].tolist())
+        self.assertEqual(tickList[0].vtSymbol, 'rb')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# encoding: UTF-8
+
+"""
+成交和委托记录的测试
+"""
+
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from vnpy.trader.vtConstant import (DIRECTION_LONG, DIRECTION_SHORT, OFFSET_OPEN, OFFSET_CLOSE,
+                                    STATUS_ALLTRADED, STATUS_CANCELLED)
+from vnpy.trader.app.ctaStrategy.ctaBase import STOPORDERPREFIX, STOPORDER_TRIGGERED, STOPORDER_CANCELLED
+from vnpy.trader.app.ctaStrategy.ctaTradeLedger import (TradeLedger, OrderLedger, LedgerDictView,
+                                                        LedgerTrade, LedgerOrder)
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine, ChannelStrategy
+
+
+########################################################################
+class LedgerTest(unittest.TestCase):
+    """记录的追加、查找和遍历"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """Constructor"""
+        self.start = datetime(2017, 1, 3, 9)
+
+    #----------------------------------------------------------------------
+    def makeOrder(self, orderID, minutes, status=STATUS_ALLTRADED, cancelMinutes=None):
+        """第minutes分钟发出的委托"""
+        cancelDt = None
+        if cancelMinutes is not None:
+            cancelDt = self.start + timedelta(minutes=cancelMinutes)
+        return LedgerOrder('rb', str(orderID), DIRECTION_LONG, OFFSET_OPEN, 3000.0 + orderID, 1,
+                           status, self.start + timedelta(minutes=minutes), 1, cancelDt)
+
+    #----------------------------------------------------------------------
+    def testTradeRoundTrip(self):
+        """成交记录生成的对象和原成交一致"""
+        ledger = TradeLedger()
+        tradeList = []
+        for i in range(1, 2500):
+            trade = LedgerTrade('rb', str(i), str(i * 2), [DIRECTION_LONG, DIRECTION_SHORT][i % 2],
+                                [OFFSET_OPEN, OFFSET_CLOSE][i % 2], 3000.0 + i, 1.0,
+                                self.start + timedelta(minutes=i))
+            tradeList.append(trade)
+            ledger.appendTrade(trade)
+
+        view = LedgerDictView(ledger)
+        self.assertEqual(len(view), len(tradeList))
+        self.assertEqual(view.keys(), [trade.tradeID for trade in tradeList])
+        for trade, stored in zip(tradeList, view.values()):
+            self.assertEqual((stored.tradeID, stored.orderID, stored.direction, stored.offset,
+                              stored.price, stored.volume, stored.dt),
+                             (trade.tradeID, trade.orderID, trade.direction, trade.offset,
+                              trade.price, trade.volume, trade.dt))
+        self.assertEqual(view['1234'].tradeTime, str(self.start + timedelta(minutes=1234)))
+
+    #----------------------------------------------------------------------
+    def testOrderLookup(self):
+        """委托按结束顺序追加，按编号查找和遍历"""
+        ledger = OrderLedger()
+        for orderID in [3, 1, 7, 2, 5]:
+            ledger.appendOrder(self.makeOrder(orderID, orderID))
+
+        # 尚未结束的委托
+        workingDict = {'4': self.makeOrder(4, 4, STATUS_CANCELLED),
+                       '6': self.makeOrder(6, 6, STATUS_CANCELLED)}
+        view = LedgerDictView(ledger, workingDict)
+
+        self.assertEqual(len(view), 7)
+        self.assertEqual(view.keys(), ['1', '2', '3', '4', '5', '6', '7'])
+        self.assertEqual([order.price for order in view.values()], [3001.0 + i for i in range(7)])
+        self.assertTrue(view['6'] is workingDict['6'])
+        self.assertEqual(view['5'].dt, self.start + timedelta(minutes=5))
+
+        for key in ['8', '0', 'x', None]:
+            self.assertFalse(key in view)
+            self.assertRaises(KeyError, view.__getitem__, key)
+
+        # 追加之后重新排序
+        ledger.appendOrder(self.makeOrder(0, 0))
+        self.assertEqual(view['0'].price, 3000.0)
+        self.assertEqual(view.keys()[0], '0')
+
+    #----------------------------------------------------------------------
+    def testOrderTimes(self):
+        """发单、撤单和停止单触发时间"""
+        ledger = OrderLedger(STOPORDERPREFIX)
+        triggered = self.makeOrder(1, 1, STOPORDER_TRIGGERED)
+        triggered.orderID = STOPORDERPREFIX + '1'
+        triggered.triggerDt = self.start + timedelta(minutes=3)
+        cancelled = self.makeOrder(2, 2, STOPORDER_CANCELLED, cancelMinutes=5)
+        cancelled.orderID = STOPORDERPREFIX + '2'
+        ledger.appendOrder(triggered)
+        ledger.appendOrder(cancelled)
+
+        view = LedgerDictView(ledger)
+        order = view[STOPORDERPREFIX + '1']
+        self.assertEqual(order.status, STOPORDER_TRIGGERED)
+        self.assertEqual(order.triggerTime, str(self.start + timedelta(minutes=3)))
+        self.assertEqual(order.cancelTime, '')
+
+        order = view[STOPORDERPREFIX + '2']
+        self.assertEqual(order.status, STOPORDER_CANCELLED)
+        self.assertEqual(order.orderTime, str(self.start + timedelta(minutes=2)))
+        self.assertEqual(order.cancelTime, str(self.start + timedelta(minutes=5)))
+        self.assertEqual(order.triggerTime, '')
+
+
+########################################################################
+class EngineLedgerTest(unittest.TestCase):
+    """回测引擎中记录的停止单时间"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """K线数据"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeBarDocs(datetime(2017, 1, 2), 6000))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def testStopOrderTimes(self):
+        """停止单记录撤单或触发的时间，触发时间和对应成交的时间相同"""
+        engine = makeEngine(self.root, 'rb')
+        engine.initStrategy(ChannelStrategy, {'stopOffset': 3})
+        engine.runBacktesting()
+
+        tradeTimes = set([trade.dt for trade in engine.tradeDict.values()])
+        stopOrderList = engine.stopOrderDict.values()
+        statusList = [so.status for so in stopOrderList]
+        self.assertTrue(statusList.count(STOPORDER_TRIGGERED) > 5)
+        self.assertTrue(statusList.count(STOPORDER_CANCELLED) > 5)
+
+        for so in stopOrderList:
+            if so.status == STOPORDER_TRIGGERED:
+                self.assertTrue(so.cancelDt is None)
+                self.assertTrue(so.triggerDt > so.dt)
+                self.assertTrue(so.triggerDt in tradeTimes)
+            elif so.status == STOPORDER_CANCELLED:
+                self.assertTrue(so.triggerDt is None)
+                self.assertTrue(so.cancelDt > so.dt)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+# encoding: UTF-8
+
+"""
+向量化回测的测试
+"""
+
+from __future__ import division
+
+import random
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from vnpy.trader.app.ctaStrategy.ctaVectorBacktesting import (VectorStrategyTemplate, windowMean, windowAtr,
+                                                              checkVectorParity, LONG_ENTRY, SHORT_ENTRY,
+                                                              LONG_PRICE, SHORT_PRICE, LONG_EXIT, SHORT_EXIT)
+
+from dataHelper import makeBarDocs, writeDataSource, makeEngine
+
+try:
+    import talib
+except ImportError:
+    talib = None
+
+
+#----------------------------------------------------------------------
+def makeGapDocs(n, gapRate, seed=1):
+    """
+    在随机游走的K线中加入跳空，使部分入场限价单不能立即成交；
+    持仓量持续增加，使openRatioModi经常超过KkRatioStrategy的入场阈值
+    """
+    docs = makeBarDocs(datetime(2017, 1, 2), n, 'rb', seed)
+    rng = random.Random(seed)
+    shift = 0
+    openInterest = 100000.0
+    for d in docs:
+        if rng.random() < gapRate:
+            shift += rng.choice([-1, 1]) * rng.randint(20, 40)
+        for name in ('open', 'high', 'low', 'close'):
+            d[name] += shift
+        openInterest += rng.randint(-50, 300)
+        d['openInterest'] = openInterest
+    return docs
+
+
+########################################################################
+class BreakoutStrategy(VectorStrategyTemplate):
+    """测试用的通道突破策略，收盘价回到均线时出场"""
+    className = 'BreakoutStrategy'
+
+    channelLength = 10      # 通道的K线数量
+    entryOffset = 2         # 入场限价相对收盘价的距离，为负时入场单需要等待回调
+
+    paramList = VectorStrategyTemplate.paramList + ['channelLength', 'entryOffset']
+
+    #----------------------------------------------------------------------
+    def calculateSignals(self, bars):
+        """收盘价突破之前channelLength根K线的最高（低）收盘价时入场"""
+        close = bars['close']
+        n = self.channelLength
+        upper = np.full(len(close), np.nan)
+        lower = np.full(len(close), np.nan)
+        mid = np.full(len(close), np.nan)
+        for i in range(n, len(close)):
+            upper[i] = close[i-n:i].max()
+            lower[i] = close[i-n:i].min()
+            mid[i] = close[i-n:i].mean()
+
+        with np.errstate(invalid='ignore'):
+            return {LONG_ENTRY: close > upper,
+                    SHORT_ENTRY: close < lower,
+                    LONG_EXIT: close < mid,
+                    SHORT_EXIT: close > mid,
+                    LONG_PRICE: close + self.entryOffset,
+                    SHORT_PRICE: close - self.entryOffset}
+
+
+########################################################################
+class WindowIndicatorTest(unittest.TestCase):
+    """滑动窗口指标和在缓存数组上逐个计算的结果完全一致"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """随机价格"""
+        rng = np.random.RandomState(1)
+        self.close = 3000 + rng.rand(80) * 50
+        self.high = self.close + rng.rand(80) * 10
+        self.low = self.close - rng.rand(80) * 10
+
+    #----------------------------------------------------------------------
+    def testWindowMean(self):
+        """和talib.MA一样先累加前period个值，之后逐个减去最早的值再加上新的值"""
+        period, window = 15, 18
+        expected = []
+        for t in range(window - 1, len(self.close)):
+            buf = self.close[t-window+1:t+1]
+            total = 0.0
+            for v in buf[:period]:
+                total += v
+            for i in range(period, window):
+                total -= buf[i-period]
+                total += buf[i]
+            expected.append(total / period)
+
+        result = windowMean(self.close, period, window)
+        self.assertTrue(np.isnan(result[:window-1]).all())
+        self.assertEqual(list(result[window-1:]), expected)
+
+        if talib:
+            self.assertEqual(list(result[window-1:]),
+                             [talib.MA(self.close[t-window+1:t+1], period)[-1]
+                              for t in range(window - 1, len(self.close))])
+
+    #----------------------------------------------------------------------
+    def testWindowAtr(self):
+        """和talib.ATR一样以前period个真实波幅的均值为起点做Wilder平滑"""
+        period, window = 15, 18
+        high, low, close = self.high, self.low, self.close
+        expected = []
+        for t in range(window - 1, len(close)):
+            h, l, c = high[t-window+1:t+1], low[t-window+1:t+1], close[t-window+1:t+1]
+            tr = [max(h[i] - l[i], abs(h[i] - c[i-1]), abs(l[i] - c[i-1])) for i in range(1, window)]
+            atr = 0.0
+            for v in tr[:period]:
+                atr += v
+            atr /= period
+            for v in tr[period:]:
+                atr = (atr * (period - 1) + v) / period
+            expected.append(atr)
+
+        result = windowAtr(high, low, close, period, window)
+        self.assertEqual(list(result[window-1:]), expected)
+
+        if talib:
+            self.assertEqual(list(result[window-1:]),
+                             [talib.ATR(high[t-window+1:t+1], low[t-window+1:t+1], close[t-window+1:t+1],
+                                        period)[-1]
+                              for t in range(window - 1, len(close))])
+
+
+########################################################################
+class VectorParityTest(unittest.TestCase):
+    """向量化回测和事件回测的成交一致"""
+
+    #----------------------------------------------------------------------
+    def setUp(self):
+        """有跳空的K线"""
+        self.root = tempfile.mkdtemp()
+        writeDataSource(self.root, 'rb', makeGapDocs(6000, 0.2))
+
+    #----------------------------------------------------------------------
+    def tearDown(self):
+        """删除数据目录"""
+        shutil.rmtree(self.root)
+
+    #----------------------------------------------------------------------
+    def createEngine(self):
+        """回测引擎"""
+        engine = makeEngine(self.root, 'rb', '20170103', '20170106')
+        engine.output = lambda content: None
+        return engine
+
+    #----------------------------------------------------------------------
+    def runVector(self, strategyClass, setting):
+        """向量化回测，返回成交列表"""
+        engine = self.createEngine()
+        engine.initStrategy(strategyClass, setting)
+        engine.runVectorBacktesting()
+        return engine.tradeDict.values()
+
+    #----------------------------------------------------------------------
+    def testTemplateParity(self):
+        """入场单挂单等待、持仓叠加、出场信号和止损的成交一致"""
+        for setting in [{},
+                        {'entryOffset': -3, 'trailingPrcnt': 0.3},
+                        {'entryOffset': -8, 'channelLength': 5, 'fixedCutLoss': 0.1, 'barOffset': 0}]:
+            consistent, eventTime, vectorTime = checkVectorParity(self.createEngine, BreakoutStrategy, setting)
+            self.assertTrue(consistent, setting)
+
+            tradeList = self.runVector(BreakoutStrategy, setting)
+            self.assertTrue(len(tradeList) > 50)
+
+        # 持仓叠加后停止单数量为全部持仓
+        self.assertTrue(max([trade.volume for trade in tradeList]) > 1)
+
+    #----------------------------------------------------------------------
+    @unittest.skipUnless(talib, 'talib is not installed')
+    def testKkRatioParity(self):
+        """KkRatioVectorStrategy的向量化回测和KkRatioStrategy的事件回测成交一致"""
+        from vnpy.trader.app.ctaStrategy.strategyFiveminCta import KkRatioStrategy, KkRatioVectorStrategy
+
+        for setting in [{'kkDevUp': 0.2, 'kkDevDown': 0.2},
+                        {'kkDevUp': 0.0, 'kkDevDown': 0.0, 'trailingPrcnt': 0.2, 'fixedCutLoss': 0.1}]:
+            consistent, eventTime, vectorTime = checkVectorParity(self.createEngine, KkRatioVectorStrategy,
+                                                                  setting, KkRatioStrategy)
+            self.assertTrue(consistent, setting)
+            self.assertTrue(len(self.runVector(KkRatioVectorStrategy, setting)) > 50)
+
+
+if __name__ == '__main__':
+    unittest.main()